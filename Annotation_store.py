@@ -0,0 +1,541 @@
+import os
+import csv
+import ast
+import json
+import sqlite3
+import argparse
+from Csv_journal import Csv_journal, repair_csv
+
+# crop.csv columns before the image question columns
+CROP_COLUMNS = [
+    "group_id",
+    "image_filename",
+    "rotation_degrees",
+    "upperleft_x", "upperleft_y",
+    "lowerright_x", "lowerright_y",
+    "flip_state",
+    "logo_filename",
+    "rotation_degrees_detail",
+    "upperleft_x_detail", "upperleft_y_detail",
+    "lowerright_x_detail", "lowerright_y_detail",
+    "flip_state_detail"
+]
+# columns of the whole image crop and of the detail crop in a crop row
+NR_WHOLE_COLUMNS = 8
+NR_DETAIL_COLUMNS = 7
+
+
+class Csv_store:
+    """
+    Stores the annotations in groups.csv and crop.csv in the output path.
+
+    This is the interface used by Group_tagger and Cropper, Sqlite_store
+    implements the same methods:
+        - get_last_group: name and position (None if not known) of the last
+          tagged group, IndexError if none
+        - create: removes the old annotations and starts new ones
+        - open: gets ready to write, call after get_last_group or create
+        - write_group: answers of one group and its position in Image_list
+        - write_crop: the whole image crop, the answers and the detail crop
+          (None if skipped) of one image
+        - close
+
+    Rows are appended as soon as they are written, the last group is also
+    kept in a small checkpoint file so that resuming does not read the whole
+    groups.csv.
+
+    A read_only store (eg. for exporting) only reads the files, it does not
+    repair them and cannot be created or opened for writing.
+    """
+
+    def __init__(self, output_path, group_question_names,
+                 image_question_names, fsync_every=20,
+                 checkpoint_filename='checkpoint.json', read_only=False):
+        self.group_csv = os.path.join(output_path, "groups.csv")
+        self.crop_csv = os.path.join(output_path, "crop.csv")
+        self.checkpoint_path = os.path.join(output_path, checkpoint_filename)
+        self.group_question_names = group_question_names
+        self.image_question_names = image_question_names
+        self.fsync_every = fsync_every
+        self.read_only = read_only
+        self.group_journal = None
+        self.crop_journal = None
+        if read_only:
+            return
+        # a crash can leave a partial last row, the checkpoint can then be
+        # ahead of groups.csv
+        if repair_csv(self.group_csv):
+            remove_file(self.checkpoint_path)
+        # the detail crop columns are left out if it was skipped
+        repair_csv(self.crop_csv, NR_DETAIL_COLUMNS)
+
+    def get_filename(self):
+        return 'groups.csv'
+
+    def get_last_group(self):
+        try:
+            return read_checkpoint(self.checkpoint_path)
+        except (IOError, ValueError):
+            pass
+        last_group_name = None
+        try:
+            with open(self.group_csv, 'r') as csv_file:
+                for row in csv.DictReader(csv_file):
+                    last_group_name = row["group_id"]
+        except IOError:
+            pass
+        if last_group_name is None:
+            raise IndexError('ERROR: no groups in ' + self.group_csv)
+        return last_group_name, None
+
+    def create(self):
+        check_writable(self)
+        self.close()
+        remove_file(self.checkpoint_path)
+        write_csv(self.group_csv,
+                  get_group_columns(self.group_question_names), [])
+        write_csv(self.crop_csv,
+                  get_crop_columns(self.image_question_names), [])
+
+    def open(self):
+        check_writable(self)
+        if self.group_journal is None:
+            self.group_journal = Csv_journal(self.group_csv, self.fsync_every)
+            self.crop_journal = Csv_journal(self.crop_csv, self.fsync_every)
+
+    def write_group(self, group_id, answers, position):
+        self.group_journal.write_row(make_group_row(group_id, answers))
+        write_checkpoint(self.checkpoint_path, group_id, position)
+
+    def write_crop(self, whole, answers, detail=None):
+        self.crop_journal.write_row(make_crop_row(whole, answers, detail))
+
+    def close(self):
+        if self.group_journal is not None:
+            self.group_journal.close()
+            self.crop_journal.close()
+            self.group_journal = None
+            self.crop_journal = None
+
+    #### reading #######################################################
+
+    def get_question_names(self):
+        """
+        returns the group and image question names from the csv headers
+        """
+        return (read_header(self.group_csv)[1:],
+                read_header(self.crop_csv)[len(CROP_COLUMNS):])
+
+    def iter_groups(self):
+        """
+        yields (group_id, answers) in the order they were tagged
+        """
+        for row in read_rows(self.group_csv):
+            yield row[0], [parse_group_answer(cell) for cell in row[1:]]
+
+    def iter_crops(self):
+        """
+        yields (whole, answers, detail) in the order they were written,
+        values are strings as read from the csv
+        """
+        nr_answers = len(self.get_question_names()[1])
+        for row in read_rows(self.crop_csv):
+            end = NR_WHOLE_COLUMNS + nr_answers
+            detail = row[end:end + NR_DETAIL_COLUMNS]
+            yield (row[:NR_WHOLE_COLUMNS],
+                   row[NR_WHOLE_COLUMNS:end],
+                   detail if len(detail) > 0 else None)
+
+
+class Sqlite_store:
+    """
+    Stores the annotations in a SQLite database in the output path, same
+    interface as Csv_store.
+
+    Answers are kept as JSON lists so commas or quotes in open ended answers
+    are safe. The database uses WAL mode so that committing every row is
+    cheap, groups and crops are indexed by group_id and crops also by
+    image_filename. export_csv writes groups.csv and crop.csv in the same
+    layout as Csv_store.
+
+    A read_only store does not create the database if it is missing, does not
+    change its settings and cannot be created or opened for writing.
+    """
+
+    def __init__(self, path, group_question_names, image_question_names,
+                 read_only=False):
+        self.path = path
+        self.group_question_names = group_question_names
+        self.image_question_names = image_question_names
+        self.read_only = read_only
+        if read_only and not os.path.isfile(path):
+            raise IOError('ERROR: no database ' + path)
+        self.connection = sqlite3.connect(path)
+        # group and file names are byte strings (from the folder walk), with
+        # str as text_factory they can be written and are read back as str
+        # like Csv_store gives them. Unicode answers are stored as utf-8
+        self.connection.text_factory = str
+        if read_only:
+            return
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # in WAL mode a crash cannot corrupt the database with NORMAL, only
+        # the last commits can be lost on power failure
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+
+    def get_filename(self):
+        return os.path.basename(self.path)
+
+    def get_last_group(self):
+        try:
+            row = self.connection.execute(
+                'SELECT group_id, position FROM groups '
+                'ORDER BY id DESC LIMIT 1'
+            ).fetchone()
+        except sqlite3.OperationalError:
+            # no tables yet
+            row = None
+        if row is None:
+            raise IndexError('ERROR: no groups in ' + self.path)
+        return row[0], row[1]
+
+    def create(self):
+        check_writable(self)
+        with self.connection:
+            self.connection.executescript(CREATE_TABLES)
+            self.connection.executemany(
+                'INSERT INTO meta VALUES (?, ?)',
+                [('group_question_names',
+                  json.dumps(self.group_question_names)),
+                 ('image_question_names',
+                  json.dumps(self.image_question_names))])
+
+    def open(self):
+        check_writable(self)
+
+    def write_group(self, group_id, answers, position):
+        with self.connection:
+            self.connection.execute(
+                'INSERT INTO groups (group_id, position, answers) '
+                'VALUES (?, ?, ?)',
+                (group_id, position, json.dumps(answers)))
+
+    def write_crop(self, whole, answers, detail=None):
+        if detail is None:
+            detail = [None] * NR_DETAIL_COLUMNS
+        values = ([to_sql_value(value) for value in whole] +
+                  [json.dumps(answers)] +
+                  [to_sql_value(value) for value in detail])
+        with self.connection:
+            self.connection.execute(
+                'INSERT INTO crops (' + ', '.join(CROP_TABLE_COLUMNS) +
+                ') VALUES (' + ', '.join(['?'] * len(values)) + ')',
+                values)
+
+    def close(self):
+        self.connection.close()
+
+    #### lookups and export ############################################
+
+    def get_group(self, group_id):
+        """
+        returns the answers of the group as a list, None if it was not tagged
+        """
+        row = self.connection.execute(
+            'SELECT answers FROM groups WHERE group_id = ? '
+            'ORDER BY id DESC LIMIT 1', (group_id,)).fetchone()
+        if row is None:
+            return None
+        return load_answers(row[0])
+
+    def get_crops(self, group_id=None, image_filename=None):
+        """
+        returns (whole, answers, detail) of the crops of the group and/or
+        image, as passed to write_crop
+        """
+        conditions = []
+        values = []
+        if group_id is not None:
+            conditions.append('group_id = ?')
+            values.append(group_id)
+        if image_filename is not None:
+            conditions.append('image_filename = ?')
+            values.append(image_filename)
+        query = 'SELECT ' + ', '.join(CROP_TABLE_COLUMNS) + ' FROM crops'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY id'
+        return [from_crop_record(record)
+                for record in self.connection.execute(query, values)]
+
+    def get_question_names(self):
+        """
+        returns the group and image question names the database was created
+        with
+        """
+        meta = dict(self.connection.execute('SELECT key, value FROM meta'))
+        return (json.loads(meta['group_question_names']),
+                json.loads(meta['image_question_names']))
+
+    def iter_groups(self):
+        """
+        yields (group_id, answers) in the order they were tagged
+        """
+        for group_id, answers in self.connection.execute(
+                'SELECT group_id, answers FROM groups ORDER BY id'):
+            yield group_id, load_answers(answers)
+
+    def iter_crops(self):
+        """
+        yields (whole, answers, detail) in the order they were written
+        """
+        for record in self.connection.execute(
+                'SELECT ' + ', '.join(CROP_TABLE_COLUMNS) +
+                ' FROM crops ORDER BY id'):
+            yield from_crop_record(record)
+
+    def export_csv(self, output_path):
+        """
+        writes groups.csv and crop.csv to output_path, in the layout used by
+        Csv_store
+        """
+        group_question_names, image_question_names = \
+            self.get_question_names()
+        write_csv(
+            os.path.join(output_path, "groups.csv"),
+            get_group_columns(group_question_names),
+            (make_group_row(group_id, answers)
+             for group_id, answers in self.iter_groups()))
+        write_csv(
+            os.path.join(output_path, "crop.csv"),
+            get_crop_columns(image_question_names),
+            (make_crop_row(*crop) for crop in self.iter_crops()))
+
+
+CREATE_TABLES = '''
+DROP TABLE IF EXISTS groups;
+DROP TABLE IF EXISTS crops;
+DROP TABLE IF EXISTS meta;
+CREATE TABLE groups (
+    id INTEGER PRIMARY KEY,
+    group_id TEXT NOT NULL,
+    position INTEGER,
+    answers TEXT NOT NULL
+);
+CREATE INDEX groups_group_id ON groups (group_id);
+CREATE TABLE crops (
+    id INTEGER PRIMARY KEY,
+    group_id TEXT NOT NULL,
+    image_filename TEXT NOT NULL,
+    rotation_degrees TEXT,
+    upperleft_x INTEGER, upperleft_y INTEGER,
+    lowerright_x INTEGER, lowerright_y INTEGER,
+    flip_state INTEGER,
+    answers TEXT NOT NULL,
+    logo_filename TEXT,
+    rotation_degrees_detail TEXT,
+    upperleft_x_detail INTEGER, upperleft_y_detail INTEGER,
+    lowerright_x_detail INTEGER, lowerright_y_detail INTEGER,
+    flip_state_detail INTEGER
+);
+CREATE INDEX crops_group_id ON crops (group_id);
+CREATE INDEX crops_image_filename ON crops (image_filename);
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+# crops table columns in crop row order, answers in between
+CROP_TABLE_COLUMNS = (CROP_COLUMNS[:NR_WHOLE_COLUMNS] + ['answers'] +
+                      CROP_COLUMNS[NR_WHOLE_COLUMNS:])
+
+
+def make_store(backend, output_path, group_question_names,
+               image_question_names, fsync_every=20,
+               checkpoint_filename='checkpoint.json',
+               sqlite_filename='annotations.db', read_only=False):
+    """
+    returns the annotation store for the backend ('csv' or 'sqlite')
+    """
+    if backend == 'csv':
+        return Csv_store(output_path, group_question_names,
+                         image_question_names, fsync_every,
+                         checkpoint_filename, read_only)
+    elif backend == 'sqlite':
+        return Sqlite_store(os.path.join(output_path, sqlite_filename),
+                            group_question_names, image_question_names,
+                            read_only)
+    raise ValueError('unknown storage backend: ' + str(backend))
+
+
+def check_writable(store):
+    """
+    raises IOError if the store was opened read only
+    """
+    if store.read_only:
+        raise IOError('ERROR: ' + store.get_filename() +
+                      ' is opened read only')
+
+
+def get_group_columns(group_question_names):
+    return ['group_id'] + list(group_question_names)
+
+
+def get_crop_columns(image_question_names):
+    return CROP_COLUMNS + list(image_question_names)
+
+
+def make_group_row(group_id, answers):
+    """
+    the groups.csv row, every answer is written as a one element list
+    """
+    return [group_id] + [[answer] for answer in answers]
+
+
+def make_crop_row(whole, answers, detail=None):
+    """
+    the crop.csv row: whole image crop, answers, detail crop if not skipped
+    """
+    return list(whole) + list(answers) + list(detail or [])
+
+
+def from_crop_record(record):
+    """
+    splits a crops table record into (whole, answers, detail), detail is None
+    if the detail crop was skipped
+    """
+    whole = list(record[:NR_WHOLE_COLUMNS])
+    answers = load_answers(record[NR_WHOLE_COLUMNS])
+    detail = list(record[NR_WHOLE_COLUMNS + 1:])
+    if detail[0] is None:
+        detail = None
+    return whole, answers, detail
+
+
+def load_answers(text):
+    """
+    reads the JSON list of answers, ascii answers are given back as str like
+    the ones read from the GUI
+    """
+    answers = json.loads(text)
+    for idx, answer in enumerate(answers):
+        try:
+            answers[idx] = answer.encode('ascii')
+        except (AttributeError, UnicodeError):
+            pass
+    return answers
+
+
+def to_sql_value(value):
+    """
+    converts numpy numbers to python ones, sqlite cannot store them
+    """
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def write_csv(path, column_names, rows):
+    with open(path, 'wb') as csv_file:
+        writer_obj = csv.writer(csv_file,
+                                delimiter=',',
+                                quotechar='',
+                                quoting=csv.QUOTE_NONE)
+        writer_obj.writerow(column_names)
+        writer_obj.writerows(rows)
+
+
+def read_header(path):
+    with open(path, 'rb') as csv_file:
+        for row in csv.reader(csv_file, quoting=csv.QUOTE_NONE):
+            return row
+    return []
+
+
+def read_rows(path):
+    """
+    yields the rows of the csv file after the header
+    """
+    with open(path, 'rb') as csv_file:
+        reader = csv.reader(csv_file, quoting=csv.QUOTE_NONE)
+        next(reader, None)
+        for row in reader:
+            yield row
+
+
+def parse_group_answer(cell):
+    """
+    groups.csv answers are written as one element lists: "['red']" -> 'red'
+    """
+    try:
+        value = ast.literal_eval(cell)
+    except (ValueError, SyntaxError):
+        return cell
+    if isinstance(value, list) and len(value) == 1:
+        return value[0]
+    return cell
+
+
+def read_checkpoint(path):
+    """
+    returns the name and the position of the last finished group from the
+    checkpoint file, the position is None in old checkpoints. The name is
+    given back as the str (utf-8 bytes) it was written as, like the folder
+    names Image_list gets from the walk. Raises IOError if there is no
+    checkpoint and ValueError if it is broken
+    """
+    with open(path, 'r') as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    try:
+        group_name = checkpoint['group_name']
+        position = checkpoint.get('position')
+    except (KeyError, TypeError, AttributeError):
+        raise ValueError('ERROR: broken checkpoint file ' + path)
+    if not isinstance(group_name, basestring) or \
+            not (position is None or isinstance(position, (int, long))):
+        raise ValueError('ERROR: broken checkpoint file ' + path)
+    if isinstance(group_name, unicode):
+        group_name = group_name.encode('utf-8')
+    return group_name, position
+
+
+def write_checkpoint(path, group_name, position):
+    """
+    records the last finished group. If the file cannot be written (or the
+    name is not utf-8, json cannot store it) the old one is removed so that
+    it is not trusted and groups.csv is read instead
+    """
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump({'group_name': group_name, 'position': position},
+                      checkpoint_file)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
+    except (IOError, OSError, UnicodeError):
+        remove_file(temp_path)
+        remove_file(path)
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description='exports a SQLite annotation database to groups.csv and '
+        'crop.csv')
+    argparser.add_argument(
+        '--database', '-d', required=True,
+        help='path to the database, annotations.db in the output path')
+    argparser.add_argument(
+        '--output_path', '-o', required=True,
+        help='where to write groups.csv and crop.csv')
+    args = argparser.parse_args()
+
+    store = Sqlite_store(args.database, None, None, read_only=True)
+    store.export_csv(args.output_path)
+    store.close()
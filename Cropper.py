@@ -2,13 +2,94 @@ import os
 import math
 from PIL import Image, ImageTk, ImageDraw
 import cv2
+import numpy as np
 from pylab import *
 import Tkinter as tk
 import re
 import tkMessageBox
-import csv
 import rotate_image as rotate
+import geometry
 import Question
+from Image_preloader import Image_preloader
+from Image_writer import Image_writer
+from Image_cache import Image_cache
+from Tiled_view import Tiled_view, build_pyramid
+from config import (CROP_WRITER_WORKERS, CROP_WRITER_QUEUE_SIZE,
+                    CROP_WRITE_PARAMS, DETAIL_ZOOM_LEVEL, CROPPER_WIDTH,
+                    CROPPER_HEIGHT, CROPPER_MAX_ZOOM, CROPPER_TILE_SIZE,
+                    CROPPER_CACHE_SIZE)
+
+ZOOM_STEP = 1.25
+
+
+def prepare_image(path):
+    """
+    reads the image and prepares it for display: converts it from openCV to
+    RGB and builds the pyramid of the view. The image is not flipped, the
+    view and the crops apply the flip.
+    Does not create Tkinter objects, so it can run outside of the Tk thread
+    returns a tuple (raw openCV image, image pyramid for Tiled_view)
+    """
+    raw_image = cv2.imread(path, 1)
+    return (raw_image, prepare_pyramid(raw_image))
+
+
+def prepare_pyramid(raw_image):
+    """
+    converts the openCV image to RGB and builds the pyramid of the view
+    """
+    image = cv2.cvtColor(raw_image, cv2.COLOR_BGR2RGB)
+    return build_pyramid(image, CROPPER_TILE_SIZE)
+
+
+def flip_pyramid(pyramid):
+    """
+    returns the levels flipped left to right, as views without copying
+    """
+    return [level[:, ::-1] for level in pyramid]
+
+
+def crop_rectangle(raw_image, corners, angle_radians, flip):
+    """
+    cuts the drawn rectangle out of the image. Does not need the window, so
+    it can run outside of the GUI (eg. in benchmark.py).
+    corners are the corners of the rectangle in raw image pixels as drawn on
+    the (flipped if flip is True) image, turned by angle_radians. The crop is
+    taken from the image rotated by the angle, so only the crop is rotated
+    and the flip is applied to the crop only
+    returns a tuple (crop, upperleft, lowerright), the corners of the crop
+    are in pixels of the rotated image and inside of it
+    """
+    height, width = raw_image.shape[0:2]
+    angle_degrees = -math.degrees(angle_radians)
+    if angle_radians != 0:
+        # the corners as offsets from the center, rotated back and put around
+        # the center of the rotated image
+        rotated_height, rotated_width = rotate.get_rotated_size(raw_image,
+                                                                angle_degrees)
+        points = geometry.offset_points(corners, (width / 2, height / 2))
+        points = geometry.rotate_points(points, (0, 0), -angle_radians)
+        points = geometry.round_half_away(
+            points + (rotated_width / 2, rotated_height / 2))
+        upperleft, lowerright = geometry.bounding_corners(points.astype(int))
+    else:
+        rotated_height, rotated_width = height, width
+        upperleft, lowerright = geometry.bounding_corners(corners)
+        upperleft = np.floor(upperleft)
+        lowerright = np.ceil(lowerright)
+    upperleft = tuple(int(value) for value in np.maximum(upperleft, 0))
+    lowerright = tuple(int(value) for value in
+                       np.minimum(lowerright, (rotated_width, rotated_height)))
+    if angle_radians != 0:
+        crop = rotate.rotate_region(raw_image, angle_degrees, upperleft,
+                                    lowerright, flip)
+    else:
+        if flip:
+            raw_image = raw_image[:, ::-1]
+        crop = raw_image[upperleft[1]:lowerright[1],
+                         upperleft[0]:lowerright[0]]
+    return (np.ascontiguousarray(crop), upperleft, lowerright)
+
 
 class Cropper:
     """
@@ -16,15 +97,24 @@ class Cropper:
     first you crop the whole_image
     then you crop (optionally) a detail, these are saved as image_detail.jpg in
     the designated output path.
+
+    preloaded is an optional dict of images already prepared by prepare_image:
+    {(path,): (raw_image, pyramid)}
+    preload_size is the nr of upcoming images prepared in the background
+
+    zoom_factor is the starting zoom, the mouse wheel zooms (with shift or
+    control it pans, with alt it resizes the rectangle). The rectangle is
+    drawn in canvas coords, which are the raw image pixels times the zoom
     """
 
     def __init__(self, window, question_definitions, image_paths, output_path,
-                 crop_csv, event_name, flip, zoom_factor):
+                 store, event_name, flip, zoom_factor, preloaded=None,
+                 preload_size=0):
         # initializing globals that don't change
         self.window = window
         self.image_paths = image_paths[:]
         self.directory = output_path
-        self.crop_csv = crop_csv
+        self.store = store
         self.event_name = event_name
         # initializing global variables
         self.whole_image = True
@@ -43,8 +133,18 @@ class Cropper:
         # rotation constants
         self.start_angle = 0
         self.angle = 0
+        # [save path, image name, crop data, answers] of every crop, they are
+        # written once the detail crop is done or skipped
         self.cropped_images = []
-        self.rows_to_write = []
+        self.current_crop = None
+        self.preloaded = dict(preloaded or {})
+        self.preloader = Image_preloader(prepare_image, preload_size)
+        # path: decoded image, the shown image and the crops, so the detail
+        # cropper does not read the files again
+        self.image_cache = Image_cache(CROPPER_CACHE_SIZE)
+        # crops are saved in the background
+        self.writer = Image_writer(CROP_WRITER_WORKERS, CROP_WRITER_QUEUE_SIZE)
+        self.window.protocol("WM_DELETE_WINDOW", self.close_window)
 
         # adding buttons for controlling the cropper
         self.destroybutton = tk.Button(self.window,
@@ -93,10 +193,21 @@ class Cropper:
         # binding keys and mouse actions
         self.window.bind("<space>", self.space_handler)
         self.window.bind("<Key>", self.keypress_handler)
-        self.window.bind("<MouseWheel>", self.mousewheel_handler)
-        self.window.bind("<Shift-MouseWheel>", self.shift_mousewheel_handler)
-        self.window.bind("<Control-MouseWheel>",
-                         self.control_mousewheel_handler)
+        self.bind_mousewheel("", self.mousewheel_handler)
+        self.bind_mousewheel("Shift-", self.shift_mousewheel_handler)
+        self.bind_mousewheel("Control-", self.control_mousewheel_handler)
+        self.bind_mousewheel("Alt-", self.alt_mousewheel_handler)
+        self.bind_mousewheel("Alt-Shift-", self.alt_shift_mousewheel_handler)
+        self.bind_mousewheel("Alt-Control-",
+                             self.alt_control_mousewheel_handler)
+
+    def bind_mousewheel(self, modifiers, handler):
+        """
+        binds the mouse wheel with the modifiers, e.g. "Shift-" (Button-4 and
+        Button-5 are the wheel on X11)
+        """
+        for event in ["MouseWheel", "Button-4", "Button-5"]:
+            self.window.bind("<" + modifiers + event + ">", handler)
 
     def run(self):
         # running the first image
@@ -112,6 +223,8 @@ class Cropper:
         images list self.current_image is the filename of the image currently
         being processed
         """
+        # only the crop of the previous image is needed later
+        self.image_cache.remove(getattr(self, 'current_load_path', None))
         self.current_load_path = self.image_paths.pop(0)
         self.current_image = os.path.split(self.current_load_path)[1]
 
@@ -156,43 +269,45 @@ class Cropper:
 
     def load_image(self):
         """
-        loads the active image and does the transformations
-        flips it if the flag is true
-        """
-        # loading image
-        self.raw_image = cv2.imread(self.current_load_path, 1)
-        # flipping it if flip flag is true
-        if self.flip:
-            self.raw_image = cv2.flip(self.raw_image, 1)
-        # converting from openCV format to PIL format
-        b, g, r = cv2.split(self.raw_image)
-        self.image = cv2.merge((r, g, b))
-        if self.zoom_factor is not 1:
-            self.image = cv2.resize(self.image,
-                                    dsize=None,
-                                    fx=self.zoom_factor,
-                                    fy=self.zoom_factor,
-                                    interpolation=cv2.INTER_NEAREST)
-        self.image = Image.fromarray(self.image)
-        self.image_width = self.image.size[0]
-        self.image_height = self.image.size[1]
-        # converting to Tkinter format
-        self.image_tk = ImageTk.PhotoImage(image=self.image)
+        loads the active image, the flip is applied when drawing and cropping
+        """
+        # using the preloaded image if there is one
+        key = (self.current_load_path,)
+        prepared = self.preloaded.pop(key, None)
+        if prepared is None:
+            prepared = self.preloader.get(key)
+        if prepared is None:
+            raw_image = self.image_cache.get(self.current_load_path)
+            if raw_image is not None:
+                prepared = (raw_image, prepare_pyramid(raw_image))
+        if prepared is None:
+            if not self.whole_image:
+                # the crop is read from disk only if it was not kept
+                self.writer.flush()
+                self.report_write_errors()
+            prepared = prepare_image(*key)
+        self.raw_image, self.pyramid = prepared
+        self.image_cache.put(self.current_load_path, self.raw_image)
+        # size of the shown image in raw pixels
+        self.image_height, self.image_width = self.raw_image.shape[0:2]
+        # preparing the next images while this one is cropped
+        if self.whole_image:
+            self.preloader.preload([(path,) for path in self.image_paths])
 
     def draw_image(self):
         """
         loads and draws the image on the canvas
         """
-        # destroying old canvas, except at beginning when it doesn't exists
+        # reusing the canvas, except at beginning when it doesn't exist
+        # (or if it was destroyed with the rest of the widgets)
         try:
-            self.canvas.destroy()
-        except AttributeError:
-            pass
-        # setting up new canvas
-        self.canvas = tk.Canvas(self.window,
-                                width=self.image_width,
-                                height=self.image_height)
-        self.canvas.grid(row=0, column=0, columnspan=2)
+            self.canvas.delete(tk.ALL)
+        except (AttributeError, tk.TclError):
+            self.canvas = tk.Canvas(self.window)
+            self.canvas.grid(row=0, column=0, columnspan=2)
+            # dragging with the middle button pans
+            self.canvas.bind("<Button-2>", self.button2_click_handler)
+            self.canvas.bind("<B2-Motion>", self.button2_drag_handler)
         if self.whole_image:
             self.canvas.bind("<Button-1>", self.click_handler)
             self.canvas.bind("<B1-Motion>", self.drag_handler)
@@ -205,22 +320,27 @@ class Cropper:
             self.canvas.bind("<B1-Motion>", self.detail_drag_handler)
             self.canvas.bind("<ButtonRelease-1>", self.detail_release_handler)
         self.window.wm_title(self.current_load_path)
-        # drawing image
-        self.canvas.create_image(0, 0, image = self.image_tk, anchor = tk.NW)
+        # drawing the tiles of the image in view
+        pyramid = self.pyramid
+        if self.flip:
+            pyramid = flip_pyramid(pyramid)
+        self.view = Tiled_view(self.canvas, pyramid, self.zoom_factor,
+                               (CROPPER_WIDTH, CROPPER_HEIGHT),
+                               CROPPER_TILE_SIZE)
 
     def flip_image(self):
         """
         flips the image vertically (left to right)
-        works by re-loading the image with the flip = True param and redrawing it
+        works by redrawing the loaded image with flipped views, the image
+        itself is flipped only when it is cropped
         """
         # remove rotation line and redraw image, if it exists
         try:
             self.remove_drawings()
         except AttributeError:
             pass
-        # set global flip to True and load image again
+        # toggle the global flip and draw the image again
         self.flip = not self.flip
-        self.load_image()
         self.draw_image()
 
     ############ drawing ##################################
@@ -230,11 +350,12 @@ class Cropper:
         first click is saved as the first point of the rectangle
         if rectangle exists, click will re-position the rectangle
         """
+        x, y = self.get_canvas_coords(event)
         if self.rect_x1 == None:
-            self.rect_x1 = event.x
-            self.rect_y1 = event.y
+            self.rect_x1 = x
+            self.rect_y1 = y
         else:
-            self.redraw_rectangle((event.x, event.y))
+            self.redraw_rectangle((x, y))
 
     def redraw_rectangle(self, new_center):
         """
@@ -260,9 +381,10 @@ class Cropper:
         """
         draws a rectangle and a helpline
         """
+        x, y = self.get_canvas_coords(event)
         if self.continue_drag:
-            self.rect_x2 = event.x
-            self.rect_y2 = event.y
+            self.rect_x2 = x
+            self.rect_y2 = y
             rectangle_points = [(self.rect_x1, self.rect_y1),
             (self.rect_x1, self.rect_y2),
             (self.rect_x2, self.rect_y2),
@@ -275,7 +397,7 @@ class Cropper:
             self.rect_final_point3 = (self.rect_x2, self.rect_y2)
             self.rect_final_point4 = (self.rect_x2, self.rect_y1)
         else:
-            self.redraw_rectangle((event.x, event.y))
+            self.redraw_rectangle((x, y))
 
     def release_handler(self, event):
         """
@@ -375,58 +497,37 @@ class Cropper:
                                                     self.line_left_point2[1],
                                                     fill = "Red", dash = 3)
         else:
-            new_line_bot_point1 = self.rotate_point(self.line_bot_point1[0],
-                                                     self.line_bot_point1[1],
-                                                     self.center_rectangle,
-                                                     self.angle)
-            new_line_bot_point2 = self.rotate_point(self.line_bot_point2[0],
-                                                     self.line_bot_point2[1],
-                                                     self.center_rectangle,
-                                                     self.angle)
-            new_line_right_point1 = self.rotate_point(self.line_right_point1[0],
-                                                     self.line_right_point1[1],
-                                                     self.center_rectangle,
-                                                     self.angle)
-            new_line_right_point2 = self.rotate_point(self.line_right_point2[0],
-                                                     self.line_right_point2[1],
-                                                     self.center_rectangle,
-                                                     self.angle)
-            new_line_top_point1 = self.rotate_point(self.line_top_point1[0],
-                                                     self.line_top_point1[1],
-                                                     self.center_rectangle,
-                                                     self.angle)
-            new_line_top_point2 = self.rotate_point(self.line_top_point2[0],
-                                                     self.line_top_point2[1],
-                                                     self.center_rectangle,
-                                                     self.angle)
-            new_line_left_point1 = self.rotate_point(self.line_left_point1[0],
-                                                     self.line_left_point1[1],
-                                                     self.center_rectangle,
-                                                     self.angle)
-            new_line_left_point2 = self.rotate_point(self.line_left_point2[0],
-                                                     self.line_left_point2[1],
-                                                     self.center_rectangle,
-                                                     self.angle)
-            self.line_bot = self.canvas.create_line(new_line_bot_point1[0],
-                                                    new_line_bot_point1[1],
-                                                    new_line_bot_point2[0],
-                                                    new_line_bot_point2[1],
+            # rotating all the helpline points at once
+            points = geometry.rotate_points([self.line_bot_point1,
+                                             self.line_bot_point2,
+                                             self.line_right_point1,
+                                             self.line_right_point2,
+                                             self.line_top_point1,
+                                             self.line_top_point2,
+                                             self.line_left_point1,
+                                             self.line_left_point2],
+                                            self.center_rectangle,
+                                            self.angle).tolist()
+            self.line_bot = self.canvas.create_line(points[0][0],
+                                                    points[0][1],
+                                                    points[1][0],
+                                                    points[1][1],
                                                     fill = "Red", dash = 3)
-            self.line_right = self.canvas.create_line(new_line_right_point1[0],
-                                                      new_line_right_point1[1],
-                                                      new_line_right_point2[0],
-                                                      new_line_right_point2[1],
-                                                      fill = "Red", dash = 3)
-            self.line_top = self.canvas.create_line(new_line_top_point1[0],
-                                                      new_line_top_point1[1],
-                                                      new_line_top_point2[0],
-                                                      new_line_top_point2[1],
-                                                      fill = "Red", dash = 3)
-            self.line_left = self.canvas.create_line(new_line_left_point1[0],
-                                                      new_line_left_point1[1],
-                                                      new_line_left_point2[0],
-                                                      new_line_left_point2[1],
+            self.line_right = self.canvas.create_line(points[2][0],
+                                                      points[2][1],
+                                                      points[3][0],
+                                                      points[3][1],
                                                       fill = "Red", dash = 3)
+            self.line_top = self.canvas.create_line(points[4][0],
+                                                    points[4][1],
+                                                    points[5][0],
+                                                    points[5][1],
+                                                    fill = "Red", dash = 3)
+            self.line_left = self.canvas.create_line(points[6][0],
+                                                     points[6][1],
+                                                     points[7][0],
+                                                     points[7][1],
+                                                     fill = "Red", dash = 3)
 
     ############ rotating the rectangle ######################################
 
@@ -450,7 +551,7 @@ class Cropper:
             # angle_change is the offset from the initial click to the last drag
             self.angle_change = ((self.rect_rotate_stop_y -
                                  self.rect_rotate_start_y) /
-                                 float(self.image.size[1] / 2))
+                                 float(self.view.get_size()[1] / 2))
             # the start angle is stored in a global var
             # so you can continue changing the angle from where you left off
             self.angle = self.angle_change + self.start_angle
@@ -481,22 +582,17 @@ class Cropper:
             - rotation always starts from the initial coords
             - redraws the rectangle
         """
-        self.rect_final_point1 = self.rotate_point(self.rect_x1,
-                                                   self.rect_y1,
-                                                   self.center_rectangle,
-                                                   self.angle)
-        self.rect_final_point2 = self.rotate_point(self.rect_x2,
-                                                   self.rect_y1,
-                                                   self.center_rectangle,
-                                                   self.angle)
-        self.rect_final_point3 = self.rotate_point(self.rect_x2,
-                                                   self.rect_y2,
-                                                   self.center_rectangle,
-                                                   self.angle)
-        self.rect_final_point4 = self.rotate_point(self.rect_x1,
-                                                   self.rect_y2,
-                                                   self.center_rectangle,
-                                                   self.angle)
+        corners = geometry.rectangle_corners(self.rect_x1,
+                                             self.rect_y1,
+                                             self.rect_x2,
+                                             self.rect_y2)
+        corners = geometry.rotate_points(corners,
+                                         self.center_rectangle,
+                                         self.angle).tolist()
+        self.rect_final_point1 = tuple(corners[0])
+        self.rect_final_point2 = tuple(corners[1])
+        self.rect_final_point3 = tuple(corners[2])
+        self.rect_final_point4 = tuple(corners[3])
         self.canvas.delete(self.boundary)
         self.draw_rectangle([self.rect_final_point1,
                             self.rect_final_point2,
@@ -531,17 +627,93 @@ class Cropper:
         rotates the given x and y coords around the center
         for use in coordinate systems where upperleft corner is 0, 0
         """
-        x -= center[0]
-        y -= center[1]
-        _x = x * math.cos(angle_radians) + y * math.sin(angle_radians)
-        _y = -x * math.sin(angle_radians) + y * math.cos(angle_radians)
-        return _x + center[0], _y + center[1]
+        return tuple(geometry.rotate_points((x, y), center,
+                                            angle_radians).tolist())
 
     def mousewheel_handler(self, event):
+        """
+        zooms in or out around the mouse pointer
+        """
+        if get_wheel_delta(event) > 0:
+            factor = ZOOM_STEP
+        else:
+            factor = 1 / ZOOM_STEP
+        if event.widget is self.canvas:
+            self.zoom(factor, event.x, event.y)
+        else:
+            self.zoom(factor)
+
+    def shift_mousewheel_handler(self, event):
+        """
+        pans the image horizontally
+        """
+        if get_wheel_delta(event) > 0:
+            self.canvas.xview_scroll(-1, 'units')
+        else:
+            self.canvas.xview_scroll(1, 'units')
+        self.view.draw()
+
+    def control_mousewheel_handler(self, event):
+        """
+        pans the image vertically
+        """
+        if get_wheel_delta(event) > 0:
+            self.canvas.yview_scroll(-1, 'units')
+        else:
+            self.canvas.yview_scroll(1, 'units')
+        self.view.draw()
+
+    def button2_click_handler(self, event):
+        self.canvas.scan_mark(event.x, event.y)
+
+    def button2_drag_handler(self, event):
+        """
+        pans the image by dragging with the middle button
+        """
+        self.canvas.scan_dragto(event.x, event.y, gain=1)
+        self.view.draw()
+
+    def zoom(self, factor, x=None, y=None):
+        """
+        zooms the image by factor around the canvas widget coords x, y, the
+        drawings are scaled along
+        """
+        fit_zoom = min(CROPPER_WIDTH / float(self.image_width),
+                       CROPPER_HEIGHT / float(self.image_height))
+        zoom_factor = max(min(fit_zoom, 1.0, self.zoom_factor),
+                          min(CROPPER_MAX_ZOOM, self.zoom_factor * factor))
+        if zoom_factor == self.zoom_factor:
+            return
+        ratio = zoom_factor / float(self.zoom_factor)
+        self.zoom_factor = zoom_factor
+        self.view.set_zoom(zoom_factor, x, y)
+        # the drawings are in canvas coords
+        if self.rect_x1 is not None:
+            self.rect_x1 = self.rect_x1 * ratio
+            self.rect_y1 = self.rect_y1 * ratio
+        if self.rect_x2 is not None:
+            self.rect_x2 = self.rect_x2 * ratio
+            self.rect_y2 = self.rect_y2 * ratio
+            self.center_rectangle = (self.center_rectangle[0] * ratio,
+                                     self.center_rectangle[1] * ratio)
+            self.rotate_rectangle()
+            self.draw_helpline()
+        if not self.whole_image and self.rotation_state:
+            if self.line1 is not None:
+                self.line1 = (self.line1[0] * ratio, self.line1[1] * ratio)
+            if self.line2 is not None:
+                self.line2 = (self.line2[0] * ratio, self.line2[1] * ratio)
+                self.canvas.delete(self.rotation_line)
+                self.rotation_line = self.canvas.create_line(
+                    self.line1[0], self.line1[1],
+                    self.line2[0], self.line2[1],
+                    fill="Red")
+
+    def alt_mousewheel_handler(self, event):
         """
         resizes the bounding rectangle and redraws helplines
         """
-        offset = event.delta / 60
+        offset = get_wheel_delta(event) / 60
         self.rect_x1 = self.rect_x1 - offset
         self.rect_y1 = self.rect_y1 - offset
         self.rect_x2 = self.rect_x2 + offset
@@ -549,21 +721,21 @@ class Cropper:
         self.rotate_rectangle()
         self.draw_helpline()
 
-    def shift_mousewheel_handler(self, event):
+    def alt_shift_mousewheel_handler(self, event):
         """
         resizes the width of the bounding rectangle
         """
-        offset = event.delta / 60
+        offset = get_wheel_delta(event) / 60
         self.rect_x1 = self.rect_x1 - offset
         self.rect_x2 = self.rect_x2 + offset
         self.rotate_rectangle()
         self.draw_helpline()
 
-    def control_mousewheel_handler(self, event):
+    def alt_control_mousewheel_handler(self, event):
         """
         resizes the height of the bounding rectangle
         """
-        offset = event.delta / 60
+        offset = get_wheel_delta(event) / 60
         self.rect_y1 = self.rect_y1 - offset
         self.rect_y2 = self.rect_y2 + offset
         self.rotate_rectangle()
@@ -571,6 +743,13 @@ class Cropper:
 
     ############ helper functions ######################################
 
+    def get_canvas_coords(self, event):
+        """
+        returns the canvas coords of the event, they differ from the widget
+        coords when the image is scrolled
+        """
+        return (self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+
     def calc_rect_center(self):
         """
         calculates the center of the rectangle
@@ -587,11 +766,8 @@ class Cropper:
         transforms points as offset from center
         returns a list of tuples
         """
-        transformed_points = []
-        for point in point_list:
-            point = (point[0] - center[0], point[1] - center[1])
-            transformed_points.append(point)
-        return transformed_points
+        return [tuple(point) for point
+                in geometry.offset_points(point_list, center).tolist()]
 
     ############### cropping and storing data #####################################
 
@@ -606,32 +782,24 @@ class Cropper:
         self.rect_x2 = int(self.rect_x2)
         self.rect_y2 = int(self.rect_y2)
 
-        # if there was rotation, rotate
+        # if there was rotation, the rotated corners are used, else the
+        # initial coords. The drawn points are on the zoomed image
         if self.angle != 0:
-            self.rotated_raw_image = rotate.rotate_image(self.raw_image,
-                                                    -math.degrees(self.angle),
-                                                    cv2.INTER_AREA)
-            upperleft, lowerright = self.get_crop_boundary()
-        # else use the original image and the initial coords
+            corners = [self.rect_final_point1, self.rect_final_point2,
+                       self.rect_final_point3, self.rect_final_point4]
         else:
-            self.rotated_raw_image = self.raw_image
-            upperleft, lowerright = self.enforce_corners([(self.rect_x1, self.rect_y1),
-                                                         (self.rect_x2, self.rect_y2)])
-
-        upperleft, lowerright = self.correct_for_outside_boundary(upperleft, lowerright)
-        cropped = self.rotated_raw_image[
-            upperleft[1]:lowerright[1],
-            upperleft[0]:lowerright[0]
-        ]
-        # saving the crop
-        if not os.path.exists(self.directory):
-            os.makedirs(self.directory)
+            corners = [(self.rect_x1, self.rect_y1),
+                       (self.rect_x2, self.rect_y2)]
+        corners = np.array(corners, dtype=float) / self.zoom_factor
+        cropped, upperleft, lowerright = crop_rectangle(
+            self.raw_image, corners, self.angle, self.flip)
+        # saving the crop, the detail cropper uses the one in memory
         save_path = (os.path.join(self.directory, self.current_image))
-        cv2.imwrite(save_path, cropped)
-        # cropped images are added to a list for the detail_cropper later to use
-        self.cropped_images.append([save_path, self.current_image])
+        self.image_cache.put(save_path, cropped)
+        self.writer.write(save_path, cropped, CROP_WRITE_PARAMS)
+        self.report_write_errors()
         # save the crop data
-        row_to_write = (
+        crop_data = (
             [self.event_name] +
             [self.current_image] +
             ["{0:.2f}".format(round(-math.degrees(self.angle), 2))] +
@@ -641,39 +809,11 @@ class Cropper:
             [int(lowerright[1])] +
             [int(self.flip)]
         )
-        for question in self.questions:
-            row_to_write.append(question.get_answer())
-        self.rows_to_write.append(row_to_write)
-
-    def get_crop_boundary(self):
-        """
-        returns the crop boundary
-            - starts with the initial non-rotated coords
-            - defines them as offset from the center
-            - calculates the coords given the offset on the rotated image
-        """
-        height, width = self.raw_image.shape[0:2]
-        center_original = (width / 2 * self.zoom_factor,
-                           height / 2 * self.zoom_factor)
-        rect_original = self.transform_points([self.rect_final_point1,
-                                              self.rect_final_point2,
-                                              self.rect_final_point3,
-                                              self.rect_final_point4],
-                                              center_original)
-        # rotating the bounding box around its center
-        # adding the offset from the center of the rotated img
-        height, width = self.rotated_raw_image.shape[0:2]
-        center_rotated = (width / 2 * self.zoom_factor,
-                          height / 2 * self.zoom_factor)
-        new_points = []
-        for point in rect_original:
-            new_point = self.rotate_point(point[0], point[1],
-                                          (0, 0), -self.angle)
-            new_point = (int(round(new_point[0] + center_rotated[0])),
-                         int(round(new_point[1] + center_rotated[1])))
-            new_points.append(new_point)
-        upperleft, lowerright = self.enforce_corners(new_points)
-        return(upperleft, lowerright)
+        answers = [question.get_answer() for question in self.questions]
+        # cropped images are added to a list for the detail_cropper later to
+        # use, together with their data
+        self.cropped_images.append([save_path, self.current_image,
+                                    crop_data, answers])
 
     def check_data_input(self):
         """
@@ -696,18 +836,8 @@ class Cropper:
         returns the furthest upperleft and lowerright point from the list
         returns a list of two tuples: [(x1, y1), (x2, y2)]
         """
-        upperleft = [99999, 99999]
-        lowerright = [0, 0]
-        for point in point_list:
-            if point[0] < upperleft[0]:
-                upperleft[0] = point[0]
-            if point[1] < upperleft[1]:
-                upperleft[1] = point[1]
-            if point[0] > lowerright[0]:
-                lowerright[0] = point[0]
-            if point[1] > lowerright[1]:
-                lowerright[1] = point[1]
-        return [tuple(upperleft), tuple(lowerright)]
+        upperleft, lowerright = geometry.bounding_corners(point_list)
+        return [tuple(upperleft.tolist()), tuple(lowerright.tolist())]
 
     def parse_image_order(self):
         """
@@ -777,6 +907,9 @@ class Cropper:
         if len(self.cropped_images) == 0:
              self.detail_write_and_exit()
              return
+        # no more whole images to load
+        self.preloader.close()
+        self.report_write_errors()
         # destroys all widgets from whole image Cropper
         for widget in self.window.winfo_children():
             widget.destroy()
@@ -784,9 +917,7 @@ class Cropper:
         self.whole_image = False
         # image globals, vertical flip and zoom
         self.flip = False
-        self.zoom_factor = 2
-        # detail order, for csv writing
-        self.detail_order = 0
+        self.zoom_factor = DETAIL_ZOOM_LEVEL
         # globals related to the crop boundary box
         # if below is true, you can draw the box
         self.continue_drag = True
@@ -838,8 +969,11 @@ class Cropper:
         pops the next image path and sets up the new image name (current_image)
         """
         path_and_name = self.cropped_images.pop(0)
+        self.image_cache.remove(self.current_load_path)
         self.current_load_path = path_and_name[0]
         self.current_image = path_and_name[1].replace("_shoe", "_detail")
+        # whole image crop, answers, detail crop
+        self.current_crop = [path_and_name[2], path_and_name[3], None]
 
     def detail_next_image(self):
         """
@@ -850,6 +984,7 @@ class Cropper:
         # if bounding box drawn, crop
         if self.rect_x1 is not None and self.rect_x2 is not None:
             self.detail_crop_image()
+        self.write_current_crop()
         # if no images left, exit
         if len(self.cropped_images) == 0:
             self.detail_write_and_exit()
@@ -866,6 +1001,7 @@ class Cropper:
         skips the image and draws the next one
         if no images left, writes the data in the csv and ends the program
         """
+        self.write_current_crop()
         # if no images left, exit
         if len(self.cropped_images) == 0:
             self.detail_write_and_exit()
@@ -882,7 +1018,7 @@ class Cropper:
         # define the crop boundary
         upperleft, lowerright = self.enforce_corners([(self.rect_x1, self.rect_y1),
                                                       (self.rect_x2, self.rect_y2)])
-        upperleft, lowerright = self.detail_correct_for_zoom(upperleft, lowerright)
+        upperleft, lowerright = self.correct_for_zoom(upperleft, lowerright)
         upperleft, lowerright = self.correct_for_outside_boundary(upperleft, lowerright)
         # crop the image
         cropped = self.rotated_raw_image[
@@ -899,12 +1035,12 @@ class Cropper:
                           [lowerright[0]] +
                           [lowerright[1]] +
                           [int(self.flip)])
-        self.rows_to_write[self.detail_order].extend(data_to_append)
-        self.detail_order += 1
+        self.current_crop[2] = data_to_append
 
         # saving the cropped image
         save_path = os.path.join(self.directory, filename)
-        cv2.imwrite(save_path, cropped)
+        self.writer.write(save_path, cropped, CROP_WRITE_PARAMS)
+        self.report_write_errors()
 
     def set_rotation_state(self):
         """
@@ -946,16 +1082,57 @@ class Cropper:
         self.draw_image()
 
     def detail_write_and_exit(self):
-        if len(self.rows_to_write) != 0:
-            csv_file = open(self.crop_csv, 'ab')
-            writer_obj = csv.writer(csv_file,
-                                    delimiter = ',',
-                                    quotechar = '',
-                                    quoting=csv.QUOTE_NONE)
-            writer_obj.writerows(self.rows_to_write)
+        self.preloader.close()
+        self.image_cache.clear()
+        # waiting for all crops to be saved
+        self.writer.close()
+        self.report_write_errors()
+        # the images not detail cropped yet are written without detail
+        self.write_pending_crops()
         # destroying the window
         self.window.destroy()
 
+    def close_window(self):
+        """
+        called when the window is closed, saves the queued crops and their
+        data first
+        """
+        self.preloader.close()
+        self.image_cache.clear()
+        self.writer.close()
+        self.report_write_errors()
+        self.write_pending_crops()
+        self.window.destroy()
+
+    def write_current_crop(self):
+        """
+        stores the data of the current detail image, it is final once the
+        detail crop is done or skipped
+        """
+        if self.current_crop is not None:
+            self.store.write_crop(*self.current_crop)
+            self.current_crop = None
+
+    def write_pending_crops(self):
+        """
+        stores the data of all crops that are not stored yet, without detail
+        """
+        self.write_current_crop()
+        for path_and_name in self.cropped_images:
+            self.store.write_crop(path_and_name[2], path_and_name[3])
+        self.cropped_images = []
+
+    def report_write_errors(self):
+        """
+        shows a warning with the crops that could not be saved
+        """
+        errors = self.writer.get_errors()
+        if len(errors) > 0:
+            tkMessageBox.showwarning(
+                "ERROR",
+                "could not save these crops:\n" +
+                "\n".join(path + ": " + str(error) for path, error in errors))
+
     #### handlers ####################################
 
     def detail_space_handler(self, event):
@@ -974,24 +1151,26 @@ class Cropper:
         first click is saved as the first point of the rectangle
         if rectangle exists, click will re-position the rectangle
         """
+        x, y = self.get_canvas_coords(event)
         if self.rotation_state:
             if self.line1 == None:
-                self.line1 = (event.x, event.y)
+                self.line1 = (x, y)
         # if it is not rotation and there is no first point, save it
         else:
             if self.rect_x1 == None:
-                self.rect_x1 = event.x
-                self.rect_y1 = event.y
+                self.rect_x1 = x
+                self.rect_y1 = y
             # if there is a first point, then redraw the rectangle
             else:
-                self.redraw_rectangle((event.x, event.y))
+                self.redraw_rectangle((x, y))
             
     def detail_drag_handler(self, event):
         """
         draws a rectangle and a helpline
         """
+        x, y = self.get_canvas_coords(event)
         if self.rotation_state and self.continue_drag:
-            self.line2 = (event.x, event.y)
+            self.line2 = (x, y)
             try:
                 self.canvas.delete(self.rotation_line)
             except AttributeError:
@@ -1002,12 +1181,12 @@ class Cropper:
                                                          self.line2[1],
                                                          fill = "Red")
         elif not self.rotation_state and self.continue_drag:
-            self.rect_x2 = event.x
-            self.rect_y2 = event.y
+            self.rect_x2 = x
+            self.rect_y2 = y
             self.draw_rectangle()
             self.draw_helpline()
         elif not self.rotation_state and not self.continue_drag:
-            self.redraw_rectangle((event.x, event.y))
+            self.redraw_rectangle((x, y))
 
     def detail_release_handler(self, event):
         """
@@ -1032,31 +1211,25 @@ class Cropper:
                                                            self.line1[1],
                                                            self.line2[0],
                                                            self.line2[1])
-            # the part below could go in a separate method
-            self.raw_image = cv2.imread(self.current_load_path, 1)
-            if self.flip:
-                self.raw_image = cv2.flip(self.raw_image, 1)
+            # the flip is lazy: raw_image is the crop as load_image left it,
+            # not flipped, and the flag is passed on so that rotate_image (like
+            # rotate_region) folds the flip into the warp with flip_source
             self.rotated_raw_image = rotate.rotate_image(self.raw_image,
                                                          self.degrees,
-                                                         cv2.INTER_AREA)
+                                                         cv2.INTER_AREA,
+                                                         self.flip)
             # preparing rotated image for display
-            b, g, r = cv2.split(self.rotated_raw_image)
-            self.rotated_image = cv2.merge((r,g,b))
-            if self.zoom_factor is not 1:
-                self.rotated_image = cv2.resize(self.rotated_image,
-                                                dsize = None,
-                                                fx = self.zoom_factor,
-                                                fy = self.zoom_factor,
-                                                interpolation = cv2.INTER_NEAREST)
-            self.rotated_image = Image.fromarray(self.rotated_image)
-            self.rotated_image_tk = ImageTk.PhotoImage(image = self.rotated_image) 
-            # drawing new canvas with a different size and the image on it
-            self.canvas.destroy()
-            self.canvas = tk.Canvas(self.window,
-                                    width = self.rotated_image.size[0],
-                                    height = self.rotated_image.size[1])
-            self.canvas.create_image(0, 0, image = self.rotated_image_tk, anchor = tk.NW)
-            self.canvas.grid(row = 0, column = 0, columnspan = 2)
+            self.rotated_image = cv2.cvtColor(self.rotated_raw_image,
+                                              cv2.COLOR_BGR2RGB)
+            self.image_height, self.image_width = self.rotated_raw_image.shape[0:2]
+            # drawing the rotated image on the same canvas
+            self.canvas.delete(tk.ALL)
+            self.view = Tiled_view(self.canvas,
+                                   build_pyramid(self.rotated_image,
+                                                 CROPPER_TILE_SIZE),
+                                   self.zoom_factor,
+                                   (CROPPER_WIDTH, CROPPER_HEIGHT),
+                                   CROPPER_TILE_SIZE)
             # adjusting globals
             self.set_crop_state()
             # binding keys to the new canvas
@@ -1081,13 +1254,11 @@ class Cropper:
 
     def correct_for_outside_boundary(self, upperleft, lowerright):
         """
-        sets the coords to image boundaries if they are going outside of them
+        sets the coords to the detail image boundaries if they are going
+        outside of them (crop_rectangle does it for the whole image)
         returns tuple (upperleft, lowerright)
         """
-        if self.whole_image:
-            height, width = self.rotated_raw_image.shape[0:2]
-        else:
-            height, width = self.image_height, self.image_width
+        height, width = self.image_height, self.image_width
         if upperleft[0] < 0:
                 upperleft = (0, upperleft[1])
         if upperleft[1] < 0:
@@ -1098,12 +1269,26 @@ class Cropper:
                 lowerright = (lowerright[0], height)
         return (upperleft, lowerright)
 
-    def detail_correct_for_zoom(self, upperleft, lowerright):
+    def correct_for_zoom(self, upperleft, lowerright):
         """
-        corrects the crop box for the zoom factor
+        corrects the crop box for the zoom factor, from canvas coords to raw
+        image pixels
         """
-        upperleft = (int(math.floor(upperleft[0] / self.zoom_factor)),
-                     int(math.floor(upperleft[1] / self.zoom_factor)))
-        lowerright = (int(math.ceil(lowerright[0] / self.zoom_factor)),
-                      int(math.ceil(lowerright[1] / self.zoom_factor)))
+        zoom_factor = float(self.zoom_factor)
+        upperleft = (int(math.floor(upperleft[0] / zoom_factor)),
+                     int(math.floor(upperleft[1] / zoom_factor)))
+        lowerright = (int(math.ceil(lowerright[0] / zoom_factor)),
+                      int(math.ceil(lowerright[1] / zoom_factor)))
         return [upperleft, lowerright]
+
+
+def get_wheel_delta(event):
+    """
+    returns the mouse wheel delta of the event, positive when scrolling up.
+    X11 sends Button-4 and Button-5 instead
+    """
+    if event.num == 4:
+        return 120
+    if event.num == 5:
+        return -120
+    return event.delta
@@ -0,0 +1,109 @@
+import os
+import csv
+
+
+class Csv_journal:
+    """
+    Keeps a csv file open for appending and writes every row as soon as it is
+    final, so a crash loses at most the row being written.
+
+    Each row is flushed to the OS right away, every fsync_every rows and on
+    close the file is also synced to disk (0 means only on close). If the
+    program died in the middle of a row, call repair_csv before opening the
+    file again.
+    """
+
+    def __init__(self, path, fsync_every=20):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.nr_unsynced = 0
+        self.csv_file = open(path, 'ab')
+        self.writer = csv.writer(self.csv_file,
+                                 delimiter=',',
+                                 quotechar='',
+                                 quoting=csv.QUOTE_NONE)
+
+    def write_row(self, row):
+        self.writer.writerow(row)
+        self.csv_file.flush()
+        self.nr_unsynced += 1
+        if self.fsync_every > 0 and self.nr_unsynced >= self.fsync_every:
+            self.sync()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def sync(self):
+        """
+        makes sure all written rows are on disk
+        """
+        self.csv_file.flush()
+        os.fsync(self.csv_file.fileno())
+        self.nr_unsynced = 0
+
+    def close(self):
+        if self.csv_file.closed:
+            return
+        self.sync()
+        self.csv_file.close()
+
+
+def repair_csv(path, nr_optional_columns=0):
+    """
+    makes sure the file ends with a line ending. A last line without one is
+    complete if it has as many fields as the header, or as many without the
+    last nr_optional_columns, it only gets the line ending. Otherwise the
+    program died while writing it: the partial line is appended to
+    path + '.partial' and removed from the file.
+    Returns True if something was removed
+    """
+    try:
+        csv_file = open(path, 'r+b')
+    except IOError:
+        return False
+    try:
+        csv_file.seek(0, os.SEEK_END)
+        end = csv_file.tell()
+        if end == 0:
+            return False
+        # looking for the last line ending, reading backwards in blocks
+        line_start = 0
+        position = end
+        block_size = 4096
+        while position > 0:
+            start = max(0, position - block_size)
+            csv_file.seek(start)
+            block = csv_file.read(position - start)
+            if position == end and block.endswith('\n'):
+                return False
+            last_newline = block.rfind('\n')
+            if last_newline >= 0:
+                line_start = start + last_newline + 1
+                break
+            position = start
+        csv_file.seek(line_start)
+        line = csv_file.read()
+        if line_start > 0:
+            csv_file.seek(0)
+            nr_columns = count_fields(csv_file.readline())
+            if count_fields(line) in (nr_columns,
+                                      nr_columns - nr_optional_columns):
+                csv_file.seek(end)
+                csv_file.write('\n' if line.endswith('\r') else '\r\n')
+                return False
+        with open(path + '.partial', 'ab') as partial_file:
+            partial_file.write(line + '\n')
+        csv_file.truncate(line_start)
+        return True
+    finally:
+        csv_file.close()
+
+
+def count_fields(line):
+    """
+    returns the nr of fields of a csv line written by Csv_journal
+    """
+    for row in csv.reader([line.rstrip('\r\n')], quoting=csv.QUOTE_NONE):
+        return len(row)
+    return 0
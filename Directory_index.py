@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+from multiprocessing.pool import ThreadPool
+
+# os.scandir is in Python 3.5+, on Python 2 it comes from the scandir package
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+INDEX_VERSION = 1
+FILESYSTEM_ENCODING = sys.getfilesystemencoding() or 'utf-8'
+
+
+class Directory_index:
+    """
+    Lists the images in a directory tree, in the same order as os.walk, and
+    keeps the listing in an index file between runs.
+
+    For every directory the index stores its mtime, its subdirectories and its
+    (sorted) image files. A directory's mtime changes when entries are added,
+    removed or renamed in it, so on the next run only directories with a
+    different mtime are listed again, the rest just need a stat. Top level
+    subdirectories can be walked in parallel, which helps on network shares
+    where every call waits for the server.
+    """
+
+    def __init__(self, directory, extensions, index_path=None, nr_workers=1):
+        self.directory = directory
+        self.extensions = tuple(extensions)
+        self.index_path = index_path
+        self.nr_workers = nr_workers
+        # root: [mtime, subdirectory names, image filenames]
+        self.entries = self.load()
+        self.scanned = {}
+
+    def walk(self):
+        """
+        returns a list of (root, image filenames) for every directory, in
+        os.walk order. Directories that cannot be read are skipped
+        """
+        entry = self.scan(self.directory)
+        if entry is None:
+            return []
+        result = [(self.directory, entry[2])]
+        subdirs = [os.path.join(self.directory, name) for name in entry[1]]
+        if self.nr_workers > 1 and len(subdirs) > 1:
+            pool = ThreadPool(min(self.nr_workers, len(subdirs)))
+            try:
+                for subtree in pool.map(self.walk_tree, subdirs):
+                    result.extend(subtree)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for subdir in subdirs:
+                result.extend(self.walk_tree(subdir))
+        return result
+
+    def save(self):
+        """
+        writes the directories seen by the last walk to the index file.
+        The index is only a cache, failing to write it is not an error
+        """
+        if self.index_path is None:
+            return
+        index = {'version': INDEX_VERSION,
+                 'directory': os.path.abspath(self.directory),
+                 'extensions': list(self.extensions),
+                 'entries': self.scanned}
+        temp_path = self.index_path + '.tmp'
+        try:
+            with open(temp_path, 'w') as index_file:
+                json.dump(index, index_file)
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            os.rename(temp_path, self.index_path)
+        except (IOError, OSError, ValueError, UnicodeError):
+            pass
+
+    #### helper functions ##############################################
+
+    def load(self):
+        """
+        reads the index file, returns an empty index if there is none or it
+        belongs to another directory
+        """
+        if self.index_path is None:
+            return {}
+        try:
+            with open(self.index_path, 'r') as index_file:
+                index = json.load(index_file)
+        except (IOError, OSError, ValueError):
+            return {}
+        if (index.get('version') != INDEX_VERSION or
+                index.get('directory') != os.path.abspath(self.directory) or
+                tuple(index.get('extensions', [])) != self.extensions):
+            return {}
+        entries = {}
+        for root, (mtime, subdirs, images) in index['entries'].items():
+            entries[to_native(root)] = [mtime,
+                                        [to_native(name) for name in subdirs],
+                                        [to_native(name) for name in images]]
+        return entries
+
+    def walk_tree(self, root):
+        """
+        returns a list of (root, image filenames) for root and everything
+        below it, depth first like os.walk
+        """
+        entry = self.scan(root)
+        if entry is None:
+            return []
+        result = [(root, entry[2])]
+        for name in entry[1]:
+            result.extend(self.walk_tree(os.path.join(root, name)))
+        return result
+
+    def iter_walk(self):
+        """
+        yields (root, image filenames) for every directory in the same order
+        as walk, listing each directory only when it is reached
+        """
+        stack = [self.directory]
+        while stack:
+            root = stack.pop()
+            entry = self.scan(root)
+            if entry is None:
+                continue
+            yield root, entry[2]
+            for name in reversed(entry[1]):
+                stack.append(os.path.join(root, name))
+
+    def scan(self, root):
+        """
+        returns [mtime, subdirectories, images] of the directory, from the
+        index if its mtime did not change
+        """
+        try:
+            mtime = os.stat(root).st_mtime
+        except OSError:
+            return None
+        entry = self.entries.get(root)
+        if entry is None or entry[0] != mtime:
+            try:
+                subdirs, files = list_directory(root)
+            except OSError:
+                return None
+            images = sorted(f for f in files if f.endswith(self.extensions))
+            entry = [mtime, subdirs, images]
+        if self.index_path:
+            self.scanned[root] = entry
+        return entry
+
+
+def list_directory(root):
+    """
+    returns (subdirectory names, other names) in listing order, like
+    os.walk symlinks to directories are not followed
+    """
+    subdirs = []
+    files = []
+    if scandir is not None:
+        for entry in scandir(root):
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            else:
+                files.append(entry.name)
+    else:
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                subdirs.append(name)
+            else:
+                files.append(name)
+    return subdirs, files
+
+
+def to_native(name):
+    """
+    json returns unicode, converting back to str like os.walk returns it
+    """
+    if isinstance(name, unicode):
+        return name.encode(FILESYSTEM_ENCODING)
+    return name
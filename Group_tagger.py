@@ -2,12 +2,15 @@ import Tkinter as tk
 import tkMessageBox
 import os
 import time
-import csv
 import sys
 from PIL import Image, ImageTk
 from Montage import *
 from Image_list import *
 from Cropper import *
+from Thumbnail_cache import Thumbnail_cache
+from Image_viewer import Image_viewer
+from Prefetcher import Prefetcher
+from Annotation_store import make_store
 from tkFileDialog import askdirectory
 import Question
 from config import *
@@ -25,7 +28,8 @@ class Group_tagger:
                  image_question_definitions,
                  image_dir,
                  output_path,
-                 size_of_group=None):
+                 size_of_group=None,
+                 stream=False):
 
         if image_dir is None:
             image_dir = askdirectory(
@@ -36,68 +40,57 @@ class Group_tagger:
 
         self.master = master
         self.image_question_definitions = image_question_definitions
-        self.image_list = Image_list(directory=image_dir,
-                                     size_of_group=size_of_group)
+        self.image_list = Image_list(
+            directory=image_dir,
+            size_of_group=size_of_group,
+            index_path=os.path.join(output_path, SCAN_INDEX_FILENAME),
+            scan_workers=SCAN_WORKERS,
+            stream=stream,
+            lookahead=GROUP_LOOKAHEAD)
 
         # creating the crop path
         self.crop_output_path = os.path.join(output_path, 'crop')
         if not os.path.exists(self.crop_output_path):
             os.makedirs(self.crop_output_path)
 
-        # creating the csv paths
-        self.group_csv = os.path.join(output_path, "groups.csv")
-        self.crop_csv = os.path.join(output_path, "crop.csv")
-
-        # opening an old csv file or creating a new one if there isn't any
-        # the tagging will start where the csv file says it left off
+        # montage thumbnails are kept between sessions
+        self.thumbnail_cache = Thumbnail_cache(
+            os.path.join(output_path, THUMBNAIL_CACHE_DIR),
+            THUMBNAIL_CACHE_SIZE)
+        # builds the next montage and the first cropper image in the
+        # background while the user is tagging
+        self.prefetcher = Prefetcher(master, PREFETCH_POLL_INTERVAL)
+        # pop-up window for the originals, keeps recently viewed ones decoded
+        self.viewer = Image_viewer(master, VIEWER_CACHE_SIZE, VIEWER_MAX_ZOOM)
+
+        # groups.csv and crop.csv, or a SQLite database
+        self.store = make_store(
+            STORAGE_BACKEND,
+            output_path,
+            [q['name'] for q in group_question_definitions],
+            [q['name'] for q in self.image_question_definitions],
+            fsync_every=CSV_FSYNC_EVERY,
+            checkpoint_filename=CHECKPOINT_FILENAME,
+            sqlite_filename=SQLITE_FILENAME)
+
+        # opening the old annotations or creating new ones if there aren't any
+        # the tagging will start where the annotations say it left off
         try:
-            csv_file = open(self.group_csv, 'r')
-            reader = csv.DictReader(csv_file)
-            for row in reader:
-                last_group_name = row["group_id"]
-            self.image_list.setup_list(last_group_name)
-            print "MESSAGE: successfully loaded old csv file!\n"
-
-        except (IOError, IndexError, NameError):
-            if raw_input('The program will create a new groups.csv file '
+            last_group_name, position = self.store.get_last_group()
+            self.image_list.setup_list(last_group_name, position)
+            print "MESSAGE: successfully loaded old annotations!\n"
+
+        except IndexError:
+            if raw_input('The program will create a new ' +
+                         self.store.get_filename() + ' file '
                          'and remove others. Do you want to continue?\n'
                          'Type y to continue:') != 'y':
                 sys.exit()
             print "\n"
+            self.store.create()
 
-            csv_file = open(self.group_csv, 'wb')
-            writer_obj = csv.writer(
-                csv_file, delimiter=',', quotechar='', quoting=csv.QUOTE_NONE)
-            column_names = [q['name'] for q in group_question_definitions]
-            column_names.insert(0, 'group_id')
-            writer_obj.writerow(column_names)
-
-            # if no group.csv file, delete old crop.csv and create new
-            try:
-                os.remove(self.crop_csv)
-            except OSError:
-                pass
-            csv_file = open(self.crop_csv, 'wb')
-            writer_obj = csv.writer(csv_file,
-                                    delimiter=',',
-                                    quotechar='',
-                                    quoting=csv.QUOTE_NONE)
-            column_names = [
-                "group_id",
-                "image_filename",
-                "rotation_degrees",
-                "upperleft_x", "upperleft_y",
-                "lowerright_x", "lowerright_y",
-                "flip_state",
-                "logo_filename",
-                "rotation_degrees_detail",
-                "upperleft_x_detail", "upperleft_y_detail",
-                "lowerright_x_detail", "lowerright_y_detail",
-                "flip_state_detail"
-            ]
-            for question_def in self.image_question_definitions:
-                column_names.append(question_def['name'])
-            writer_obj.writerow(column_names)
+        # rows are written as soon as they are final
+        self.store.open()
 
         # location of click when selecting images
         self.shift_x1 = None
@@ -188,6 +181,7 @@ class Group_tagger:
                 "No images left",
                 "do you want to quit? (crop the images first!)"
             ):
+                self.close()
                 self.master.destroy()
             return
         # draw the next image
@@ -201,16 +195,24 @@ class Group_tagger:
         window = tk.Toplevel(self.master)
         window.grab_set()
         window.focus()
+        preloaded = {}
+        key = self.get_cropper_image_key()
+        if key is not None:
+            prepared = self.prefetcher.get('cropper', key)
+            if prepared is not None:
+                preloaded[key] = prepared
         self.cropper = Cropper(
             window,
             self.image_question_definitions,
             self.image_list.get_current_filenames(),
             os.path.join(self.crop_output_path,
                          self.image_list.get_relative_dir()),
-            self.crop_csv,
+            self.store,
             self.image_list.get_current_group(),
             flip,
-            ZOOM_LEVEL)
+            ZOOM_LEVEL,
+            preloaded,
+            CROPPER_PRELOAD_SIZE)
         self.cropper.run()
         self.master.wait_window(window)
 
@@ -245,26 +247,20 @@ class Group_tagger:
         """
         if repeated:
             self.master.wm_title(self.image_list.get_current_group())
-            self.canvas.delete(tk.ALL)
-            self.canvas.create_image(
-                0, 0, image=self.image_tk, anchor=tk.NW)
+            self.hide_marks()
         else:
             self.filenames = self.image_list.get_current_filenames()
-            self.image = Montage(self.filenames,
-                                 (MONTAGE_WIDTH, MONTAGE_HEIGHT),
-                                 (1, 2),
-                                 False)
-            self.image_tk = ImageTk.PhotoImage(self.image.draw_montage())
+            prefetched = self.prefetcher.get('montage', tuple(self.filenames))
+            if prefetched is None:
+                prefetched = self.build_montage(self.filenames)
             try:
-                self.canvas.delete(tk.ALL)
+                # tiles of the previous montage still loading are skipped
+                self.image.close()
             except AttributeError:
-                self.canvas = tk.Canvas(self.master,
-                                        width=self.image.get_size()[0],
-                                        height=self.image.get_size()[1])
-                self.canvas.grid(row=0,
-                                 column=0,
-                                 columnspan=len(self.questions) + 1)
-            self.canvas.create_image(0, 0, image=self.image_tk, anchor=tk.NW)
+                pass
+            self.image, montage_image = prefetched
+            self.show_montage(montage_image)
+            self.hide_marks()
             self.master.wm_title(
                 self.image_list.get_current_group() +
                 ' | ' +
@@ -281,6 +277,224 @@ class Group_tagger:
             index: False for index in range(1, self.image.get_nr_images() + 1)}
         # set shiftclick selection behavior to deselect
         self.deselect = False
+        self.prefetch_next_montage()
+        self.prefetch_cropper_image()
+
+    def show_montage(self, montage_image):
+        """
+        shows the montage (PIL image) on the canvas. The canvas and its image
+        item are created once, later montages are pasted into the same
+        PhotoImage unless the size changed. A virtual montage has no image
+        (None), it is scrolled and only the tiles in view are shown
+        """
+        try:
+            self.canvas
+        except AttributeError:
+            self.create_canvas()
+        # tiles of the previous virtual montage
+        self.canvas.delete('tile')
+        self.tile_items = {}
+        self.canvas.yview_moveto(0)
+        if self.image.is_virtual():
+            if self.montage_item is not None:
+                self.canvas.itemconfigure(self.montage_item,
+                                          state=tk.HIDDEN)
+            width, height = self.image.get_total_size()
+            self.canvas.config(scrollregion=(0, 0, width, height),
+                               yscrollincrement=self.image.get_image_size()[1])
+            self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+            self.update_visible_tiles()
+            return
+        self.scrollbar.pack_forget()
+        self.canvas.config(scrollregion=(0, 0) + montage_image.size)
+        if self.montage_item is not None:
+            self.canvas.itemconfigure(self.montage_item, state=tk.NORMAL)
+        if self.image_tk is not None and \
+                (self.image_tk.width(), self.image_tk.height()) == \
+                montage_image.size:
+            self.image_tk.paste(montage_image)
+            return
+        self.image_tk = ImageTk.PhotoImage(montage_image)
+        if self.montage_item is None:
+            self.montage_item = self.canvas.create_image(
+                0, 0, image=self.image_tk, anchor=tk.NW)
+        else:
+            self.canvas.itemconfigure(self.montage_item, image=self.image_tk)
+            self.canvas.config(width=montage_image.size[0],
+                               height=montage_image.size[1])
+
+    def create_canvas(self):
+        """
+        creates the montage canvas and its scrollbar, shown only for virtual
+        montages
+        """
+        frame = tk.Frame(self.master)
+        frame.grid(row=0,
+                   column=0,
+                   columnspan=len(self.questions) + 1)
+        self.canvas = tk.Canvas(frame,
+                                width=self.image.get_size()[0],
+                                height=self.image.get_size()[1])
+        self.scrollbar = tk.Scrollbar(frame,
+                                      orient=tk.VERTICAL,
+                                      command=self.scroll_montage)
+        self.canvas.config(yscrollcommand=self.scrollbar.set)
+        self.canvas.pack(side=tk.LEFT)
+        # the cropper is a separate window, it keeps its own wheel bindings
+        self.master.bind("<MouseWheel>", self.montage_wheel_handler)
+        self.master.bind("<Button-4>", self.montage_wheel_handler)
+        self.master.bind("<Button-5>", self.montage_wheel_handler)
+        self.image_tk = None
+        self.montage_item = None
+        # tile index: (canvas item, PhotoImage) of a virtual montage
+        self.tile_items = {}
+        self.tile_update = None
+        self.tile_poll = None
+        # tag: (x, y) of the created selection marks
+        self.mark_centers = {}
+        # tile index: mark shown on it
+        self.shown_marks = {}
+
+    def scroll_montage(self, *args):
+        """
+        scrollbar command, scrolls the canvas and loads the tiles in view
+        """
+        self.canvas.yview(*args)
+        self.schedule_tile_update()
+
+    def montage_wheel_handler(self, event):
+        if not self.image.is_virtual():
+            return
+        if event.num == 4 or event.delta > 0:
+            self.canvas.yview_scroll(-1, 'units')
+        else:
+            self.canvas.yview_scroll(1, 'units')
+        self.schedule_tile_update()
+
+    def schedule_tile_update(self):
+        """
+        loads the tiles once the scrolling events are processed, instead of
+        on every event
+        """
+        if self.tile_update is None:
+            self.tile_update = self.master.after_idle(
+                self.update_visible_tiles)
+
+    def update_visible_tiles(self):
+        """
+        for a virtual montage: requests the tiles in view (and
+        MONTAGE_VIEW_MARGIN rows around it) from the montage's worker
+        threads and puts the loaded ones on the canvas, the others are put
+        there by poll_tiles as they arrive. Drops the tiles out of view so
+        the memory does not grow with the size of the group
+        """
+        self.tile_update = None
+        if not self.image.is_virtual():
+            return
+        top = self.canvas.canvasy(0)
+        # the canvas has no size before it is shown
+        view_height = max(self.canvas.winfo_height(),
+                          self.image.get_size()[1])
+        margin = MONTAGE_VIEW_MARGIN * self.image.get_image_size()[1]
+        indices = self.image.get_tiles_in_view(top - margin,
+                                               top + view_height + margin)
+        self.image.request_tiles(indices)
+        visible = set(indices)
+        for index in self.tile_items.keys():
+            if index not in visible:
+                self.canvas.delete(self.tile_items.pop(index)[0])
+        for index in indices:
+            self.update_tile(index)
+        self.image.drop_tiles(visible)
+        self.schedule_tile_poll()
+
+    def update_tile(self, index):
+        """
+        puts the tile of a virtual montage on the canvas if it is loaded and
+        not shown yet
+        """
+        if index in self.tile_items:
+            return
+        tile = self.image.get_tile(index)
+        if tile is None:
+            return
+        photo = ImageTk.PhotoImage(tile)
+        box = self.image.get_tile_box(index)
+        item = self.canvas.create_image(box[0], box[1], image=photo,
+                                        anchor=tk.NW, tags='tile')
+        # under the selection marks
+        self.canvas.tag_lower(item)
+        self.tile_items[index] = (item, photo)
+
+    def schedule_tile_poll(self):
+        """
+        checks for loaded tiles after PREFETCH_POLL_INTERVAL while some are
+        loading
+        """
+        if self.tile_poll is None and self.image.is_loading():
+            self.tile_poll = self.master.after(PREFETCH_POLL_INTERVAL,
+                                               self.poll_tiles)
+
+    def poll_tiles(self):
+        """
+        puts the tiles that arrived from the worker threads on the canvas
+        """
+        self.tile_poll = None
+        if not self.image.is_virtual():
+            return
+        for index in self.image.collect_tiles():
+            self.update_tile(index)
+        self.schedule_tile_poll()
+
+    def build_montage(self, filenames):
+        """
+        creates and draws a montage, can run outside of the Tk thread
+        returns a tuple (Montage object, PIL image). A virtual montage is not
+        drawn (the image is None), only its first tiles are loaded
+        """
+        montage = Montage(filenames,
+                          (MONTAGE_WIDTH, MONTAGE_HEIGHT),
+                          (1, 2),
+                          False,
+                          nr_workers=MONTAGE_WORKERS,
+                          cache=self.thumbnail_cache,
+                          min_tile_size=MONTAGE_MIN_TILE_SIZE)
+        if montage.is_virtual():
+            margin = MONTAGE_VIEW_MARGIN * montage.get_image_size()[1]
+            montage.load_tiles(montage.get_tiles_in_view(
+                0, montage.get_size()[1] + margin))
+            return (montage, None)
+        return (montage, montage.draw_montage())
+
+    def prefetch_next_montage(self):
+        """
+        starts building the montage of the next group in the queue
+        """
+        filenames = self.image_list.get_next_filenames()
+        if filenames is not None:
+            self.prefetcher.prefetch('montage', tuple(filenames),
+                                     self.build_montage, filenames)
+
+    def prefetch_cropper_image(self):
+        """
+        starts preparing the first image the cropper will show. Called again
+        when the selection changes, the old result is then dropped
+        """
+        key = self.get_cropper_image_key()
+        if key is None:
+            self.prefetcher.cancel('cropper')
+        else:
+            self.prefetcher.prefetch('cropper', key, prepare_image, *key)
+
+    def get_cropper_image_key(self):
+        """
+        returns the arguments of prepare_image for the first image the
+        cropper will show, or None if no images are selected
+        """
+        filenames = self.image_list.get_current_filenames()
+        if len(filenames) == 0:
+            return None
+        return (filenames[0],)
 
     def switch_ignore_select(self):
         """
@@ -292,9 +506,8 @@ class Group_tagger:
             self.selectbutton.config(background = "#ff8c8c", text = "switch to\nselect")
         else:
             self.selectbutton.config(background = "#02cf12", text = "switch to\ndeselect")
-        # deletes previous drawings from canvas
-        self.canvas.delete(tk.ALL)
-        self.canvas.create_image(0, 0, image = self.image_tk, anchor = tk.NW)
+        # hides previous drawings from canvas
+        self.hide_marks()
         # sets selection states to all imgs being deselected
         if self.deselect:
             self.image_selection_states = {index:True for index in range(1, self.image.get_nr_images() + 1)}
@@ -310,12 +523,12 @@ class Group_tagger:
         """
         # setting the first image
         if self.shift_x1 is None:
-            self.shift_x1 = event.x
-            self.shift_y1 = event.y
+            self.shift_x1 = int(self.canvas.canvasx(event.x))
+            self.shift_y1 = int(self.canvas.canvasy(event.y))
         # setting the second image and running other code
         elif self.shift_x2 is None:
-            self.shift_x2 = event.x
-            self.shift_y2 = event.y
+            self.shift_x2 = int(self.canvas.canvasx(event.x))
+            self.shift_y2 = int(self.canvas.canvasy(event.y))
             # getting the order for start and end imgs
             order1 = self.image.get_image_index(self.shift_x1, self.shift_y1)
             order2 = self.image.get_image_index(self.shift_x2, self.shift_y2)
@@ -333,6 +546,7 @@ class Group_tagger:
                 self.image_selection_states[idx] = not self.image_selection_states[idx]
             # updating the selection in image_list
             self.image_list.add_remove_filenames(self.image_selection_states)
+            self.prefetch_cropper_image()
             # drawing crosses or checkmarks
             self.draw_selection_states()
             # resetting the keys
@@ -347,30 +561,63 @@ class Group_tagger:
         it will be either deselected or selected from images to crop
         and a cross or a checkmark will be drawn across it
         """
-        index = self.image.get_image_index(event.x, event.y)
+        index = self.image.get_image_index(int(self.canvas.canvasx(event.x)),
+                                           int(self.canvas.canvasy(event.y)))
         self.image_selection_states[index] = not self.image_selection_states[index]
         self.image_list.add_remove_filenames(self.image_selection_states)
+        self.prefetch_cropper_image()
         self.draw_selection_states()
 
     def draw_selection_states(self):
         """
         will draw a cross across deselected imgs if in deselect state
-        or a checkmark if in select state
+        or a checkmark if in select state. Only the tiles whose mark changed
+        are touched
         """
-        self.canvas.delete(tk.ALL)
-        self.canvas.create_image(0, 0, image = self.image_tk, anchor = tk.NW)
-        if self.deselect:
-            for index, state in self.image_selection_states.iteritems():
-                if not state:
-                    center = self.image.get_image_center_from_order(index)
-                    self.draw_x(center[0], center[1])
-        else:
-            for index, state in self.image_selection_states.iteritems():
-                if state:
-                    center = self.image.get_image_center_from_order(index)
-                    self.draw_checkmark(center[0], center[1])
+        for index, state in self.image_selection_states.iteritems():
+            if self.deselect:
+                mark = None if state else 'x'
+            else:
+                mark = 'checkmark' if state else None
+            self.show_mark(index, mark)
 
-    def draw_x(self, x, y):
+    def show_mark(self, index, mark):
+        """
+        shows the mark ('x', 'checkmark' or None) on the tile. Marks are
+        canvas items tagged with the mark and the tile index, they are
+        created the first time and then only shown or hidden
+        """
+        shown = self.shown_marks.get(index)
+        if shown == mark:
+            return
+        if shown is not None:
+            self.canvas.itemconfigure(shown + str(index), state=tk.HIDDEN)
+        if mark is not None:
+            tag = mark + str(index)
+            center = self.image.get_image_center_from_order(index)
+            old_center = self.mark_centers.get(tag)
+            if old_center is None:
+                if mark == 'x':
+                    self.draw_x(center[0], center[1], ('mark', tag))
+                else:
+                    self.draw_checkmark(center[0], center[1], ('mark', tag))
+                self.mark_centers[tag] = center
+            elif old_center != center:
+                # the montage layout changed
+                self.canvas.move(tag, center[0] - old_center[0],
+                                 center[1] - old_center[1])
+                self.mark_centers[tag] = center
+            self.canvas.itemconfigure(tag, state=tk.NORMAL)
+        self.shown_marks[index] = mark
+
+    def hide_marks(self):
+        """
+        hides all selection marks, they are kept for the next montage
+        """
+        self.canvas.itemconfigure('mark', state=tk.HIDDEN)
+        self.shown_marks = {}
+
+    def draw_x(self, x, y, tags=()):
         """
         draws an x with the center at x, y
         """
@@ -378,14 +625,16 @@ class Group_tagger:
         y1 = y + 10
         x2 = x - 10
         y2 = y - 10
-        self.canvas.create_line(x1, y1, x2, y2, fill = "Red", width = 3)
+        self.canvas.create_line(x1, y1, x2, y2, fill = "Red", width = 3,
+                                tags = tags)
         x1 = x + 10
         y1 = y - 10
         x2 = x - 10
         y2 = y + 10
-        self.canvas.create_line(x1, y1, x2, y2, fill = "Red", width = 3)
+        self.canvas.create_line(x1, y1, x2, y2, fill = "Red", width = 3,
+                                tags = tags)
 
-    def draw_checkmark(self, x, y):
+    def draw_checkmark(self, x, y, tags=()):
         """
         draws a checkmark with the center at x, y
         """
@@ -393,31 +642,27 @@ class Group_tagger:
         y1 = y + 5
         x2 = x - 5
         y2 = y - 5
-        self.canvas.create_line(x1, y1, x2, y2, fill="Green", width=3)
+        self.canvas.create_line(x1, y1, x2, y2, fill="Green", width=3,
+                                tags=tags)
         x1 = x + 5
         y1 = y + 5
         x2 = x + 15
         y2 = y - 15
-        self.canvas.create_line(x1, y1, x2, y2, fill="Green", width=3)
+        self.canvas.create_line(x1, y1, x2, y2, fill="Green", width=3,
+                                tags=tags)
 
     def montage_click(self, event):
         """
         callback function for the event of clicking inside the image
-        displays the full sized image in another window, closes the window if
-        you click anywhere inside the GUI
+        displays the original image in another window, fitted to the screen
         """
-        image_order = self.image.get_image_index(event.x, event.y)
+        image_order = self.image.get_image_index(
+            int(self.canvas.canvasx(event.x)),
+            int(self.canvas.canvasy(event.y)))
 
         # this will create a pop-up window with the selected image
         if (image_order - 1) < len(self.filenames):
-            self.pop_up_image = tk.Toplevel()
-            image = Image.open(self.filenames[image_order - 1])
-            image_tk = ImageTk.PhotoImage(image)
-            groupimage = tk.Label(self.pop_up_image, image=image_tk)
-            groupimage.image = image_tk
-            groupimage.pack()
-            groupimage.grab_set()
-            groupimage.bind("<Button-1>", self.exit_pop_up)
+            self.viewer.show(self.filenames[image_order - 1])
 
     def process_tags(self):
         """
@@ -438,17 +683,10 @@ class Group_tagger:
                 tkMessageBox.showwarning("ERROR", "enter all tags!")
                 return False
 
-        # opens the csv in write / binary mode
-        csv_file = open(self.group_csv, 'ab')
-        writer_obj = csv.writer(csv_file,
-                                delimiter=',',
-                                quotechar='',
-                                quoting=csv.QUOTE_NONE)
-
-        answers = [[question.get_answer()] for question in self.questions]
-        row_to_write = ([self.image_list.get_current_group()] + answers)
-        writer_obj.writerow(row_to_write)
-        csv_file.close()
+        answers = [question.get_answer() for question in self.questions]
+        self.store.write_group(self.image_list.get_current_group(),
+                               answers,
+                               self.image_list.get_current_position())
         return True
 
     #### helper functions ##############################################
@@ -469,10 +707,14 @@ class Group_tagger:
                                      'the csv dir provided contains a csv file'
                                      ' which suggests that you have completed '
                                      'all images')
+            self.close()
             self.master.destroy()
 
-    def exit_pop_up(self, event):
-        self.pop_up_image.destroy()
+    def close(self):
+        """
+        closes the annotation store
+        """
+        self.store.close()
 
     def create_csv_path(self, output_path, string, date):
         csv_path = os.path.abspath(output_path +
@@ -0,0 +1,57 @@
+import threading
+from collections import OrderedDict
+
+
+class Image_cache:
+    """
+    In-memory cache of decoded images (numpy arrays), bounded by max_size in
+    bytes. The least recently used images are removed first, an image larger
+    than max_size is not cached.
+
+    get, put and remove can be called from multiple threads.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # key: image, ordered from least to most recently used
+        self.entries = OrderedDict()
+        self.total_size = 0
+
+    def get(self, key):
+        """
+        returns the cached image or None
+        """
+        with self.lock:
+            image = self.entries.pop(key, None)
+            if image is not None:
+                # marking the entry as most recently used
+                self.entries[key] = image
+            return image
+
+    def put(self, key, image):
+        with self.lock:
+            self.remove_entry(key)
+            if image.nbytes > self.max_size:
+                return
+            self.entries[key] = image
+            self.total_size += image.nbytes
+            while self.total_size > self.max_size:
+                self.remove_entry(next(iter(self.entries)))
+
+    def remove(self, key):
+        with self.lock:
+            self.remove_entry(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_size = 0
+
+    def remove_entry(self, key):
+        """
+        removes the entry, the lock has to be held
+        """
+        image = self.entries.pop(key, None)
+        if image is not None:
+            self.total_size -= image.nbytes
@@ -2,7 +2,9 @@ import os
 import re
 import random
 import warnings
-import copy
+import itertools
+from collections import deque
+from Directory_index import Directory_index
 
 SUPPORTED_EXTENSIONS = (".jpg", ".JPG", ".PNG", ".png", ".tiff", ".TIFF",
                         ".jpeg", ".JPEG")
@@ -20,17 +22,41 @@ class Image_list:
     one group. Constant size mode means that you specify the size of the group.
     Constant size mode also preserves folder structure, meaning that groups can
     contain only images from the same subfolder.
+
+    The directory listing can be kept in an index file (index_path) so that
+    the next start only lists the subfolders that changed, scan_workers
+    subfolders are walked in parallel.
+
+    In stream mode the groups are not listed upfront: they are generated
+    while walking the folders and only the next lookahead groups and the last
+    lookahead finished groups are kept. The first group is ready right away
+    and memory does not grow with the nr of images, but the total nr of
+    groups is not known until the walk is done. Stream mode does not use the
+    index file and cannot be shuffled.
     """
 
-    def __init__(self, directory, size_of_group=None, seed=None):
+    def __init__(self, directory, size_of_group=None, seed=None,
+                 index_path=None, scan_workers=1, stream=False, lookahead=16):
 
         self.directory = directory
+        self.size_of_group = size_of_group
+        self.index_path = index_path
+        self.scan_workers = scan_workers
+        self.stream = stream
+        self.lookahead = lookahead
 
         if(size_of_group):
             self.mode = 'constant_size'
-            self.init_constant_size_mode(directory, size_of_group)
         else:
             self.mode = 'folder'
+
+        if stream:
+            if seed is not None:
+                raise ValueError('groups cannot be shuffled in stream mode')
+            self.init_stream_mode(directory)
+        elif(size_of_group):
+            self.init_constant_size_mode(directory, size_of_group)
+        else:
             self.init_folder_mode(directory)
 
         if(len(self.groups) == 0):
@@ -43,71 +69,151 @@ class Image_list:
             random.seed(seed)
             random.shuffle(self.groups)
 
+        # the queue is a deque so taking and putting back groups at the front
+        # does not move the whole list
+        self.groups = deque(self.groups)
+
+        # group name: position in the queue, to find where to resume
+        self.positions = {}
+        if not stream:
+            for position, group in enumerate(self.groups):
+                group.position = position
+                self.positions[group.name] = position
+
         # setting the current group order to 0 as no group is active
         self.current_id = 0
         self.current_group = None
         self.state_repeated = None
 
-        # initializing the log
-        self.finished = []
+        # initializing the log, in stream mode only the last groups are kept
+        if stream:
+            self.finished = deque(maxlen=lookahead)
+        else:
+            self.finished = deque()
+        self.nr_finished = 0
 
     def init_folder_mode(self, path):
         self.groups = []
         self.nr_images = 0
-        for root, dirs, files in os.walk(path):
-            images = [f for f in files if f.endswith(SUPPORTED_EXTENSIONS)]
-            images = sorted(images)  # sort alphabetically
-            if(len(images) > 0):
-                self.groups.append({
-                    'full_dir': root,
-                    # avoid prefix '/'
-                    'relative_dir': re.split(path, root)[1][1:],
-                    'group_name': 'root' + re.split(path, root)[1],
-                    'filenames': images,
-                    'repeated': False,
-                    'count': len(images)
-                })
-                self.nr_images += len(images)
+        table = Group_table()
+        for root, images in self.scan_directory(path):
+            for group in self.make_folder_groups(path, root, images, table):
+                self.groups.append(group)
+                self.nr_images += group.count
 
     def init_constant_size_mode(self, path, size):
         self.groups = []
         self.nr_images = 0
-        for root, dirs, files in os.walk(path):
-
-            images = [f for f in files if f.endswith(SUPPORTED_EXTENSIONS)]
-            images = sorted(images)  # sort alphabetically
-
-            if(len(images) > 0):
-                counter = 1
-                while len(images) > 0:
-                    image_subgroup = images[0:size]
-                    self.groups.append({
-                        'full_dir': root,
-                        'relative_dir': re.split(path, root)[1],
-                        'group_name': 'root' + re.split(path, root)[1] +
-                                      '#' + str(counter),
-                        'filenames': image_subgroup,
-                        'repeated': False,
-                        'count': len(image_subgroup)
-                    })
-                    images = images[size:]
-                    counter += 1
-
-                self.nr_images += len(images)
+        table = Group_table()
+        for root, images in self.scan_directory(path):
+            for group in self.make_constant_size_groups(path, root, images,
+                                                        size, table):
+                self.groups.append(group)
+                self.nr_images += group.count
+
+    def init_stream_mode(self, path):
+        self.groups = deque()
+        self.nr_images = 0
+        self.nr_generated = 0
+        self.group_source = self.generate_groups(path)
+        self.fill_lookahead()
+
+    def make_folder_groups(self, path, root, images, table):
+        """
+        adds the group of one folder to the table, returns it as a list
+        (empty if no images)
+        """
+        if(len(images) == 0):
+            return []
+        # avoid prefix '/'
+        directory_id = table.add_directory(root, re.split(path, root)[1][1:])
+        return [table.add_group('root' + re.split(path, root)[1],
+                                directory_id, images)]
+
+    def make_constant_size_groups(self, path, root, images, size, table):
+        """
+        adds the groups of one folder to the table, each with up to size
+        images, returns them as a list
+        """
+        groups = []
+        if(len(images) == 0):
+            return groups
+        relative_dir = re.split(path, root)[1]
+        directory_id = table.add_directory(root, relative_dir)
+        for counter, start in enumerate(range(0, len(images), size), 1):
+            groups.append(table.add_group(
+                'root' + relative_dir + '#' + str(counter),
+                directory_id,
+                images[start:start + size]))
+        return groups
+
+    def generate_groups(self, path):
+        """
+        yields the groups folder by folder while walking the directory
+        """
+        index = Directory_index(path, SUPPORTED_EXTENSIONS)
+        for root, images in index.iter_walk():
+            # a table per folder, it is freed with the last of its groups
+            table = Group_table()
+            if self.size_of_group:
+                groups = self.make_constant_size_groups(path, root, images,
+                                                        self.size_of_group,
+                                                        table)
+            else:
+                groups = self.make_folder_groups(path, root, images, table)
+            for group in groups:
+                group.position = self.nr_generated
+                self.nr_generated += 1
+                self.nr_images += group.count
+                yield group
+
+    def fill_lookahead(self):
+        """
+        in stream mode, generates groups until lookahead groups are queued
+        or the walk is done
+        """
+        if not self.stream:
+            return
+        while self.group_source is not None and \
+                len(self.groups) < self.lookahead:
+            try:
+                self.groups.append(next(self.group_source))
+            except StopIteration:
+                self.group_source = None
+
+    def is_complete(self):
+        """
+        returns True if all groups are known, False while stream mode is
+        still walking the directory
+        """
+        return not self.stream or self.group_source is None
+
+    def scan_directory(self, path):
+        """
+        returns a list of (root, image filenames sorted alphabetically) for
+        every folder, in os.walk order, and updates the index file
+        """
+        index = Directory_index(path,
+                                SUPPORTED_EXTENSIONS,
+                                index_path=self.index_path,
+                                nr_workers=self.scan_workers)
+        result = index.walk()
+        index.save()
+        return result
 
     def __str__(self):
         result = []
         if(len(self.groups) > 0):
             result.append('UNFINISHED IMAGES')
             for image_group in self.groups:
-                result.append('----- ' + image_group['group_name'] + ' -----')
-                for path in image_group['filenames']:
+                result.append('----- ' + image_group.name + ' -----')
+                for path in image_group.get_filenames():
                     result.append(path)
         if(len(self.finished) > 0):
             result.append('FINISHED IMAGES')
             for image_group in self.finished:
-                result.append('----- ' + image_group['group_name'] + ' -----')
-                for path in image_group['filenames']:
+                result.append('----- ' + image_group.name + ' -----')
+                for path in image_group.get_filenames():
                     result.append(path)
 
         return '\n'.join(result)
@@ -117,13 +223,13 @@ class Image_list:
         if(len(self.groups) > 0):
             result.append('UNFINISHED IMAGES')
             for image_group in self.groups:
-                result.append(image_group['group_name'] +
-                              ', N = ' + str(image_group['count']))
+                result.append(image_group.name +
+                              ', N = ' + str(image_group.count))
         if(len(self.finished) > 0):
             result.append('FINISHED IMAGES')
             for image_group in self.finished:
-                result.append(image_group['group_name'] +
-                              ' : ' + str(image_group['count']))
+                result.append(image_group.name +
+                              ' : ' + str(image_group.count))
 
         return '\n'.join(result)
 
@@ -136,23 +242,23 @@ class Image_list:
         if no groups are left, raises Error
         """
 
+        self.fill_lookahead()
         if len(self.groups) == 0:
             raise IndexError('ERROR: no groups left to process')
             return
 
         if self.current_group and not self.get_repeat_state():
             self.finished.append(self.current_group)
+            self.nr_finished += 1
 
         # preparing the new group
-        self.current_group = self.groups.pop(0)
-        self.state_repeated = self.current_group['repeated']
+        self.current_group = self.groups.popleft()
+        self.fill_lookahead()
+        self.state_repeated = self.current_group.repeated
         self.current_id += 1
 
         # resolving the filenames
-        self.current_filenames = dict(zip(
-            range(1, len(self.current_group['filenames']) + 1),
-            self.current_group['filenames']
-        ))
+        self.current_filenames = dict(enumerate(self.current_group.get_filenames(), 1))
         self.ignored_filenames = dict()
 
         return [self.get_current_filenames(), self.state_repeated]
@@ -174,15 +280,13 @@ class Image_list:
             return None
 
         # reinsert current group into the queue
-        self.groups.insert(0, self.current_group)
+        self.groups.appendleft(self.current_group)
 
         # set previous group as current
         self.current_group = self.finished.pop()
-        self.current_filenames = dict(zip(
-            range(1, len(self.current_group['filenames']) + 1),
-            self.current_group['filenames']
-        ))
-        self.state_repeated = self.current_group['repeated']
+        self.nr_finished -= 1
+        self.current_filenames = dict(enumerate(self.current_group.get_filenames(), 1))
+        self.state_repeated = self.current_group.repeated
         self.ignored_filenames = dict()
         self.current_id -= 1
 
@@ -192,44 +296,126 @@ class Image_list:
         """
         returns True if no groups are left
         """
+        self.fill_lookahead()
         if len(self.groups) == 0:
             return True
 
     def repeat_group(self, times):
         """
-        adds a copy of the current group to the list and sets it as repeated
+        adds a copy of the current group to the list and sets it as repeated.
+        The copies share the filename list with the current group
         """
         for idx in reversed(range(times)):
-            new_name = self.current_group['group_name'] + "_" + str(idx + 2)
-            new_group = copy.deepcopy(self.current_group)
-            new_group['group_name'] = new_name
-            new_group['repeated'] = True
-            self.groups.insert(0, new_group)
+            new_name = self.current_group.name + "_" + str(idx + 2)
+            self.groups.appendleft(self.current_group.repeat(new_name))
 
-    def setup_list(self, last_group_name):
+    def setup_list(self, last_group_name, position=None):
         """
         if you're done with some of the groups, this function will setup the
         to start with the group after the provided last_group
         it's assumed that the list is starting from the __init__ state. I don't
         need it to be more general for now
+
+        position is the one of last_group in the initial queue if it is known
+        (see get_current_position), it is used if the group there still has
+        that name
         """
-        for idx in range(len(self.groups)):
-            target = self.groups[idx]
-            if re.match(target['group_name'], last_group_name):
-                next_group_id = idx + 1
-        if next_group_id >= len(self.groups):
-            self.finished = self.groups[0:next_group_id]
-            self.groups = []
+        if self.stream:
+            self.setup_stream(last_group_name, position)
+            return
+        next_group_id = self.find_group(last_group_name, position) + 1
+        groups = list(self.groups)
+        if next_group_id >= len(groups):
+            self.finished = deque(groups[0:next_group_id])
+            self.nr_finished = len(self.finished)
+            self.groups = deque()
         else:
-            self.current_group = self.groups[next_group_id]
-            self.current_filenames = dict(zip(
-                range(1, len(self.current_group['filenames']) + 1),
-                self.current_group['filenames']
-            ))
+            self.current_group = groups[next_group_id]
+            self.current_filenames = dict(enumerate(self.current_group.get_filenames(), 1))
+            self.ignored_filenames = dict()
+            self.state_repeated = self.current_group.repeated
+            self.finished = deque(groups[0:next_group_id])
+            self.nr_finished = len(self.finished)
+            self.groups = deque(groups[next_group_id:])
+
+    def setup_stream(self, last_group_name, position=None):
+        """
+        stream mode version of setup_list: skips the generated groups up to
+        and including last_group_name, keeping only the last few as history.
+        Without a position, a repeated group (eg. root/a_2) is looked up as
+        the group it repeats only if there is no group with its exact name, a
+        folder can be named like one (eg. root/a and root/a_2023). Raises
+        IndexError if the group is not found
+        """
+        original_name = get_original_group_name(last_group_name)
+        if position is not None and \
+                self.skip_stream_to(last_group_name, position):
+            pass
+        elif not self.skip_stream_to(last_group_name) and \
+                (original_name == last_group_name or
+                 not self.skip_stream_to(original_name)):
+            raise IndexError('ERROR: group ' + last_group_name +
+                             ' not found')
+        self.fill_lookahead()
+        if len(self.groups) > 0:
+            self.current_group = self.groups[0]
+            self.current_filenames = dict(enumerate(self.current_group.get_filenames(), 1))
             self.ignored_filenames = dict()
-            self.state_repeated = self.current_group['repeated']
-            self.finished = self.groups[0:next_group_id]
-            self.groups = self.groups[next_group_id:]
+            self.state_repeated = self.current_group.repeated
+
+    def skip_stream_to(self, group_name, position=None):
+        """
+        moves the generated groups up to and including group_name to the
+        finished ones, returns False if there is no such group. If the
+        position is given the group there is taken if it is group_name or the
+        group it repeats. The list has to be in the __init__ state, it is put
+        back in it if the group is not found
+        """
+        names = (group_name, get_original_group_name(group_name))
+        while True:
+            self.fill_lookahead()
+            if len(self.groups) == 0:
+                self.restart_stream()
+                return False
+            group = self.groups.popleft()
+            self.finished.append(group)
+            self.nr_finished += 1
+            if position is None:
+                if group.name == group_name:
+                    return True
+            elif group.position == position:
+                if group.name in names:
+                    return True
+                # the folders changed since the position was stored
+                self.restart_stream()
+                return False
+
+    def restart_stream(self):
+        """
+        starts the walk over so the list can be used from the top
+        """
+        self.finished.clear()
+        self.nr_finished = 0
+        self.init_stream_mode(self.directory)
+
+    def find_group(self, group_name, position=None):
+        """
+        returns the position of the group in the initial queue. A repeated
+        group (eg. root/a_2) gives the position of the group it repeats.
+        A given position is returned if the group there is group_name or the
+        group it repeats, it tells them apart when a folder is named like a
+        repeated group. Raises IndexError if there is no such group
+        """
+        if position is not None and position in (
+                self.positions.get(group_name),
+                self.positions.get(get_original_group_name(group_name))):
+            return position
+        position = self.positions.get(group_name)
+        if position is None:
+            position = self.positions.get(get_original_group_name(group_name))
+        if position is None:
+            raise IndexError('ERROR: group ' + group_name + ' not found')
+        return position
 
     def add_remove_filenames(self, image_selection_states):
         """
@@ -256,7 +442,7 @@ class Image_list:
         """
         returns the list of finished group IDs
         """
-        return [group['group_name'] for group in self.finished]
+        return [group.name for group in self.finished]
 
     def current_order(self):
         """
@@ -269,7 +455,13 @@ class Image_list:
         """
         returns the current group ID
         """
-        return self.current_group['group_name']
+        return self.current_group.name
+
+    def get_current_position(self):
+        """
+        returns the position of the current group in the initial queue
+        """
+        return self.current_group.position
 
     def get_current_filenames(self):
         """
@@ -277,7 +469,7 @@ class Image_list:
         last img since fnames are stored in a dict, this returns fnames ordered
         by the key (i.e., in the way they were entered)
         """
-        prefix = self.current_group['full_dir']
+        prefix = self.current_group.get_full_dir()
         return ['/'.join([prefix, self.current_filenames[idx]]) for idx
                 in sorted(self.current_filenames.keys())]
 
@@ -290,6 +482,17 @@ class Image_list:
         return [self.ignored_filenames[idx] for idx
                 in sorted(self.ignored_filenames.keys())]
 
+    def get_next_filenames(self):
+        """
+        returns fnames for the next group in the queue as a list, or None if
+        there is no next group or it repeats the current one
+        """
+        if len(self.groups) == 0 or self.groups[0].repeated:
+            return None
+        prefix = self.groups[0].get_full_dir()
+        return ['/'.join([prefix, fname])
+                for fname in self.groups[0].get_filenames()]
+
     def get_repeat_state(self):
         """
         returns True if the current group is repeated
@@ -301,7 +504,7 @@ class Image_list:
         returns True if the next group is repeated
         """
         if len(self.groups) > 0:
-            return self.groups[0]['repeated']
+            return self.groups[0].repeated
         else:
             return False
 
@@ -311,18 +514,21 @@ class Image_list:
         """
         max_images = 0
         for group in self.groups:
-            if group['count'] > max_images:
-                max_images = group['count']
+            if group.count > max_images:
+                max_images = group.count
         return max_images
 
     def get_group_list(self):
-        return [group['group_name'] for group in self.groups]
+        return [group.name for group in self.groups]
 
     def get_percent_complete(self):
         """
         returns a string representing percent complete
         """
-        done = len(self.finished)
+        if not self.is_complete():
+            # the nr of remaining groups is not known yet
+            return "?%"
+        done = self.nr_finished
         remain = len(self.groups)
         proportion = float(done) / (done + remain + 1)
         percent = str(int(round(proportion, 2) * 100)) + "%"
@@ -332,13 +538,14 @@ class Image_list:
         """
         returns integer of number of groups completed
         """
-        return len(self.finished)
+        return self.nr_finished
 
     def get_nr_groups(self):
         """
-        returns integer of number of groups
+        returns integer of number of groups (in stream mode, the ones known
+        so far)
         """
-        return len(self.finished) + len(self.groups)
+        return self.nr_finished + len(self.groups)
 
     def get_timestamp(self):
         """
@@ -347,7 +554,21 @@ class Image_list:
         return "99:99"
 
     def get_relative_dir(self):
-        relative_dir = self.current_group['relative_dir']
+        return self.clean_relative_dir(self.current_group.get_relative_dir())
+
+    def get_group_directories(self):
+        """
+        returns a dict {group_name: (full_dir, relative_dir)} for all groups,
+        finished or not
+        """
+        directories = {}
+        for group in itertools.chain(self.finished, self.groups):
+            directories[group.name] = (
+                group.get_full_dir(),
+                self.clean_relative_dir(group.get_relative_dir()))
+        return directories
+
+    def clean_relative_dir(self, relative_dir):
         if relative_dir == '':
             return relative_dir
         else:
@@ -356,3 +577,86 @@ class Image_list:
             if relative_dir[0] == '/' or relative_dir[0] == '\\':
                 relative_dir = relative_dir[1:]
             return relative_dir
+
+
+class Group_table(object):
+    """
+    compact storage of the groups. Every directory is stored once and the
+    filenames of all groups are kept in one flat list, a group only records
+    where its filenames start and how many there are
+    """
+
+    def __init__(self):
+        # (full_dir, relative_dir)
+        self.directories = []
+        self.directory_ids = {}
+        self.filenames = []
+
+    def add_directory(self, full_dir, relative_dir):
+        """
+        returns the id of the directory, adding it if it is new
+        """
+        directory_id = self.directory_ids.get(full_dir)
+        if directory_id is None:
+            directory_id = len(self.directories)
+            self.directories.append((intern_path(full_dir),
+                                     intern_path(relative_dir)))
+            self.directory_ids[full_dir] = directory_id
+        return directory_id
+
+    def add_group(self, name, directory_id, filenames):
+        start = len(self.filenames)
+        self.filenames.extend(filenames)
+        return Group(self, name, directory_id, start, len(filenames))
+
+
+class Group(object):
+    """
+    one group of images, its filenames are count entries of the table
+    starting at start
+    """
+    __slots__ = ('table', 'name', 'directory_id', 'start', 'count',
+                 'repeated', 'position')
+
+    def __init__(self, table, name, directory_id, start, count,
+                 repeated=False, position=None):
+        self.table = table
+        self.name = name
+        self.directory_id = directory_id
+        self.start = start
+        self.count = count
+        self.repeated = repeated
+        self.position = position
+
+    def get_filenames(self):
+        return self.table.filenames[self.start:self.start + self.count]
+
+    def get_full_dir(self):
+        return self.table.directories[self.directory_id][0]
+
+    def get_relative_dir(self):
+        return self.table.directories[self.directory_id][1]
+
+    def repeat(self, name):
+        """
+        returns a repeated copy of the group, sharing the same filenames
+        """
+        return Group(self.table, name, self.directory_id, self.start,
+                     self.count, True, self.position)
+
+
+def intern_path(path):
+    """
+    interns the path so that equal directories share one string. Only byte
+    strings can be interned in python 2
+    """
+    if isinstance(path, str):
+        return intern(path)
+    return path
+
+
+def get_original_group_name(group_name):
+    """
+    strips the suffix of a repeated group: root/a_2 -> root/a
+    """
+    return re.sub('_[0-9]+$', '', group_name)
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+
+class Image_preloader:
+    """
+    Ring buffer of the next few images, prepared in the background.
+
+    function is called on a worker thread with the key as its arguments,
+    e.g. Cropper.prepare_image(path). preload takes the
+    keys of the upcoming images in order, the first size of them are prepared
+    and everything else is dropped. get returns the result for a key, waiting
+    for it if the worker is not done yet.
+    """
+
+    def __init__(self, function, size, nr_workers=1):
+        self.function = function
+        self.size = size
+        self.pool = None
+        if size > 0:
+            self.pool = ThreadPool(nr_workers)
+        # key: AsyncResult, in the order the images will be needed
+        self.pending = OrderedDict()
+
+    def preload(self, keys):
+        """
+        schedules the first size keys, drops the ones no longer upcoming
+        (results of running work for those are ignored)
+        """
+        if self.pool is None:
+            return
+        keys = list(keys)[:self.size]
+        for key in list(self.pending.keys()):
+            if key not in keys:
+                del self.pending[key]
+        for key in keys:
+            if key not in self.pending:
+                self.pending[key] = self.pool.apply_async(self.function, key)
+
+    def get(self, key):
+        """
+        returns the prepared result for the key, or None if it was not
+        preloaded or preparing it failed (then the caller prepares it again
+        and gets the error itself)
+        """
+        result = self.pending.pop(key, None)
+        if result is None:
+            return None
+        try:
+            return result.get()
+        except Exception:
+            return None
+
+    def close(self):
+        """
+        stops the workers, pending results are dropped
+        """
+        self.pending.clear()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
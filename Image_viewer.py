@@ -0,0 +1,229 @@
+import os
+import math
+import Tkinter as tk
+from collections import OrderedDict
+from PIL import Image, ImageTk
+
+# JPEG files can be decoded at 1/2, 1/4 and 1/8 of their size
+REDUCTIONS = [8, 4, 2, 1]
+ZOOM_STEP = 1.25
+# mouse movement (pixels) after which a click is a drag
+DRAG_THRESHOLD = 3
+
+
+class Image_viewer:
+    """
+    Pop-up window showing an original image, fitted to the screen.
+
+    The image is decoded only at the resolution needed: JPEG files in draft
+    mode at the smallest reduction (1/8, 1/4, 1/2 or full size) that is still
+    at least as large as the view. Decoded levels are kept in an LRU bounded
+    by cache_size (in bytes), so opening the same image again is instant.
+
+    The mouse wheel zooms in (up to max_zoom of the original size) and out
+    around the pointer, dragging pans, a click without dragging (or Escape)
+    closes the window. Only the visible region of the decoded level is
+    resized and sent to Tk.
+    """
+
+    def __init__(self, master, cache_size, max_zoom=2.0, screen_fraction=0.9):
+        self.master = master
+        self.cache_size = cache_size
+        self.max_zoom = max_zoom
+        self.screen_fraction = screen_fraction
+        # (path, mtime, reduction): decoded PIL image, least recent first
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.window = None
+
+    def show(self, path):
+        """
+        opens the pop-up window with the image, closing the previous one
+        """
+        self.close()
+        self.path = path
+        # reads only the header
+        self.original_size = Image.open(path).size
+        width, height = self.original_size
+        max_width = int(self.master.winfo_screenwidth() * self.screen_fraction)
+        max_height = int(self.master.winfo_screenheight() *
+                         self.screen_fraction)
+        self.fit_zoom = min(1.0,
+                            max_width / float(width),
+                            max_height / float(height))
+        self.zoom = self.fit_zoom
+        self.view_size = (max(1, int(width * self.zoom)),
+                          max(1, int(height * self.zoom)))
+        # center of the view in original image pixels
+        self.center = (width / 2.0, height / 2.0)
+
+        self.window = tk.Toplevel(self.master)
+        self.window.title(os.path.basename(path))
+        self.canvas = tk.Canvas(self.window,
+                                width=self.view_size[0],
+                                height=self.view_size[1],
+                                highlightthickness=0)
+        self.canvas.pack()
+        self.image_tk = None
+        self.image_item = self.canvas.create_image(0, 0, anchor=tk.NW)
+        self.drag_start = None
+        self.dragged = False
+
+        self.canvas.bind("<ButtonPress-1>", self.press_handler)
+        self.canvas.bind("<B1-Motion>", self.drag_handler)
+        self.canvas.bind("<ButtonRelease-1>", self.release_handler)
+        self.canvas.bind("<MouseWheel>", self.wheel_handler)
+        self.canvas.bind("<Button-4>", self.wheel_handler)
+        self.canvas.bind("<Button-5>", self.wheel_handler)
+        self.window.bind("<Escape>", lambda event: self.close())
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.draw()
+        self.canvas.focus_set()
+        self.window.grab_set()
+
+    def close(self):
+        """
+        closes the pop-up window, the decoded images stay cached
+        """
+        if self.window is not None:
+            self.window.destroy()
+            self.window = None
+            self.image_tk = None
+
+    def draw(self):
+        """
+        shows the part of the image around self.center at self.zoom
+        """
+        width, height = self.original_size
+        view_width, view_height = self.view_size
+        # visible region in original image pixels
+        region_width = min(width, view_width / self.zoom)
+        region_height = min(height, view_height / self.zoom)
+        x1 = clamp(self.center[0] - region_width / 2.0, 0,
+                   width - region_width)
+        y1 = clamp(self.center[1] - region_height / 2.0, 0,
+                   height - region_height)
+        self.center = (x1 + region_width / 2.0, y1 + region_height / 2.0)
+
+        level = self.get_level(self.zoom)
+        scale = level.size[0] / float(width)
+        box = (int(x1 * scale),
+               int(y1 * scale),
+               max(int(x1 * scale) + 1, int((x1 + region_width) * scale)),
+               max(int(y1 * scale) + 1, int((y1 + region_height) * scale)))
+        display_size = (max(1, int(round(region_width * self.zoom))),
+                        max(1, int(round(region_height * self.zoom))))
+        region = level.crop(box)
+        if region.size != display_size:
+            if display_size[0] < region.size[0]:
+                region = region.resize(display_size, Image.ANTIALIAS)
+            else:
+                region = region.resize(display_size, Image.BILINEAR)
+
+        self.image_tk = ImageTk.PhotoImage(region)
+        # a region smaller than the view (zoomed out) is centered
+        self.canvas.coords(self.image_item,
+                           (view_width - display_size[0]) // 2,
+                           (view_height - display_size[1]) // 2)
+        self.canvas.itemconfig(self.image_item, image=self.image_tk)
+
+    def get_level(self, zoom):
+        """
+        returns the image decoded at the smallest reduction that is at least
+        zoom times the original size
+        """
+        reduction = 1
+        for candidate in REDUCTIONS:
+            if 1.0 / candidate >= zoom:
+                reduction = candidate
+                break
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        key = (self.path, mtime, reduction)
+        level = self.cache.pop(key, None)
+        if level is None:
+            level = self.decode(reduction)
+            self.cached_bytes += get_nr_bytes(level)
+        # marking the level as most recently used
+        self.cache[key] = level
+        self.evict(keep=key)
+        return level
+
+    def decode(self, reduction):
+        """
+        decodes the image at 1/reduction of its size, JPEG files in draft mode
+        """
+        width, height = self.original_size
+        size = (int(math.ceil(width / float(reduction))),
+                int(math.ceil(height / float(reduction))))
+        image = Image.open(self.path)
+        if reduction > 1:
+            image.draft('RGB', size)
+        image = image.convert('RGB')
+        # formats without draft mode are decoded at full size
+        if image.size[0] >= 2 * size[0]:
+            image = image.resize(size, Image.ANTIALIAS)
+        return image
+
+    def evict(self, keep):
+        """
+        removes the least recently used levels until the cache fits, the level
+        being shown is kept
+        """
+        for key in list(self.cache.keys()):
+            if self.cached_bytes <= self.cache_size:
+                break
+            if key == keep:
+                continue
+            self.cached_bytes -= get_nr_bytes(self.cache.pop(key))
+
+    #### event handlers ################################################
+
+    def wheel_handler(self, event):
+        if event.num == 4 or event.delta > 0:
+            zoom = min(self.max_zoom, self.zoom * ZOOM_STEP)
+        else:
+            zoom = max(self.fit_zoom, self.zoom / ZOOM_STEP)
+        if zoom == self.zoom:
+            return
+        # the image point under the pointer stays in place
+        offset_x = event.x - self.view_size[0] / 2.0
+        offset_y = event.y - self.view_size[1] / 2.0
+        point_x = self.center[0] + offset_x / self.zoom
+        point_y = self.center[1] + offset_y / self.zoom
+        self.zoom = zoom
+        self.center = (point_x - offset_x / zoom, point_y - offset_y / zoom)
+        self.draw()
+
+    def press_handler(self, event):
+        self.drag_start = (event.x, event.y)
+        self.dragged = False
+
+    def drag_handler(self, event):
+        if self.drag_start is None:
+            return
+        dx = event.x - self.drag_start[0]
+        dy = event.y - self.drag_start[1]
+        if not self.dragged and max(abs(dx), abs(dy)) < DRAG_THRESHOLD:
+            return
+        self.dragged = True
+        self.drag_start = (event.x, event.y)
+        self.center = (self.center[0] - dx / self.zoom,
+                       self.center[1] - dy / self.zoom)
+        self.draw()
+
+    def release_handler(self, event):
+        if self.drag_start is not None and not self.dragged:
+            self.close()
+        self.drag_start = None
+
+
+def clamp(value, lowest, highest):
+    return max(lowest, min(value, highest))
+
+
+def get_nr_bytes(image):
+    return image.size[0] * image.size[1] * len(image.getbands())
@@ -0,0 +1,94 @@
+import os
+import threading
+import Queue
+import cv2
+
+
+class Image_writer:
+    """
+    Saves images on worker threads so that slow disks (e.g. network shares)
+    do not block the GUI.
+
+    Jobs (path, image, encode params) go into a bounded queue, write blocks if
+    the queue is full. Failed writes are collected and can be picked up by the
+    GUI with get_errors. flush waits until all queued images are written,
+    close also stops the workers. Always close the writer when done, otherwise
+    queued images are lost when the program exits.
+    """
+
+    def __init__(self, nr_workers=1, queue_size=8):
+        self.jobs = Queue.Queue(maxsize=queue_size)
+        self.errors = Queue.Queue()
+        self.workers = []
+        for idx in range(nr_workers):
+            worker = threading.Thread(target=self.work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def write(self, path, image, params=()):
+        """
+        queues the openCV image (numpy array) to be saved to path. The array
+        should not be changed in place afterwards
+        """
+        if len(self.workers) == 0:
+            raise ValueError('the writer is already closed')
+        self.jobs.put((path, image, list(params)))
+
+    def flush(self):
+        """
+        blocks until all queued images are written
+        """
+        self.jobs.join()
+
+    def close(self):
+        """
+        writes all queued images and stops the workers
+        """
+        for worker in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def get_errors(self):
+        """
+        returns a list of (path, error) for the writes that failed since the
+        last call
+        """
+        errors = []
+        while True:
+            try:
+                errors.append(self.errors.get_nowait())
+            except Queue.Empty:
+                return errors
+
+    #### helper functions ##############################################
+
+    def work(self):
+        """
+        runs on the worker threads until it gets None from the queue
+        """
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                path, image, params = job
+                self.save(path, image, params)
+            except Exception as error:
+                self.errors.put((path, error))
+            finally:
+                self.jobs.task_done()
+
+    def save(self, path, image, params):
+        directory = os.path.dirname(path)
+        if directory != '' and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # another worker may have created it in the meantime
+                if not os.path.isdir(directory):
+                    raise
+        if not cv2.imwrite(path, image, params):
+            raise IOError('openCV could not write the image')
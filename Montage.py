@@ -4,6 +4,43 @@ from PIL import Image, ImageDraw
 from pylab import *
 import cv2
 import numpy
+import Queue
+from multiprocessing.pool import ThreadPool
+
+# decode scales supported by openCV, from the smallest output to the largest
+REDUCED_READ_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                      (4, cv2.IMREAD_REDUCED_COLOR_4),
+                      (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def read_reduced(path, target_width, target_height, force_square):
+    """
+    reads an image at the smallest decode scale (1/2, 1/4 or 1/8) that still
+    covers the target size after resizing. For JPEGs the scaling is done by
+    the decoder itself, which skips most of the work on large images.
+    The image size is read from the file header with PIL, this does not
+    decode the pixels
+    :return:    openCV image (numpy array), not yet resized to the target
+    """
+    try:
+        header = Image.open(path)
+        image_width, image_height = header.size
+        header.close()
+    except IOError:
+        return cv2.imread(path)
+    width_ratio = float(image_width) / target_width
+    height_ratio = float(image_height) / target_height
+    if force_square:
+        # both sides are stretched to the target
+        max_scale = min(width_ratio, height_ratio)
+    else:
+        # the longer side is fitted to the target
+        max_scale = max(width_ratio, height_ratio)
+    for scale, flag in REDUCED_READ_FLAGS:
+        if scale <= max_scale:
+            return cv2.imread(path, flag)
+    return cv2.imread(path)
+
 
 class Montage:
     """
@@ -19,6 +56,15 @@ class Montage:
     force_square    should the input images be streched to
                     squares?
     every_nth_image if you want to reduce the nr of images in the montage
+    nr_workers      nr of threads that decode and resize the images
+    cache           optional Thumbnail_cache, resized images are read
+                    from it before touching the original files
+    min_tile_size   if the tiles would get smaller than this, the montage
+                    becomes virtual: tiles of this size in as many rows as
+                    needed, taller than montage_size. It is meant to be
+                    scrolled, only the tiles in view are loaded with
+                    load_tiles (or in the background with request_tiles
+                    and collect_tiles) instead of drawing the whole montage
 
     all input images are expected to be of same size
     """
@@ -27,7 +73,10 @@ class Montage:
                  montage_size,
                  row_to_column,
                  force_square=True,
-                 every_nth_image=1):
+                 every_nth_image=1,
+                 nr_workers=1,
+                 cache=None,
+                 min_tile_size=None):
         # will get every nth image
         if every_nth_image is not 1:
             fnames = [fnames[idx] for idx in range(len(fnames))
@@ -37,12 +86,29 @@ class Montage:
         self.montage_size = montage_size
         self.row_to_column = row_to_column
         self.force_square = force_square
+        self.nr_workers = nr_workers
+        self.cache = cache
         self.define_montage_dimensions()
         self.define_image_dim(self.montage_size,
                               self.ncols,
                               self.nrows)
-        if self.force_square:
-            self.resize_factor = None
+        self.virtual = (min_tile_size is not None and
+                        self.photow < min_tile_size)
+        if self.virtual:
+            self.ncols = max(1, self.montage_size[0] // min_tile_size)
+            self.nrows = (self.nr_images + self.ncols - 1) // self.ncols
+            self.define_image_dim(self.montage_size,
+                                  self.ncols,
+                                  self.nrows)
+        # index: PIL image of the loaded tiles, in virtual mode
+        self.tiles = {}
+        # background loading of the tiles: the indices in view, the ones
+        # given to the pool and not collected yet, (index, image) of the
+        # finished ones, see load_wanted_tile
+        self.pool = None
+        self.wanted = frozenset()
+        self.pending = set()
+        self.finished = Queue.Queue()
  
     def draw_montage(self):
         """
@@ -55,33 +121,203 @@ class Montage:
             width = self.photow * self.ncols
         if self.photoh * self.nrows > self.montage_size[1]:
             height = self.photoh * self.nrows
-        self.montage = numpy.full(shape = (height, width, 3),
-                             fill_value = 0,
-                             dtype = numpy.uint8)
-        count = 0
-        # Insert each thumb:
-        for irow in range(self.nrows):
-            for icol in range(self.ncols):
-                left = icol * self.photow
-                right = left + self.photow
-                upper = irow * self.photoh
-                lower = upper + self.photoh
-                try:
-                    # Read in an image and resize
-                    image = cv2.imread(self.fnames[count])
-                    image = self.resize_image(image,
-                                              self.photow,
-                                              self.photoh,
-                                              self.force_square)
-                except IndexError:
-                    break
-                self.montage[upper:lower, left:right] = image
-                count += 1
-        b, g, r = cv2.split(self.montage)
-        self.montage = cv2.merge((r, g, b))
-        self.montage = Image.fromarray(self.montage)
+        # RGB buffer of the montage, the PIL image is made from it at the end
+        self.montage = None
+        self.buffer = numpy.full(shape = (height, width, 3),
+                                 fill_value = 0,
+                                 dtype = numpy.uint8)
+        # Insert each thumb: reading and resizing is done in a thread pool
+        # (openCV releases the GIL), thumbs are placed by their index so the
+        # order does not depend on which thread finishes first
+        if self.nr_workers > 1 and self.nr_images > 1:
+            pool = ThreadPool(min(self.nr_workers, self.nr_images))
+            try:
+                for index, image in pool.imap_unordered(
+                        self.load_tile, range(self.nr_images)):
+                    self.update_tile(index, image)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for index in range(self.nr_images):
+                self.update_tile(*self.load_tile(index))
+        self.montage = Image.fromarray(self.buffer)
         return self.montage
 
+    def load_tile(self, index):
+        """
+        reads in the image with the given index (starting from 0) and resizes
+        it to the tile size. Returns a tuple (index, image)
+        """
+        fname = self.fnames[index]
+        tile_size = (self.photow, self.photoh, self.force_square)
+        if self.cache is not None:
+            image = self.cache.get(fname, tile_size)
+            if image is not None:
+                return (index, image)
+        image = read_reduced(fname,
+                             self.photow,
+                             self.photoh,
+                             self.force_square)
+        image = self.resize_image(image,
+                                  self.photow,
+                                  self.photoh,
+                                  self.force_square)
+        if self.cache is not None:
+            self.cache.put(fname, tile_size, image)
+        return (index, image)
+
+    def update_tile(self, index, image):
+        """
+        puts the openCV image (BGR numpy array) in the tile with the given
+        index (starting from 0), resizing it if it is not tile sized. Only
+        the tile is converted to RGB and copied, also into the PIL image if
+        the montage was already drawn. Returns the (left, upper, right,
+        lower) box of the tile
+        """
+        if image.shape[:2] != (self.photoh, self.photow):
+            image = self.resize_image(image,
+                                      self.photow,
+                                      self.photoh,
+                                      self.force_square)
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        box = self.get_tile_box(index)
+        self.buffer[box[1]:box[3], box[0]:box[2]] = image
+        if self.montage is not None:
+            self.montage.paste(Image.fromarray(image), box[:2])
+        return box
+
+    def get_tile_box(self, index):
+        """
+        returns the (left, upper, right, lower) box of the tile with the given
+        index (starting from 0)
+        """
+        row, col = divmod(index, self.ncols)
+        left = col * self.photow
+        upper = row * self.photoh
+        return (left, upper, left + self.photow, upper + self.photoh)
+
+    def load_tiles(self, indices):
+        """
+        decodes the tiles with the given indices (starting from 0) that are
+        not loaded yet, in virtual mode instead of draw_montage
+        """
+        missing = [index for index in indices if index not in self.tiles]
+        if self.nr_workers > 1 and len(missing) > 1:
+            pool = ThreadPool(min(self.nr_workers, len(missing)))
+            try:
+                tiles = list(pool.imap_unordered(self.load_tile, missing))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            tiles = [self.load_tile(index) for index in missing]
+        for index, image in tiles:
+            self.tiles[index] = Image.fromarray(
+                cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+
+    def request_tiles(self, indices):
+        """
+        starts decoding the tiles with the given indices that are not loaded
+        or pending on worker threads, without waiting for them. A tile that
+        is no longer requested when a worker gets to it is skipped. Finished
+        tiles are picked up with collect_tiles
+        """
+        self.wanted = frozenset(indices)
+        self.start_loading(indices)
+
+    def start_loading(self, indices):
+        """
+        gives the tiles that are not loaded or pending to the pool
+        """
+        for index in indices:
+            if index in self.tiles or index in self.pending:
+                continue
+            if self.pool is None:
+                self.pool = ThreadPool(self.nr_workers)
+            self.pending.add(index)
+            self.pool.apply_async(self.load_wanted_tile, (index,),
+                                  callback=self.finished.put)
+
+    def load_wanted_tile(self, index):
+        """
+        runs on a worker thread, returns (index, image). The image is None if
+        the tile is not requested anymore and False if it cannot be read
+        """
+        if index not in self.wanted:
+            return (index, None)
+        try:
+            return self.load_tile(index)
+        except Exception:
+            return (index, False)
+
+    def collect_tiles(self):
+        """
+        stores the tiles decoded since the last call that are still
+        requested, returns their indices
+        """
+        collected = []
+        skipped = []
+        while True:
+            try:
+                index, image = self.finished.get(block=False)
+            except Queue.Empty:
+                break
+            self.pending.discard(index)
+            if image is None:
+                skipped.append(index)
+            elif image is not False and index in self.wanted:
+                self.tiles[index] = Image.fromarray(
+                    cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+                collected.append(index)
+        # a skipped tile can be back in view by now
+        self.start_loading([index for index in skipped
+                            if index in self.wanted])
+        return collected
+
+    def is_loading(self):
+        """
+        returns True if requested tiles are still decoding or not collected
+        """
+        return len(self.pending) > 0
+
+    def close(self):
+        """
+        stops the background loading, the pending tiles are skipped
+        """
+        self.wanted = frozenset()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def get_tile(self, index):
+        """
+        returns the loaded tile as a PIL image, None if it is not loaded
+        """
+        return self.tiles.get(index)
+
+    def drop_tiles(self, keep):
+        """
+        forgets the loaded tiles except the ones with indices in keep
+        """
+        keep = set(keep)
+        for index in self.tiles.keys():
+            if index not in keep:
+                del self.tiles[index]
+
+    def get_tiles_in_view(self, top, bottom):
+        """
+        returns the indices (starting from 0) of the images in the rows
+        between the top and bottom y coords
+        """
+        first_row = max(0, int(top) // self.photoh)
+        last_row = min(self.nrows - 1, int(bottom) // self.photoh)
+        return range(first_row * self.ncols,
+                     min(self.nr_images, (last_row + 1) * self.ncols))
+
+    def is_virtual(self):
+        return self.virtual
+
     def save_montage(self, path):
         self.montage.save(path)
 
@@ -105,7 +341,6 @@ class Montage:
                                      fill_value = 0,
                                      dtype = numpy.uint8)
             if image_width > image_height:
-                self.resize_factor = float(target_width) / image_width
                 image_height = target_height * (float(image_height) / image_width)
                 image_height = int(image_height)
                 image_width = target_width
@@ -113,7 +348,6 @@ class Montage:
                 image = cv2.resize(image, dsize = (image_width, image_height))
                 whole_image[start:(start + image_height), 0:image_width] = image
             else:
-                self.resize_factor = float(target_height) / image_height
                 image_width = target_width * (float(image_width) / image_height)
                 image_width = int(image_width)
                 image_height = target_height
@@ -122,15 +356,13 @@ class Montage:
                 whole_image[0:image_height, start:(start + image_width)] = image
             return whole_image
 
-    def get_resize_factor(self):
-        return self.resize_factor
-
     def get_image_center_from_coords(self, x, y):
         """
         returns the center of the image when given the x, y coords that are inside the borders of the montage
         will return center even if there is no image (i.e, there is only blank space)
         """
-        if x > self.montage_size[0] or y > self.montage_size[1] or x < 0 or y < 0:
+        width, height = self.get_total_size()
+        if x > width or y > height or x < 0 or y < 0:
             return None
         order = self.get_image_index(x, y)
         indices = self.get_image_indices(order)
@@ -146,7 +378,8 @@ class Montage:
         Will return an index even if there is no image in that part of the
         montage.
         """
-        if x > self.montage_size[0] or y > self.montage_size[1] or x < 0 or y < 0:
+        width, height = self.get_total_size()
+        if x > width or y > height or x < 0 or y < 0:
             return None
         col = (x - 1) / self.photow
         row = (y - 1) / self.photoh
@@ -191,6 +424,15 @@ class Montage:
         """
         return self.montage_size
 
+    def get_total_size(self):
+        """
+        returns the size of all tiles together, in virtual mode it is taller
+        than the montage size
+        """
+        if self.virtual:
+            return (self.ncols * self.photow, self.nrows * self.photoh)
+        return self.montage_size
+
     def get_image_size(self):
         """
         Returns the size of the individual image on the montage.
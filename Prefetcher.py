@@ -0,0 +1,111 @@
+import threading
+import Queue
+
+POLL_INTERVAL = 50  # ms between checks for finished work
+
+
+class Prefetcher:
+    """
+    Runs slow functions (decoding images, building montages) on worker
+    threads while the user works in the GUI, and hands the results back to the
+    Tk thread: finished results are collected by a callback scheduled with
+    master.after(), Tkinter objects should only be created there.
+
+    Results are kept in named slots. A slot remembers the key of the last
+    request, a result for any other key is stale and is dropped. E.g. if the
+    user deselects images, the prefetched first image for the cropper no longer
+    matches the key asked for and gets computed again.
+    """
+
+    def __init__(self, master, poll_interval=POLL_INTERVAL):
+        self.master = master
+        self.poll_interval = poll_interval
+        self.finished = Queue.Queue()
+        # slot: key of the last request
+        self.requested = {}
+        # slot: (key, result)
+        self.results = {}
+        # (slot, key): nr of workers still running
+        self.running = {}
+        self.poll_id = None
+
+    def prefetch(self, slot, key, function, *args):
+        """
+        starts computing function(*args) on a worker thread and stores the
+        result under slot and key. Does nothing if the key is already
+        requested in the slot
+        """
+        if self.requested.get(slot) == key:
+            return
+        self.requested[slot] = key
+        self.results.pop(slot, None)
+        worker = threading.Thread(target=self.work,
+                                  args=(slot, key, function, args))
+        worker.daemon = True
+        self.running[(slot, key)] = self.running.get((slot, key), 0) + 1
+        worker.start()
+        if self.poll_id is None:
+            self.poll_id = self.master.after(self.poll_interval, self.poll)
+
+    def get(self, slot, key, wait=True):
+        """
+        returns the prefetched result for the slot and key and removes it
+        from the slot. Returns None if nothing was prefetched for that key. If
+        the work is still running and wait is True, blocks until it finishes
+        """
+        self.collect()
+        while (wait and slot not in self.results and
+               self.requested.get(slot) == key and
+               (slot, key) in self.running):
+            self.collect(block=True)
+        if slot in self.results and self.results[slot][0] == key:
+            self.requested.pop(slot, None)
+            return self.results.pop(slot)[1]
+        return None
+
+    def cancel(self, slot):
+        """
+        drops the result of the slot, running work is ignored when it ends
+        """
+        self.requested.pop(slot, None)
+        self.results.pop(slot, None)
+
+    #### helper functions ##############################################
+
+    def work(self, slot, key, function, args):
+        """
+        runs on the worker thread. Errors are not raised, the result is
+        simply missing and the GUI computes it again when it needs it
+        """
+        try:
+            result = function(*args)
+            succeeded = True
+        except Exception:
+            result = None
+            succeeded = False
+        self.finished.put((slot, key, result, succeeded))
+
+    def collect(self, block=False):
+        """
+        moves finished results into their slots if they are not stale
+        """
+        while True:
+            try:
+                slot, key, result, succeeded = self.finished.get(block=block)
+            except Queue.Empty:
+                return
+            block = False
+            self.running[(slot, key)] -= 1
+            if self.running[(slot, key)] == 0:
+                del self.running[(slot, key)]
+            if succeeded and self.requested.get(slot) == key:
+                self.results[slot] = (key, result)
+
+    def poll(self):
+        """
+        called on the Tk thread with after() while work is running
+        """
+        self.poll_id = None
+        self.collect()
+        if len(self.running) > 0:
+            self.poll_id = self.master.after(self.poll_interval, self.poll)
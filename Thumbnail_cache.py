@@ -0,0 +1,159 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy
+
+CACHE_EXTENSION = '.npy'
+
+
+class Thumbnail_cache:
+    """
+    Persistent on-disk cache for the resized montage images, so reopening a
+    folder (or going back to a group) does not decode the originals again.
+
+    Every entry is a numpy file named after a hash of the original path, its
+    mtime and size, and the tile dimensions. An entry for a file that was
+    changed, or for a different tile size, is therefore never found and is
+    eventually evicted. The cache is bounded by max_size (in bytes), the least
+    recently used entries are removed first. File mtimes of the entries keep
+    the LRU order between sessions.
+
+    get and put can be called from multiple threads.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        # key: size in bytes, ordered from least to most recently used
+        self.entries = OrderedDict()
+        self.total_size = 0
+        self.load_entries()
+
+    def load_entries(self):
+        """
+        reads the existing entries from the cache directory, oldest first
+        """
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(CACHE_EXTENSION):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            found.append((stat.st_mtime, name[:-len(CACHE_EXTENSION)],
+                          stat.st_size))
+        for mtime, key, size in sorted(found):
+            self.entries[key] = size
+            self.total_size += size
+        with self.lock:
+            self.evict()
+
+    def get(self, path, tile_size):
+        """
+        returns the cached openCV image (numpy array) for the given file and
+        tile size, or None if there is no valid entry
+        """
+        try:
+            key = self.make_key(path, tile_size)
+        except OSError:
+            return None
+        with self.lock:
+            if key not in self.entries:
+                return None
+            # marking the entry as most recently used
+            self.entries[key] = self.entries.pop(key)
+        cache_path = self.get_cache_path(key)
+        try:
+            image = numpy.load(cache_path)
+            os.utime(cache_path, None)
+        except (IOError, OSError, ValueError):
+            with self.lock:
+                self.remove(key)
+            return None
+        return image
+
+    def put(self, path, tile_size, image):
+        """
+        stores the image for the given file and tile size, evicts the least
+        recently used entries if the cache is over its size
+        """
+        try:
+            key = self.make_key(path, tile_size)
+        except OSError:
+            return
+        cache_path = self.get_cache_path(key)
+        # writing to a temporary file first so that a crash or a reader in
+        # another thread never sees a half written entry
+        temp_path = '%s.%d.tmp' % (cache_path, threading.current_thread().ident)
+        try:
+            with open(temp_path, 'wb') as temp_file:
+                numpy.save(temp_file, image)
+            if os.path.exists(cache_path):
+                os.remove(cache_path)
+            os.rename(temp_path, cache_path)
+            size = os.path.getsize(cache_path)
+        except (IOError, OSError):
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+        with self.lock:
+            if key in self.entries:
+                self.total_size -= self.entries.pop(key)
+            self.entries[key] = size
+            self.total_size += size
+            self.evict()
+
+    def clear(self):
+        """
+        removes all entries
+        """
+        with self.lock:
+            for key in list(self.entries.keys()):
+                self.remove(key)
+
+    #### helper functions ##############################################
+
+    def make_key(self, path, tile_size):
+        """
+        the key is a hash of the absolute path, mtime and size of the original
+        file plus the tile size. Raises OSError if the file does not exist
+        """
+        stat = os.stat(path)
+        key = '|'.join([os.path.abspath(path),
+                        repr(stat.st_mtime),
+                        str(stat.st_size),
+                        'x'.join(str(value) for value in tile_size)])
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return hashlib.sha1(key).hexdigest()
+
+    def get_cache_path(self, key):
+        return os.path.join(self.directory, key + CACHE_EXTENSION)
+
+    def remove(self, key):
+        """
+        removes an entry, should be called with the lock held
+        """
+        size = self.entries.pop(key, None)
+        if size is not None:
+            self.total_size -= size
+        try:
+            os.remove(self.get_cache_path(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        removes least recently used entries until the cache fits its size,
+        should be called with the lock held
+        """
+        while self.total_size > self.max_size and len(self.entries) > 0:
+            key = next(iter(self.entries))
+            self.remove(key)
@@ -0,0 +1,165 @@
+import math
+import Tkinter as tk
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+
+class Tiled_view:
+    """
+    Shows a large image on a canvas at any zoom, drawing only the tiles in
+    view.
+
+    The image is given as a pyramid (see build_pyramid). Every tile of
+    tile_size display pixels is cut from the smallest level that still has at
+    least the resolution of the zoom and resized, so zooming out of a large
+    image does not resize the whole image. Canvas coordinates are the display
+    coordinates of the whole zoomed image (raw pixel * zoom), the canvas is at
+    most max_size (width, height) and scrolls over them. Tiles are tagged
+    'tile' and kept below the other canvas items, call draw after scrolling.
+    """
+
+    def __init__(self, canvas, pyramid, zoom, max_size, tile_size=256):
+        self.canvas = canvas
+        self.pyramid = pyramid
+        self.max_size = max_size
+        self.tile_size = tile_size
+        # (column, row): (canvas item, PhotoImage)
+        self.tiles = {}
+        self.zoom = zoom
+        self.configure_canvas()
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
+        self.draw()
+
+    def get_raw_size(self):
+        """
+        returns (width, height) of the image
+        """
+        return (self.pyramid[0].shape[1], self.pyramid[0].shape[0])
+
+    def get_size(self):
+        """
+        returns (width, height) of the whole zoomed image
+        """
+        width, height = self.get_raw_size()
+        return (max(1, int(round(width * self.zoom))),
+                max(1, int(round(height * self.zoom))))
+
+    def get_view_size(self):
+        """
+        returns (width, height) of the canvas
+        """
+        width, height = self.get_size()
+        return (min(width, self.max_size[0]), min(height, self.max_size[1]))
+
+    def set_zoom(self, zoom, x=None, y=None):
+        """
+        changes the zoom, keeping the image point at the widget coords x, y
+        (default is the center of the view) in place
+        """
+        if x is None or y is None:
+            x = self.get_view_size()[0] / 2
+            y = self.get_view_size()[1] / 2
+        raw_x = self.canvas.canvasx(x) / self.zoom
+        raw_y = self.canvas.canvasy(y) / self.zoom
+        self.zoom = zoom
+        self.clear()
+        self.configure_canvas()
+        width, height = self.get_size()
+        self.canvas.xview_moveto((raw_x * zoom - x) / float(width))
+        self.canvas.yview_moveto((raw_y * zoom - y) / float(height))
+        self.draw()
+
+    def configure_canvas(self):
+        width, height = self.get_size()
+        view_width, view_height = self.get_view_size()
+        self.canvas.config(width=view_width,
+                           height=view_height,
+                           scrollregion=(0, 0, width, height))
+
+    def draw(self):
+        """
+        creates the tiles in view and deletes the others
+        """
+        width, height = self.get_size()
+        view_width, view_height = self.get_view_size()
+        left = self.canvas.canvasx(0)
+        top = self.canvas.canvasy(0)
+        columns = range(max(0, int(left // self.tile_size)),
+                        min(int(math.ceil(width / float(self.tile_size))),
+                            int((left + view_width) // self.tile_size) + 1))
+        rows = range(max(0, int(top // self.tile_size)),
+                     min(int(math.ceil(height / float(self.tile_size))),
+                         int((top + view_height) // self.tile_size) + 1))
+        in_view = set((column, row) for column in columns for row in rows)
+        for tile in list(self.tiles.keys()):
+            if tile not in in_view:
+                self.canvas.delete(self.tiles.pop(tile)[0])
+        for tile in in_view:
+            if tile not in self.tiles:
+                self.tiles[tile] = self.make_tile(*tile)
+
+    def clear(self):
+        """
+        deletes all tiles, e.g. when the zoom changes
+        """
+        for item, image_tk in self.tiles.values():
+            self.canvas.delete(item)
+        self.tiles = {}
+
+    def make_tile(self, column, row):
+        """
+        cuts the tile from the pyramid, returns (canvas item, PhotoImage)
+        """
+        width, height = self.get_size()
+        x1 = column * self.tile_size
+        y1 = row * self.tile_size
+        x2 = min(width, x1 + self.tile_size)
+        y2 = min(height, y1 + self.tile_size)
+        level = self.get_level()
+        scale = level.shape[1] / float(self.pyramid[0].shape[1]) / self.zoom
+        level_x1 = min(int(x1 * scale), level.shape[1] - 1)
+        level_y1 = min(int(y1 * scale), level.shape[0] - 1)
+        level_x2 = max(level_x1 + 1,
+                       min(int(math.ceil(x2 * scale)), level.shape[1]))
+        level_y2 = max(level_y1 + 1,
+                       min(int(math.ceil(y2 * scale)), level.shape[0]))
+        # the levels can be flipped views
+        region = np.ascontiguousarray(
+            level[level_y1:level_y2, level_x1:level_x2])
+        if region.shape[1] > x2 - x1:
+            interpolation = cv2.INTER_AREA
+        else:
+            interpolation = cv2.INTER_NEAREST
+        region = cv2.resize(region, (x2 - x1, y2 - y1),
+                            interpolation=interpolation)
+        image_tk = ImageTk.PhotoImage(image=Image.fromarray(region))
+        item = self.canvas.create_image(x1, y1, image=image_tk, anchor=tk.NW,
+                                        tags=('tile',))
+        self.canvas.tag_lower(item)
+        return (item, image_tk)
+
+    def get_level(self):
+        """
+        returns the smallest pyramid level with at least the zoom's resolution
+        """
+        width = float(self.pyramid[0].shape[1])
+        for level in reversed(self.pyramid):
+            if level.shape[1] / width >= self.zoom:
+                return level
+        return self.pyramid[0]
+
+
+def build_pyramid(image, min_size):
+    """
+    returns [image, image at half size, at a quarter, ...], halving until the
+    larger side is at most min_size
+    """
+    levels = [image]
+    while max(levels[-1].shape[0:2]) > min_size:
+        height, width = levels[-1].shape[0:2]
+        levels.append(cv2.resize(levels[-1],
+                                 ((width + 1) // 2, (height + 1) // 2),
+                                 interpolation=cv2.INTER_AREA))
+    return levels
@@ -0,0 +1,481 @@
+"""
+Times the hot paths of the tagger on a synthetic image tree, without the GUI:
+drawing a montage (Montage.draw_montage), the rotated whole image crop
+(Cropper.crop_rectangle), rotate_image.rotate_image and the directory scan of
+Image_list. Reports the throughput (images/s and MB/s) and the peak memory of
+each benchmark, and saves the results as JSON so runs of different commits
+can be compared.
+
+    python benchmark.py [-t <tree_path>] [-f 4] [-n 25] [-W 2000] [-H 1500]
+                        [-e jpg] [-r 3] [-j results.json] [-c old.json]
+    python benchmark.py -m
+
+The tree is generated in tree_path (a temporary directory by default) and
+reused if it was generated with the same parameters. Every benchmark runs in
+its own process, so the peak memory (ru_maxrss) is its own. The peak memory
+is not measured on Windows, it is reported as n/a. The times are the best of
+the repeats. MB/s is per MB of image files for the montage and the scan, per
+MB of decoded pixels for the crop and the rotation. With -m only the memory
+taken by the groups of large (made up) trees is compared, as one dict per
+group and in the Group_table of Image_list.
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+try:
+    import resource
+except ImportError:
+    # not on Windows, the peak memory is not reported there
+    resource = None
+import numpy as np
+import cv2
+from collections import deque
+import rotate_image as rotate
+import geometry
+from Montage import Montage
+from Image_list import Image_list, Group_table
+from Image_writer import Image_writer
+from Cropper import crop_rectangle
+from config import (MONTAGE_WIDTH, MONTAGE_HEIGHT, MONTAGE_WORKERS,
+                    SCAN_WORKERS, CROP_WRITER_WORKERS, CROP_WRITER_QUEUE_SIZE,
+                    CROP_WRITE_PARAMS)
+
+TREE_FILENAME = 'benchmark_tree.json'
+BENCHMARKS = ['montage', 'crop', 'rotate', 'scan']
+# (nr_folders, images_per_folder, size_of_group) of the group memory trees
+GROUP_MEMORY_TREES = [(100, 10000, 12), (1000, 1000, 50), (10000, 100, 100)]
+# rotation of the crops, in degrees
+ANGLE = 12.5
+
+
+#### synthetic images ##################################################
+
+def make_tree(tree_path, nr_folders, images_per_folder, width, height,
+              extension):
+    """
+    writes nr_folders subfolders of images_per_folder images to tree_path,
+    unless it already holds a tree with the same parameters. Returns the
+    parameters of the tree
+    """
+    params = {'nr_folders': nr_folders,
+              'images_per_folder': images_per_folder,
+              'width': width,
+              'height': height,
+              'extension': extension}
+    params_path = os.path.join(tree_path, TREE_FILENAME)
+    if os.path.isfile(params_path):
+        with open(params_path, 'r') as params_file:
+            if json.load(params_file) == params:
+                return params
+        shutil.rmtree(tree_path)
+    elif os.path.isdir(tree_path) and len(os.listdir(tree_path)) > 0:
+        raise IOError('Error: ' + tree_path + ' is not empty and was not '
+                      'generated by the benchmark!')
+    if not os.path.exists(tree_path):
+        os.makedirs(tree_path)
+    random_state = np.random.RandomState(0)
+    for folder in range(nr_folders):
+        folder_path = os.path.join(tree_path, 'folder_%03d' % folder)
+        os.makedirs(folder_path)
+        for image in range(images_per_folder):
+            cv2.imwrite(
+                os.path.join(folder_path, 'image_%05d.%s' % (image, extension)),
+                make_image(width, height, random_state))
+    # written last, a partly generated tree is generated again
+    with open(params_path, 'w') as params_file:
+        json.dump(params, params_file)
+    return params
+
+
+def make_image(width, height, random_state):
+    """
+    returns a BGR image of smooth color blobs with some noise, which encodes
+    to a realistic size unlike pure noise
+    """
+    blobs = random_state.randint(0, 256, size=(6, 8, 3)).astype(np.uint8)
+    image = cv2.resize(blobs, (width, height), interpolation=cv2.INTER_CUBIC)
+    noise = random_state.randint(-8, 9, size=(height, width, 1))
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def get_tree_images(tree_path):
+    """
+    returns the image paths of the tree, sorted by folder
+    """
+    paths = []
+    for root, dirs, files in os.walk(tree_path):
+        dirs.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(files)
+                     if name != TREE_FILENAME)
+    return paths
+
+
+def get_folders(tree_path):
+    return sorted(os.path.join(tree_path, name)
+                  for name in os.listdir(tree_path)
+                  if os.path.isdir(os.path.join(tree_path, name)))
+
+
+#### benchmarks ########################################################
+
+def benchmark_montage(tree_path, repeat):
+    """
+    draws the montage of every folder, without the thumbnail cache
+    """
+    folders = [get_tree_images(folder) for folder in get_folders(tree_path)]
+
+    def run():
+        for filenames in folders:
+            Montage(filenames,
+                    (MONTAGE_WIDTH, MONTAGE_HEIGHT),
+                    (1, 2),
+                    False,
+                    nr_workers=MONTAGE_WORKERS).draw_montage()
+    filenames = [name for names in folders for name in names]
+    return (get_best_time(run, repeat), len(filenames),
+            get_file_size(filenames))
+
+
+def benchmark_crop(tree_path, repeat):
+    """
+    crops a rotated rectangle from the middle of every image and saves it,
+    the images are decoded outside of the timing
+    """
+    output_path = tempfile.mkdtemp(prefix='benchmark_crops_')
+    try:
+        writer = Image_writer(CROP_WRITER_WORKERS, CROP_WRITER_QUEUE_SIZE)
+        seconds = 0
+        nr_bytes = 0
+        paths = get_tree_images(tree_path)
+        for path in paths:
+            raw_image = cv2.imread(path, 1)
+            nr_bytes += raw_image.nbytes
+            corners = get_crop_corners(raw_image)
+            save_path = os.path.join(output_path, os.path.basename(path))
+
+            def run():
+                crop = crop_rectangle(raw_image, corners, np.radians(-ANGLE),
+                                      False)[0]
+                writer.write(save_path, crop, CROP_WRITE_PARAMS)
+                writer.flush()
+            seconds += get_best_time(run, repeat)
+        writer.close()
+    finally:
+        shutil.rmtree(output_path)
+    return (seconds, len(paths), nr_bytes)
+
+
+def benchmark_rotate(tree_path, repeat):
+    """
+    rotates every whole image, decoded outside of the timing
+    """
+    seconds = 0
+    nr_bytes = 0
+    paths = get_tree_images(tree_path)
+    for path in paths:
+        raw_image = cv2.imread(path, 1)
+        nr_bytes += raw_image.nbytes
+        seconds += get_best_time(
+            lambda: rotate.rotate_image(raw_image, ANGLE, cv2.INTER_AREA),
+            repeat)
+    return (seconds, len(paths), nr_bytes)
+
+
+def benchmark_scan(tree_path, repeat):
+    """
+    lists the tree and builds the folder groups, without the scan index
+    """
+    paths = get_tree_images(tree_path)
+    seconds = get_best_time(
+        lambda: Image_list(directory=tree_path, scan_workers=SCAN_WORKERS),
+        repeat)
+    return (seconds, len(paths), get_file_size(paths))
+
+
+def get_crop_corners(raw_image):
+    """
+    returns the corners of a rectangle over the middle half of the image,
+    drawn and rotated by ANGLE in the cropper
+    """
+    height, width = raw_image.shape[0:2]
+    return geometry.rotate_points(
+        geometry.rectangle_corners(width / 4, height / 4,
+                                   width * 3 / 4, height * 3 / 4),
+        (width / 2, height / 2),
+        np.radians(-ANGLE))
+
+
+#### group memory ####################################################
+
+def get_deep_size(obj, seen=None):
+    """
+    returns the bytes taken by the object and everything it references,
+    counting shared objects (eg. interned strings) once
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += get_deep_size(key, seen) + get_deep_size(value, seen)
+    elif isinstance(obj, (list, tuple, set, deque)):
+        for item in obj:
+            size += get_deep_size(item, seen)
+    elif hasattr(obj, '__slots__'):
+        for name in obj.__slots__:
+            size += get_deep_size(getattr(obj, name, None), seen)
+    return size
+
+
+def compare_group_memory(nr_folders, images_per_folder, size_of_group):
+    """
+    returns the bytes taken by the groups of a synthetic tree when stored as
+    one dict per group (the old layout) and in a Group_table
+    """
+    # only the names are made up, no files are read
+    path = '/images'
+    folders = [(path + '/camera_' + str(folder),
+                ['IMG_%06d.jpg' % image for image in range(images_per_folder)])
+               for folder in range(nr_folders)]
+
+    dicts = []
+    for root, images in folders:
+        for counter, start in enumerate(
+                range(0, len(images), size_of_group), 1):
+            filenames = images[start:start + size_of_group]
+            dicts.append({
+                'full_dir': root,
+                'relative_dir': re.split(path, root)[1],
+                'group_name': 'root' + re.split(path, root)[1] +
+                              '#' + str(counter),
+                'filenames': filenames,
+                'repeated': False,
+                'count': len(filenames)
+            })
+
+    table = Group_table()
+    groups = []
+    for root, images in folders:
+        directory_id = table.add_directory(root, re.split(path, root)[1])
+        for counter, start in enumerate(
+                range(0, len(images), size_of_group), 1):
+            groups.append(table.add_group(
+                'root' + re.split(path, root)[1] + '#' + str(counter),
+                directory_id, images[start:start + size_of_group]))
+
+    # the filename strings are shared by both layouts, they are left out
+    filename_strings = set(id(image) for root, images in folders
+                           for image in images)
+    return (get_deep_size(dicts, set(filename_strings)),
+            get_deep_size(groups, set(filename_strings)))
+
+
+def print_group_memory():
+    """
+    prints the memory taken by the groups of large trees in both layouts
+    """
+    for nr_folders, images_per_folder, size_of_group in GROUP_MEMORY_TREES:
+        dict_size, table_size = compare_group_memory(
+            nr_folders, images_per_folder, size_of_group)
+        print '%d folders x %d images, groups of %d: dicts %.1f MB, ' \
+            'table %.1f MB (%.0f%%)' % (
+                nr_folders, images_per_folder, size_of_group,
+                dict_size / 1024. ** 2, table_size / 1024. ** 2,
+                100. * table_size / dict_size)
+
+
+#### running and reporting #############################################
+
+def run_benchmark(name, tree_path, repeat):
+    """
+    runs the benchmark in a separate process, returns its results as a dict
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_in_process,
+                                      args=(queue, name, tree_path, repeat))
+    process.start()
+    result = queue.get()
+    process.join()
+    if 'error' in result:
+        raise RuntimeError(name + ': ' + result['error'])
+    return result
+
+
+def run_in_process(queue, name, tree_path, repeat):
+    try:
+        function = globals()['benchmark_' + name]
+        seconds, nr_images, nr_bytes = function(tree_path, repeat)
+        queue.put({'seconds': seconds,
+                   'images': nr_images,
+                   'megabytes': nr_bytes / 1024. ** 2,
+                   'images_per_s': nr_images / max(seconds, 1e-9),
+                   'mb_per_s': nr_bytes / 1024. ** 2 / max(seconds, 1e-9),
+                   'peak_memory_mb': to_megabytes(get_peak_memory())})
+    except Exception as error:
+        queue.put({'error': repr(error)})
+
+
+def get_best_time(function, repeat):
+    """
+    returns the fastest of repeat runs, in seconds
+    """
+    best = None
+    for idx in range(repeat):
+        start = time.time()
+        function()
+        seconds = time.time() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best
+
+
+def get_peak_memory():
+    """
+    returns the peak resident memory of this process, in bytes, None if it
+    cannot be measured
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
+
+
+def to_megabytes(nr_bytes):
+    if nr_bytes is None:
+        return None
+    return nr_bytes / 1024. ** 2
+
+
+def get_file_size(paths):
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def get_commit():
+    """
+    returns the current git commit, or None outside of a git repository
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    """
+    prints a table of the results, with the change in time relative to the
+    baseline results if given
+    """
+    print '%-8s %8s %8s %10s %10s %10s' % (
+        'name', 'images', 'seconds', 'images/s', 'MB/s', 'peak MB'),
+    print '  change' if baseline is not None else ''
+    for name in BENCHMARKS:
+        if name not in results['benchmarks']:
+            continue
+        result = results['benchmarks'][name]
+        if result['peak_memory_mb'] is None:
+            peak_memory = '%10s' % 'n/a'
+        else:
+            peak_memory = '%10.1f' % result['peak_memory_mb']
+        print '%-8s %8d %8.2f %10.1f %10.1f %s' % (
+            name, result['images'], result['seconds'],
+            result['images_per_s'], result['mb_per_s'], peak_memory),
+        old = None
+        if baseline is not None:
+            old = baseline['benchmarks'].get(name)
+        if old is not None:
+            print '%+7.1f%%' % (100. * (result['seconds'] - old['seconds']) /
+                                max(old['seconds'], 1e-9))
+        else:
+            print ''
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='times the montage, crop, rotation and scan on '
+        'synthetic images')
+    argparser.add_argument(
+        '--tree_path', '-t', default=None,
+        help='where to generate the images, default is a temporary '
+        'directory that is removed afterwards')
+    argparser.add_argument(
+        '--folders', '-f', type=int, default=4,
+        help='nr of folders (groups) in the tree')
+    argparser.add_argument(
+        '--images', '-n', type=int, default=25,
+        help='nr of images per folder')
+    argparser.add_argument(
+        '--width', '-W', type=int, default=2000, help='image width')
+    argparser.add_argument(
+        '--height', '-H', type=int, default=1500, help='image height')
+    argparser.add_argument(
+        '--extension', '-e', default='jpg',
+        help='image format, e.g. jpg, png or tif')
+    argparser.add_argument(
+        '--repeat', '-r', type=int, default=3,
+        help='nr of runs of every benchmark, the fastest is reported')
+    argparser.add_argument(
+        '--benchmarks', '-b', nargs='+', default=BENCHMARKS,
+        choices=BENCHMARKS, help='benchmarks to run, default is all')
+    argparser.add_argument(
+        '--json', '-j', default=None, help='file to save the results to')
+    argparser.add_argument(
+        '--compare', '-c', default=None,
+        help='results of an earlier run (JSON) to compare the times with')
+    argparser.add_argument(
+        '--group_memory', '-m', action='store_true',
+        help='only compare the memory taken by the groups of large trees '
+        'as dicts and in a Group_table, no images are generated')
+    args = argparser.parse_args()
+
+    if args.group_memory:
+        print_group_memory()
+        return
+
+    tree_path = args.tree_path or tempfile.mkdtemp(prefix='benchmark_tree_')
+    try:
+        print 'MESSAGE: generating or reusing the images in ' + tree_path
+        tree = make_tree(tree_path, args.folders, args.images, args.width,
+                         args.height, args.extension)
+        results = {'commit': get_commit(),
+                   'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'python': sys.version.split()[0],
+                   'opencv': cv2.__version__,
+                   'tree': tree,
+                   'repeat': args.repeat,
+                   'benchmarks': {}}
+        for name in args.benchmarks:
+            results['benchmarks'][name] = run_benchmark(name, tree_path,
+                                                        args.repeat)
+    finally:
+        if args.tree_path is None:
+            shutil.rmtree(tree_path)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+    if args.json is not None:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=1, sort_keys=True)
+        print 'MESSAGE: results saved to ' + args.json
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,61 @@ MONTAGE_WIDTH = 1400
 MONTAGE_HEIGHT = 700
 QUESTION_WIDTH = 30  # width of the question buttons
 ZOOM_LEVEL = 0.5   # zoom level for images when cropping
+DETAIL_ZOOM_LEVEL = 2  # zoom level for the crops when cropping the detail
+# largest size of the cropper image, larger images scroll
+CROPPER_WIDTH = 1400
+CROPPER_HEIGHT = 800
+CROPPER_MAX_ZOOM = 4
+
+# performance parameters
+MONTAGE_WORKERS = 4  # threads decoding and resizing montage tiles
+# montages of large groups scroll instead of shrinking the tiles below this
+# size (pixels), only the tiles in view and MONTAGE_VIEW_MARGIN rows around
+# them are loaded
+MONTAGE_MIN_TILE_SIZE = 100
+MONTAGE_VIEW_MARGIN = 2
+# montage thumbnails are cached in this subfolder of the output path
+THUMBNAIL_CACHE_DIR = 'thumbnails'
+THUMBNAIL_CACHE_SIZE = 500 * 1024 ** 2  # in bytes
+PREFETCH_POLL_INTERVAL = 50  # ms between checks for prefetched montages
+                             # and montage tiles
+# the pop-up of an original image keeps this many bytes of decoded images and
+# zooms in up to VIEWER_MAX_ZOOM times the original size
+VIEWER_CACHE_SIZE = 200 * 1024 ** 2
+VIEWER_MAX_ZOOM = 2.0
+CROPPER_PRELOAD_SIZE = 3  # nr of upcoming images the cropper prepares
+# the cropper draws the image in tiles of this size (pixels), cut from an
+# image pyramid built once per image
+CROPPER_TILE_SIZE = 256
+# the cropper keeps the decoded image and the crops of the group in memory up
+# to this size (in bytes), the detail crops are cut from those. A decoded 24
+# megapixel image takes about 100 MB with its display pyramid
+CROPPER_CACHE_SIZE = 300 * 1024 ** 2
+# crops are saved by background threads, through a queue of this size
+CROP_WRITER_WORKERS = 2
+CROP_WRITER_QUEUE_SIZE = 8
+# openCV imwrite parameters, e.g. [cv2.IMWRITE_JPEG_QUALITY, 95]
+CROP_WRITE_PARAMS = []
+# listing of the image path, kept in the output path between runs
+SCAN_INDEX_FILENAME = 'scan_index.json'
+SCAN_WORKERS = 8  # threads walking the top level subfolders
+# where the annotations are stored: 'csv' for groups.csv and crop.csv, or
+# 'sqlite' for a database (export it with Annotation_store.py)
+STORAGE_BACKEND = 'csv'
+SQLITE_FILENAME = 'annotations.db'
+# last finished group, kept in the output path to resume without reading the
+# whole groups.csv
+CHECKPOINT_FILENAME = 'checkpoint.json'
+# groups.csv and crop.csv are synced to disk every CSV_FSYNC_EVERY rows and on
+# exit (0 is only on exit). Every row is flushed to the OS anyway, so only a
+# power failure can lose the unsynced rows. fsync blocks the GUI, syncing
+# every row makes saving slow on some disks
+CSV_FSYNC_EVERY = 20
+# generate the groups while walking the image path instead of listing it all
+# first (can be turned on with --stream), keeping GROUP_LOOKAHEAD groups ahead
+# and GROUP_LOOKAHEAD finished groups in memory
+STREAM_GROUPS = False
+GROUP_LOOKAHEAD = 16
 
 # required sections for the questions definitions
 REQUIRED_QUESTION_SECTIONS = ['name', 'description', 'answers', 'open_ended']
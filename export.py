@@ -0,0 +1,265 @@
+"""
+Exports the annotations (crop.csv joined with groups.csv on group_id, or the
+SQLite database) to a columnar bundle: one NumPy .npy file per column and a
+meta.json describing them. Data loaders can memory-map the columns instead of
+parsing crop.csv row by row.
+
+    python export.py -o <output_path> -d <bundle_path> [-b sqlite]
+
+Coordinates are int32, rotations float32 and flips int8 arrays. Missing
+detail crops are -1 (NaN for the rotation), see has_detail. Filenames are
+fixed width byte strings. Tags are dictionary encoded: an int32 code per row
+and a <column>.dictionary.npy with the values (-1 if there is no value).
+Image tags are prefixed with image_, group tags with group_. Question names
+that would give two columns the same name or file are refused before anything
+is written. Use load_columns to read a bundle.
+"""
+import os
+import re
+import json
+import argparse
+import numpy as np
+from Annotation_store import make_store, NR_WHOLE_COLUMNS, NR_DETAIL_COLUMNS
+from config import STORAGE_BACKEND, SQLITE_FILENAME, CHECKPOINT_FILENAME
+
+BUNDLE_VERSION = 1
+# name and dtype of the whole image crop columns, None for strings. The
+# group_id column is dictionary encoded
+WHOLE_COLUMNS = [
+    ("group_id", 'dictionary'),
+    ("image_filename", None),
+    ("rotation_degrees", np.float32),
+    ("upperleft_x", np.int32), ("upperleft_y", np.int32),
+    ("lowerright_x", np.int32), ("lowerright_y", np.int32),
+    ("flip_state", np.int8)
+]
+DETAIL_COLUMNS = [
+    ("logo_filename", None),
+    ("rotation_degrees_detail", np.float32),
+    ("upperleft_x_detail", np.int32), ("upperleft_y_detail", np.int32),
+    ("lowerright_x_detail", np.int32), ("lowerright_y_detail", np.int32),
+    ("flip_state_detail", np.int8)
+]
+
+
+class Dictionary_encoder:
+    """
+    gives every distinct value an int code, in order of appearance
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value):
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+
+def export_columns(store, bundle_path):
+    """
+    writes the annotations of the store as a columnar bundle to bundle_path,
+    returns the nr of rows
+    """
+    group_question_names, image_question_names = store.get_question_names()
+    check_column_names(group_question_names, image_question_names)
+    # the last row of a group wins, like when resuming
+    group_answers = dict(store.iter_groups())
+
+    # python lists per column, converted to arrays at the end
+    whole = [[] for column in WHOLE_COLUMNS]
+    detail = [[] for column in DETAIL_COLUMNS]
+    has_detail = []
+    image_tags = [[] for name in image_question_names]
+    group_tags = [[] for name in group_question_names]
+    encoders = {}
+
+    for whole_values, answers, detail_values in store.iter_crops():
+        for idx, value in enumerate(whole_values):
+            whole[idx].append(value)
+        has_detail.append(detail_values is not None)
+        if detail_values is None:
+            detail_values = [None] * NR_DETAIL_COLUMNS
+        for idx, value in enumerate(detail_values):
+            detail[idx].append(value)
+        for idx, answer in enumerate(answers):
+            image_tags[idx].append(answer)
+        answers = group_answers.get(whole_values[0])
+        for idx in range(len(group_question_names)):
+            if answers is None or idx >= len(answers):
+                group_tags[idx].append(None)
+            else:
+                group_tags[idx].append(answers[idx])
+
+    if not os.path.exists(bundle_path):
+        os.makedirs(bundle_path)
+    columns = []
+    for (name, dtype), values in zip(WHOLE_COLUMNS + DETAIL_COLUMNS,
+                                     whole + detail):
+        if dtype == 'dictionary':
+            columns.append(save_dictionary_column(bundle_path, name, values))
+        elif dtype is None:
+            columns.append(save_column(bundle_path, name,
+                                       to_string_array(values)))
+        else:
+            columns.append(save_column(bundle_path, name,
+                                       to_number_array(values, dtype)))
+    columns.append(save_column(bundle_path, 'has_detail',
+                               np.array(has_detail, dtype=np.bool_)))
+    for name, values in zip(image_question_names, image_tags):
+        columns.append(save_dictionary_column(bundle_path, 'image_' + name,
+                                              values))
+    for name, values in zip(group_question_names, group_tags):
+        columns.append(save_dictionary_column(bundle_path, 'group_' + name,
+                                              values))
+
+    meta = {'version': BUNDLE_VERSION,
+            'nr_rows': len(has_detail),
+            'columns': columns}
+    with open(os.path.join(bundle_path, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file, indent=1)
+    return len(has_detail)
+
+
+def load_columns(bundle_path, mmap=True):
+    """
+    returns ({column name: array}, {column name: dictionary values}) of the
+    bundle, the arrays are memory-mapped unless mmap is False
+    """
+    with open(os.path.join(bundle_path, 'meta.json'), 'r') as meta_file:
+        meta = json.load(meta_file)
+    mmap_mode = 'r' if mmap else None
+    columns = {}
+    dictionaries = {}
+    for column in meta['columns']:
+        columns[column['name']] = np.load(
+            os.path.join(bundle_path, column['file']), mmap_mode=mmap_mode)
+        if column['encoding'] == 'dictionary':
+            dictionaries[column['name']] = np.load(
+                os.path.join(bundle_path, column['dictionary_file']))
+    return columns, dictionaries
+
+
+#### helper functions ##################################################
+
+def check_column_names(group_question_names, image_question_names):
+    """
+    raises ValueError if two columns would get the same name or file, the
+    filenames are compared without case for Windows and macOS
+    """
+    names = [name for name, dtype in WHOLE_COLUMNS + DETAIL_COLUMNS]
+    names.append('has_detail')
+    names.extend('image_' + name for name in image_question_names)
+    names.extend('group_' + name for name in group_question_names)
+    seen = {}
+    for name in names:
+        filename = get_column_filename(name).lower()
+        # a dictionary encoded column also has a .dictionary.npy file
+        filenames = [filename + '.npy', filename + '.dictionary.npy']
+        for other in filenames:
+            if other in seen:
+                raise ValueError('columns ' + repr(seen[other]) + ' and ' +
+                                 repr(name) + ' would both be saved as ' +
+                                 other + ', rename one of the questions')
+        for other in filenames:
+            seen[other] = name
+
+
+def save_column(bundle_path, name, array, encoding='plain'):
+    """
+    saves the array, returns its meta.json entry
+    """
+    filename = get_column_filename(name) + '.npy'
+    np.save(os.path.join(bundle_path, filename), array)
+    return {'name': name,
+            'file': filename,
+            'dtype': array.dtype.str,
+            'encoding': encoding}
+
+
+def save_dictionary_column(bundle_path, name, values):
+    """
+    saves the codes and the dictionary of the values (None is -1), returns
+    the meta.json entry
+    """
+    encoder = Dictionary_encoder()
+    codes = np.array([encoder.encode(to_bytes(value)) for value in values],
+                     dtype=np.int32)
+    column = save_column(bundle_path, name, codes, 'dictionary')
+    column['dictionary_file'] = get_column_filename(name) + '.dictionary.npy'
+    np.save(os.path.join(bundle_path, column['dictionary_file']),
+            to_string_array(encoder.values))
+    return column
+
+
+def get_column_filename(name):
+    """
+    question names can contain any character, filenames keep only the safe
+    ones
+    """
+    return re.sub('[^0-9A-Za-z_.-]+', '_', name)
+
+
+def to_number_array(values, dtype):
+    """
+    converts the values (numbers or strings as read from the csv) to an
+    array, missing ones become NaN for floats and -1 for integers
+    """
+    missing = np.nan if np.issubdtype(dtype, np.floating) else -1
+    array = np.empty(len(values), dtype=dtype)
+    for idx, value in enumerate(values):
+        if value is None or value == '':
+            array[idx] = missing
+        elif np.issubdtype(dtype, np.floating):
+            array[idx] = float(value)
+        else:
+            array[idx] = int(float(value))
+    return array
+
+
+def to_string_array(values):
+    """
+    fixed width byte strings, missing values are empty
+    """
+    values = [to_bytes(value) or '' for value in values]
+    if len(values) == 0:
+        return np.array([], dtype='S1')
+    return np.array(values, dtype='S')
+
+
+def to_bytes(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if value is None:
+        return None
+    return str(value)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description='exports the annotations to one .npy file per column')
+    argparser.add_argument(
+        '--output_path', '-o', required=True,
+        help='output path used when tagging, with crop.csv and groups.csv '
+        'or the database')
+    argparser.add_argument(
+        '--bundle_path', '-d', required=True,
+        help='directory where to write the columns')
+    argparser.add_argument(
+        '--backend', '-b', default=STORAGE_BACKEND,
+        help='csv or sqlite, default is STORAGE_BACKEND in config.py')
+    args = argparser.parse_args()
+
+    # only reading: the files are not repaired and the checkpoint is kept
+    store = make_store(args.backend, args.output_path, None, None,
+                       checkpoint_filename=CHECKPOINT_FILENAME,
+                       sqlite_filename=SQLITE_FILENAME, read_only=True)
+    nr_rows = export_columns(store, args.bundle_path)
+    store.close()
+    print 'exported ' + str(nr_rows) + ' crops to ' + args.bundle_path
@@ -0,0 +1,117 @@
+"""
+Rectangle, rotation and affine helpers on numpy arrays.
+
+Points are arrays of shape (..., 2) holding (x, y) in image coordinates,
+i.e. the upperleft corner is 0, 0 and y points down. All functions work on a
+single point, a list of points (n, 2) or a batch of lists (m, n, 2), e.g. the
+corners of many rectangles. Centers (..., 2) and angles (...) of a batch have
+the leading dimensions of the points without the point axis.
+"""
+import numpy as np
+
+
+def rectangle_corners(x1, y1, x2, y2):
+    """
+    returns the four corners (..., 4, 2) of the rectangle spanned by (x1, y1)
+    and (x2, y2), in the order (x1, y1), (x2, y1), (x2, y2), (x1, y2)
+    """
+    x1, y1, x2, y2 = np.broadcast_arrays(x1, y1, x2, y2)
+    return np.stack([np.stack([x1, y1], axis=-1),
+                     np.stack([x2, y1], axis=-1),
+                     np.stack([x2, y2], axis=-1),
+                     np.stack([x1, y2], axis=-1)], axis=-2)
+
+
+def offset_points(points, center):
+    """
+    returns the points as offsets from the center
+    """
+    points = np.asarray(points)
+    return points - _expand_center(points, center)
+
+
+def rotate_points(points, center, angle_radians):
+    """
+    rotates the points around the center, for use in coordinate systems where
+    upperleft corner is 0, 0 (a positive angle turns clockwise on the screen)
+    """
+    points = np.asarray(points, dtype=float)
+    center = _expand_center(points, center)
+    angle_radians = np.asarray(angle_radians, dtype=float)
+    if points.ndim > 1:
+        angle_radians = angle_radians[..., np.newaxis]
+    cos = np.cos(angle_radians)
+    sin = np.sin(angle_radians)
+    x = points[..., 0] - center[..., 0]
+    y = points[..., 1] - center[..., 1]
+    rotated = np.stack([x * cos + y * sin, -x * sin + y * cos], axis=-1)
+    return rotated + center
+
+
+def bounding_corners(points):
+    """
+    returns the upperleft and lowerright corner (each (..., 2)) of the axis
+    aligned box around the points (..., n, 2). Like the image, the lowerright
+    corner does not go below 0
+    """
+    points = np.asarray(points)
+    upperleft = points.min(axis=-2)
+    lowerright = np.maximum(points.max(axis=-2), 0)
+    return upperleft, lowerright
+
+
+def round_half_away(values):
+    """
+    rounds like Python's round: halves are rounded away from zero, while
+    numpy rounds them to the nearest even number
+    """
+    values = np.asarray(values, dtype=float)
+    return np.sign(values) * np.floor(np.abs(values) + 0.5)
+
+
+def translation_matrix(dx, dy):
+    """
+    returns the 3x3 affine matrix of a 2D translation of (dx, dy)
+    """
+    return np.array([[1, 0, dx], [0, 1, dy], [0, 0, 1]], dtype=float)
+
+
+def flip_matrix(width):
+    """
+    returns the 3x3 affine matrix flipping an image of the width left to right,
+    same as cv2.flip(image, 1)
+    """
+    return np.array([[-1, 0, width - 1], [0, 1, 0], [0, 0, 1]], dtype=float)
+
+
+def rotation_matrix(center, angle_degrees, scale=1.0):
+    """
+    returns the 3x3 affine matrix rotating by angle_degrees about the center,
+    same as cv2.getRotationMatrix2D (a positive angle turns counterclockwise
+    on the screen)
+    """
+    alpha = scale * np.cos(np.radians(angle_degrees))
+    beta = scale * np.sin(np.radians(angle_degrees))
+    return np.array([
+        [alpha, beta, (1 - alpha) * center[0] - beta * center[1]],
+        [-beta, alpha, beta * center[0] + (1 - alpha) * center[1]],
+        [0, 0, 1]], dtype=float)
+
+
+def transform_points(matrix, points):
+    """
+    applies the affine matrix (2x3 or 3x3) to the points
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    points = np.asarray(points, dtype=float)
+    return points.dot(matrix[0:2, 0:2].T) + matrix[0:2, 2]
+
+
+def _expand_center(points, center):
+    """
+    adds the point axis to a batch of centers so they broadcast with points
+    """
+    center = np.asarray(center)
+    if points.ndim > 1:
+        center = center[..., np.newaxis, :]
+    return center
@@ -29,6 +29,14 @@ argparser.add_argument(
     'each group will contain images from the whole folder'
 )
 
+argparser.add_argument(
+    '--stream', action='store_true', default=STREAM_GROUPS,
+    help='generate the groups while walking the image folders instead of '
+    'listing them all first. Tagging starts right away and memory stays '
+    'flat on very large image trees, but the progress is unknown until the '
+    'walk is done'
+)
+
 args = argparser.parse_args()
 
 if args.image_path:
@@ -61,7 +69,8 @@ group_tagger = Group_tagger(
     image_question_definitions=image_questions,
     image_dir=args.image_path,
     size_of_group=args.size_of_group,
-    output_path=args.output_path)
+    output_path=args.output_path,
+    stream=args.stream)
 
 group_tagger.run()
 
@@ -0,0 +1,208 @@
+"""
+Regenerates the whole and detail crops listed in crop.csv from the source
+images, without the GUI. Useful after changing the output format or if the
+crops were lost. The crops are done in parallel by a pool of processes.
+
+    python replay.py -i <image_path> -o <output_path> [-size N] [-p 4]
+
+image_path and size_of_group must be the same as when tagging, they define
+the group names stored in crop.csv.
+"""
+import os
+import re
+import sys
+import csv
+import time
+import argparse
+import multiprocessing
+import cv2
+import rotate_image as rotate
+from Image_list import Image_list
+from config import CROP_WRITE_PARAMS
+
+# nr of columns describing the whole image crop and the detail crop
+WHOLE_COLUMNS = 8
+DETAIL_COLUMNS = 7
+# columns in the crop.csv header that are not image questions
+FIXED_COLUMNS = WHOLE_COLUMNS + DETAIL_COLUMNS
+
+
+def read_crop_jobs(crop_csv, image_list, crop_output_path, extension=None):
+    """
+    reads crop.csv and returns a list of jobs (dicts) for replay_crop
+    rows are written as: whole crop columns, image question answers, detail
+    crop columns (only if a detail was cropped)
+    """
+    directories = image_list.get_group_directories()
+    jobs = []
+    with open(crop_csv, 'rb') as csv_file:
+        reader = csv.reader(csv_file, delimiter=',', quoting=csv.QUOTE_NONE)
+        header = next(reader)
+        nr_questions = len(header) - FIXED_COLUMNS
+        for row in reader:
+            if len(row) < WHOLE_COLUMNS:
+                continue
+            group_id, image_filename = row[0], row[1]
+            if group_id not in directories:
+                # repeated groups are named group_2, group_3...
+                group_id = re.sub('_[0-9]+$', '', group_id)
+            full_dir, relative_dir = directories.get(group_id, (None, None))
+            output_dir = os.path.join(crop_output_path, relative_dir or '')
+            job = {
+                'group_id': row[0],
+                'source': None,
+                'rotation': float(row[2]),
+                'upperleft': (int(row[3]), int(row[4])),
+                'lowerright': (int(row[5]), int(row[6])),
+                'flip': row[7] == '1',
+                'save_path': change_extension(
+                    os.path.join(output_dir, image_filename), extension),
+                'detail': None
+            }
+            if full_dir is not None:
+                job['source'] = '/'.join([full_dir, image_filename])
+            detail = row[WHOLE_COLUMNS + nr_questions:]
+            if len(detail) >= DETAIL_COLUMNS and detail[0] != '':
+                job['detail'] = {
+                    'rotation': float(detail[1]),
+                    'upperleft': (int(detail[2]), int(detail[3])),
+                    'lowerright': (int(detail[4]), int(detail[5])),
+                    'flip': detail[6] == '1',
+                    'save_path': change_extension(
+                        os.path.join(output_dir, detail[0]), extension)
+                }
+            jobs.append(job)
+    return jobs
+
+
+def replay_crop(job):
+    """
+    crops the whole image and the detail of one crop.csv row, runs in the
+    worker processes. Returns a tuple (nr of crops written, error or None)
+    """
+    if job['source'] is None:
+        return (0, 'group %s not found in the image path' % job['group_id'])
+    image = cv2.imread(job['source'], 1)
+    if image is None:
+        return (0, 'could not read ' + job['source'])
+    written = 0
+    for crop in [job, job['detail']]:
+        if crop is None:
+            break
+        if crop['flip']:
+            image = cv2.flip(image, 1)
+        image = crop_rotated(image, crop['rotation'],
+                             crop['upperleft'], crop['lowerright'])
+        if not save(crop['save_path'], image):
+            return (written, 'could not write ' + crop['save_path'])
+        written += 1
+    return (written, None)
+
+
+def crop_rotated(image, degrees, upperleft, lowerright):
+    """
+    crops the region between upperleft and lowerright of the image rotated by
+    degrees, the coords are clipped to the rotated image like in Cropper
+    """
+    if degrees != 0:
+        height, width = rotate.get_rotated_size(image, degrees)
+    else:
+        height, width = image.shape[0:2]
+    upperleft = (max(upperleft[0], 0), max(upperleft[1], 0))
+    lowerright = (min(lowerright[0], width), min(lowerright[1], height))
+    if degrees != 0:
+        return rotate.rotate_region(image, degrees, upperleft, lowerright)
+    return image[upperleft[1]:lowerright[1], upperleft[0]:lowerright[0]]
+
+
+def save(path, image):
+    directory = os.path.dirname(path)
+    if directory != '' and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # another process may have created it in the meantime
+            if not os.path.isdir(directory):
+                raise
+    return cv2.imwrite(path, image, CROP_WRITE_PARAMS)
+
+
+def change_extension(path, extension):
+    if extension is None:
+        return path
+    if not extension.startswith('.'):
+        extension = '.' + extension
+    return os.path.splitext(path)[0] + extension
+
+
+def replay(jobs, processes):
+    """
+    runs the jobs in a process pool and prints the progress
+    returns the list of errors
+    """
+    errors = []
+    nr_crops = 0
+    start_time = time.time()
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.imap_unordered(replay_crop, jobs, chunksize=16)
+        for idx, (written, error) in enumerate(results):
+            nr_crops += written
+            if error is not None:
+                errors.append(error)
+            elapsed = time.time() - start_time
+            sys.stdout.write('\r%d/%d rows, %d crops, %d errors, %.1f rows/s' %
+                             (idx + 1, len(jobs), nr_crops, len(errors),
+                              (idx + 1) / max(elapsed, 1e-6)))
+            sys.stdout.flush()
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    sys.stdout.write('\n')
+    return errors
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='regenerates the crops listed in crop.csv')
+    argparser.add_argument(
+        '--image_path', '-i', required=True,
+        help='path to the source images, same as when tagging')
+    argparser.add_argument(
+        '--output_path', '-o', required=True,
+        help='output path used when tagging, must contain crop.csv')
+    argparser.add_argument(
+        '--size_of_group', '-size', type=int,
+        help='Number of images per group, same as when tagging')
+    argparser.add_argument(
+        '--crop_path', '-c', default=None,
+        help='where to write the crops, default is the crop folder in '
+        'the output path')
+    argparser.add_argument(
+        '--processes', '-p', type=int, default=multiprocessing.cpu_count(),
+        help='nr of worker processes')
+    argparser.add_argument(
+        '--extension', '-e', default=None,
+        help='save crops in this format (e.g. png) instead of the '
+        'original one')
+    args = argparser.parse_args()
+
+    crop_csv = os.path.join(args.output_path, 'crop.csv')
+    if not os.path.isfile(crop_csv):
+        raise IOError('Error: no crop.csv in the output path!')
+    crop_path = args.crop_path or os.path.join(args.output_path, 'crop')
+
+    image_list = Image_list(directory=args.image_path,
+                            size_of_group=args.size_of_group)
+    jobs = read_crop_jobs(crop_csv, image_list, crop_path, args.extension)
+    print 'MESSAGE: replaying %d rows from %s' % (len(jobs), crop_csv)
+    errors = replay(jobs, args.processes)
+    for error in errors:
+        print 'ERROR: ' + error
+
+
+if __name__ == '__main__':
+    main()
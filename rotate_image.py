@@ -1,49 +1,33 @@
 import cv2
 import numpy as np
+import geometry
 
 def getTranslationMatrix2d(dx, dy):
     """
     Returns a numpy affine transformation matrix for a 2D translation of
     (dx, dy)
     """
-    return np.matrix([[1, 0, dx], [0, 1, dy], [0, 0, 1]])
+    return geometry.translation_matrix(dx, dy)
 
-def rotate_image(image, angle, interpolation):
+def get_rotation_matrix(image_size, angle):
     """
-    Rotates the given image about it's centre
+    Returns the affine matrix that rotates an image of image_size
+    (width, height) by angle degrees about it's centre, translated so that the
+    whole rotated image fits, and the size (width, height) of the rotated image
     """
 
-    image_size = (image.shape[1], image.shape[0])
     image_center = tuple(np.array(image_size) / 2)
-
-    rot_mat = np.vstack([cv2.getRotationMatrix2D(image_center, angle, 1.0), [0, 0, 1]])
-    trans_mat = np.identity(3)
+    rot_mat = geometry.rotation_matrix(image_center, angle)
 
     w2 = image_size[0] * 0.5
     h2 = image_size[1] * 0.5
 
-    rot_mat_notranslate = np.matrix(rot_mat[0:2, 0:2])
-
-    tl = (np.array([-w2, h2]) * rot_mat_notranslate).A[0]
-    tr = (np.array([w2, h2]) * rot_mat_notranslate).A[0]
-    bl = (np.array([-w2, -h2]) * rot_mat_notranslate).A[0]
-    br = (np.array([w2, -h2]) * rot_mat_notranslate).A[0]
-
-    x_coords = [pt[0] for pt in [tl, tr, bl, br]]
-    x_pos = [x for x in x_coords if x > 0]
-    x_neg = [x for x in x_coords if x < 0]
+    # corners of the image relative to its centre, all rotated at once
+    corners = np.array([[-w2, h2], [w2, h2], [-w2, -h2], [w2, -h2]])
+    corners = corners.dot(rot_mat[0:2, 0:2])
 
-    y_coords = [pt[1] for pt in [tl, tr, bl, br]]
-    y_pos = [y for y in y_coords if y > 0]
-    y_neg = [y for y in y_coords if y < 0]
-
-    right_bound = max(x_pos)
-    left_bound = min(x_neg)
-    top_bound = max(y_pos)
-    bot_bound = min(y_neg)
-
-    new_w = int(abs(right_bound - left_bound))
-    new_h = int(abs(top_bound - bot_bound))
+    new_w = int(abs(corners[:, 0].max() - corners[:, 0].min()))
+    new_h = int(abs(corners[:, 1].max() - corners[:, 1].min()))
     new_image_size = (new_w, new_h)
 
     new_midx = new_w * 0.5
@@ -53,8 +37,67 @@ def rotate_image(image, angle, interpolation):
     dy = int(new_midy - h2)
 
     trans_mat = getTranslationMatrix2d(dx, dy)
-    affine_mat = (np.matrix(trans_mat) * np.matrix(rot_mat))[0:2, :]
+    affine_mat = trans_mat.dot(rot_mat)[0:2, :]
+
+    return affine_mat, new_image_size
+
+def flip_source(affine_mat, width):
+    """
+    Returns the affine matrix that warps the image like affine_mat warps the
+    image flipped left to right, so the flip is done by the warp instead of on
+    a copy of the image
+    """
+
+    return affine_mat.dot(geometry.flip_matrix(width))
+
+def rotate_image(image, angle, interpolation, flip=False):
+    """
+    Rotates the given image about it's centre, flipped left to right first if
+    flip is True
+    """
+
+    image_size = (image.shape[1], image.shape[0])
+    affine_mat, new_image_size = get_rotation_matrix(image_size, angle)
+    if flip:
+        affine_mat = flip_source(affine_mat, image_size[0])
     result = cv2.warpAffine(image, affine_mat, new_image_size, flags=cv2.INTER_LANCZOS4)
 
     return result
 
+def get_rotated_size(image, angle):
+    """
+    Returns the (height, width) the image would have after rotate_image,
+    without rotating it
+    """
+
+    image_size = (image.shape[1], image.shape[0])
+    new_image_size = get_rotation_matrix(image_size, angle)[1]
+    return (new_image_size[1], new_image_size[0])
+
+def rotate_region(image, angle, upperleft, lowerright, flip=False):
+    """
+    Returns the same pixels as
+        rotate_image(image, angle, ..., flip)[upperleft[1]:lowerright[1],
+                                              upperleft[0]:lowerright[0]]
+    but warps only the pixels of the region instead of the whole image: the
+    translation of the rotation matrix is shifted so that upperleft lands on
+    the origin and the output has the size of the region.
+    upperleft and lowerright are (x, y) coords on the rotated image and have to
+    be inside of it
+    """
+
+    image_size = (image.shape[1], image.shape[0])
+    affine_mat = get_rotation_matrix(image_size, angle)[0].copy()
+    if flip:
+        affine_mat = flip_source(affine_mat, image_size[0])
+    affine_mat[0, 2] -= upperleft[0]
+    affine_mat[1, 2] -= upperleft[1]
+    region_size = (int(lowerright[0] - upperleft[0]),
+                   int(lowerright[1] - upperleft[1]))
+    if region_size[0] <= 0 or region_size[1] <= 0:
+        # same as slicing outside of the image
+        return np.zeros((max(region_size[1], 0), max(region_size[0], 0)) +
+                        image.shape[2:], dtype=image.dtype)
+    result = cv2.warpAffine(image, affine_mat, region_size, flags=cv2.INTER_LANCZOS4)
+
+    return result
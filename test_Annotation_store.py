@@ -0,0 +1,288 @@
+"""
+Checks the annotation stores.
+
+    python -m unittest discover
+"""
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import Annotation_store as store
+
+GROUP_QUESTIONS = ['quality', 'comment']
+IMAGE_QUESTIONS = ['logo']
+GROUPS = [('root/a', 0, ['good', '']),
+          ('root/b#1', 1, ['bad', 'blurry']),
+          ('root/b#1_2', 1, ['good', 'second look'])]
+# (whole, answers, detail), Cropper writes the rotations as text
+CROPS = [(['root/a', 'IMG_1.jpg', '0.00', 10, 20, 110, 220, 0], ['yes'],
+          ['IMG_1_logo.jpg', '12.50', 3, 4, 50, 60, 1]),
+         (['root/a', 'IMG_2.jpg', '-37.50', 0, 0, 640, 480, 1], ['no'],
+          None),
+         (['root/b#1', 'IMG_3.jpg', '90.00', 5, 6, 7, 8, 0], ['yes'],
+          ['IMG_3_logo.jpg', '0.00', 0, 0, 1, 1, 0])]
+
+
+def write_annotations(annotations):
+    annotations.create()
+    annotations.open()
+    for group_id, position, answers in GROUPS:
+        annotations.write_group(group_id, answers, position)
+    for whole, answers, detail in CROPS:
+        annotations.write_crop(whole, answers, detail)
+
+
+def to_strings(values):
+    """
+    the values as read back from a csv file
+    """
+    if values is None:
+        return None
+    return [str(value) for value in values]
+
+
+class Checkpoint_test(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.checkpoint_path = os.path.join(self.path, 'checkpoint.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_round_trip(self):
+        store.write_checkpoint(self.checkpoint_path, 'root/a#2', 7)
+        self.assertEqual(store.read_checkpoint(self.checkpoint_path),
+                         ('root/a#2', 7))
+        store.write_checkpoint(self.checkpoint_path, 'root/b', 8)
+        self.assertEqual(store.read_checkpoint(self.checkpoint_path),
+                         ('root/b', 8))
+
+    def test_non_ascii_name(self):
+        # folder names are str, json gives unicode back
+        name = 'root/caf\xc3\xa9'
+        store.write_checkpoint(self.checkpoint_path, name, 3)
+        group_name, position = store.read_checkpoint(self.checkpoint_path)
+        self.assertEqual((group_name, position), (name, 3))
+        self.assertTrue(isinstance(group_name, str))
+        # json cannot store a name that is not utf-8, groups.csv is read
+        # instead of the checkpoint
+        store.write_checkpoint(self.checkpoint_path, 'root/caf\xe9', 4)
+        self.assertRaises(IOError, store.read_checkpoint,
+                          self.checkpoint_path)
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_without_position(self):
+        with open(self.checkpoint_path, 'w') as checkpoint_file:
+            json.dump({'group_name': 'root/a'}, checkpoint_file)
+        self.assertEqual(store.read_checkpoint(self.checkpoint_path),
+                         ('root/a', None))
+
+    def test_broken(self):
+        self.assertRaises(IOError, store.read_checkpoint,
+                          self.checkpoint_path)
+        for content in ['{"group_na', '[1, 2]', '{"position": 3}',
+                        '{"group_name": "root/a", "position": "3"}']:
+            with open(self.checkpoint_path, 'w') as checkpoint_file:
+                checkpoint_file.write(content)
+            self.assertRaises(ValueError, store.read_checkpoint,
+                              self.checkpoint_path)
+
+    def test_last_group(self):
+        for backend in ['csv', 'sqlite']:
+            annotations = store.make_store(backend, self.path,
+                                           GROUP_QUESTIONS, IMAGE_QUESTIONS)
+            annotations.create()
+            annotations.open()
+            self.assertRaises(IndexError, annotations.get_last_group)
+            annotations.write_group('root/a', ['good', ''], 0)
+            annotations.write_group('root/b_2', ['bad', 'x'], 1)
+            self.assertEqual(annotations.get_last_group(), ('root/b_2', 1))
+            annotations.close()
+
+    def test_last_group_without_checkpoint(self):
+        annotations = store.make_store('csv', self.path, GROUP_QUESTIONS,
+                                       IMAGE_QUESTIONS)
+        annotations.create()
+        annotations.open()
+        annotations.write_group('root/a', ['good', ''], 0)
+        annotations.close()
+        os.remove(self.checkpoint_path)
+        # groups.csv has the name but not the position
+        self.assertEqual(annotations.get_last_group(), ('root/a', None))
+
+
+class Round_trip_test(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_csv(self):
+        annotations = store.make_store('csv', self.path, GROUP_QUESTIONS,
+                                       IMAGE_QUESTIONS)
+        write_annotations(annotations)
+        annotations.close()
+
+        annotations = store.make_store('csv', self.path, None, None)
+        self.assertEqual(annotations.get_question_names(),
+                         (GROUP_QUESTIONS, IMAGE_QUESTIONS))
+        self.assertEqual(annotations.get_last_group(), ('root/b#1_2', 1))
+        self.assertEqual(list(annotations.iter_groups()),
+                         [(group_id, answers)
+                          for group_id, position, answers in GROUPS])
+        self.assertEqual(list(annotations.iter_crops()),
+                         [(to_strings(whole), answers, to_strings(detail))
+                          for whole, answers, detail in CROPS])
+
+    def test_sqlite(self):
+        annotations = store.make_store('sqlite', self.path, GROUP_QUESTIONS,
+                                       IMAGE_QUESTIONS)
+        write_annotations(annotations)
+        annotations.close()
+
+        annotations = store.make_store('sqlite', self.path, None, None)
+        self.assertEqual(annotations.get_question_names(),
+                         (GROUP_QUESTIONS, IMAGE_QUESTIONS))
+        self.assertEqual(annotations.get_last_group(), ('root/b#1_2', 1))
+        self.assertEqual(list(annotations.iter_groups()),
+                         [(group_id, answers)
+                          for group_id, position, answers in GROUPS])
+        self.assertEqual(annotations.get_crops(), CROPS)
+        self.assertEqual(annotations.get_crops(group_id='root/a'), CROPS[0:2])
+        self.assertEqual(annotations.get_crops(image_filename='IMG_3.jpg'),
+                         CROPS[2:3])
+        self.assertEqual(annotations.get_group('root/b#1'),
+                         ['bad', 'blurry'])
+        self.assertEqual(annotations.get_group('root/c'), None)
+        annotations.close()
+
+    def test_non_ascii(self):
+        # folder and file names are utf-8 str, answers typed in the GUI can
+        # be unicode
+        group_id = 'root/caf\xc3\xa9'
+        whole = [group_id, 'cr\xc3\xa8me.jpg', '0.00', 1, 2, 3, 4, 0]
+        for backend in ['csv', 'sqlite']:
+            annotations = store.make_store(backend, self.path,
+                                           GROUP_QUESTIONS, IMAGE_QUESTIONS)
+            annotations.create()
+            annotations.open()
+            annotations.write_group(group_id, ['good', u'd\xe9j\xe0 vu'], 0)
+            annotations.write_crop(whole, ['yes'], None)
+            annotations.close()
+            annotations = store.make_store(backend, self.path, None, None,
+                                           read_only=True)
+            group_name, position = annotations.get_last_group()
+            self.assertEqual((group_name, position), (group_id, 0))
+            self.assertTrue(isinstance(group_name, str))
+            groups = list(annotations.iter_groups())
+            self.assertEqual(groups[0][0], group_id)
+            crops = list(annotations.iter_crops())
+            self.assertEqual(crops[0][0][0:2], whole[0:2])
+            annotations.close()
+        # the answers are kept as JSON in the database
+        self.assertEqual(groups[0][1][1], u'd\xe9j\xe0 vu')
+
+    def test_sqlite_export_csv(self):
+        annotations = store.make_store('sqlite', self.path, GROUP_QUESTIONS,
+                                       IMAGE_QUESTIONS)
+        write_annotations(annotations)
+        annotations.export_csv(self.path)
+        crops = list(annotations.iter_crops())
+        annotations.close()
+
+        csv_annotations = store.make_store('csv', self.path, None, None,
+                                           read_only=True)
+        self.assertEqual(list(csv_annotations.iter_groups()),
+                         [(group_id, answers)
+                          for group_id, position, answers in GROUPS])
+        self.assertEqual(list(csv_annotations.iter_crops()),
+                         [(to_strings(whole), answers, to_strings(detail))
+                          for whole, answers, detail in crops])
+
+    def test_resume(self):
+        # rows written after reopening are appended
+        for backend in ['csv', 'sqlite']:
+            annotations = store.make_store(backend, self.path,
+                                           GROUP_QUESTIONS, IMAGE_QUESTIONS)
+            write_annotations(annotations)
+            annotations.close()
+            annotations = store.make_store(backend, self.path,
+                                           GROUP_QUESTIONS, IMAGE_QUESTIONS)
+            annotations.get_last_group()
+            annotations.open()
+            annotations.write_group('root/c', ['good', 'x'], 2)
+            annotations.write_crop(*CROPS[1])
+            annotations.close()
+            annotations = store.make_store(backend, self.path, None, None,
+                                           read_only=True)
+            self.assertEqual(annotations.get_last_group(), ('root/c', 2))
+            self.assertEqual(len(list(annotations.iter_groups())), 4)
+            self.assertEqual(len(list(annotations.iter_crops())), 4)
+            annotations.close()
+
+
+class Read_only_test(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def read_files(self):
+        """
+        returns {filename: content} of the output path
+        """
+        contents = {}
+        for filename in os.listdir(self.path):
+            with open(os.path.join(self.path, filename), 'rb') as file_obj:
+                contents[filename] = file_obj.read()
+        return contents
+
+    def test_csv(self):
+        annotations = store.make_store('csv', self.path, GROUP_QUESTIONS,
+                                       IMAGE_QUESTIONS)
+        annotations.create()
+        annotations.open()
+        annotations.write_group('root/a', ['good', ''], 0)
+        annotations.close()
+        # a partial row that would be repaired when opened for writing
+        with open(os.path.join(self.path, 'groups.csv'), 'ab') as csv_file:
+            csv_file.write('root/b')
+        contents = self.read_files()
+
+        annotations = store.make_store('csv', self.path, None, None,
+                                       read_only=True)
+        self.assertEqual(annotations.get_question_names(),
+                         (GROUP_QUESTIONS, IMAGE_QUESTIONS))
+        self.assertEqual(annotations.get_last_group(), ('root/a', 0))
+        self.assertRaises(IOError, annotations.create)
+        self.assertRaises(IOError, annotations.open)
+        annotations.close()
+        self.assertEqual(self.read_files(), contents)
+
+    def test_sqlite(self):
+        path = os.path.join(self.path, 'annotations.db')
+        self.assertRaises(IOError, store.make_store, 'sqlite', self.path,
+                          None, None, read_only=True)
+        self.assertFalse(os.path.exists(path))
+        annotations = store.make_store('sqlite', self.path, GROUP_QUESTIONS,
+                                       IMAGE_QUESTIONS)
+        annotations.create()
+        annotations.write_group('root/a', ['good', ''], 0)
+        annotations.close()
+
+        annotations = store.make_store('sqlite', self.path, None, None,
+                                       read_only=True)
+        self.assertEqual(annotations.get_last_group(), ('root/a', 0))
+        self.assertRaises(IOError, annotations.create)
+        self.assertRaises(IOError, annotations.open)
+        annotations.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+Checks cutting the drawn rectangle out of an image without the GUI.
+
+    python -m unittest discover
+"""
+import math
+import unittest
+import numpy as np
+import cv2
+import geometry
+import rotate_image as rotate
+from Cropper import crop_rectangle
+
+
+def make_image(width=641, height=479):
+    random_state = np.random.RandomState(1)
+    blobs = random_state.randint(0, 256, size=(6, 8, 3)).astype(np.uint8)
+    return cv2.resize(blobs, (width, height), interpolation=cv2.INTER_CUBIC)
+
+
+def get_drawn_corners(rectangle, angle_radians):
+    """
+    the corners of the rectangle turned about its center, as the cropper
+    draws them
+    """
+    x1, y1, x2, y2 = rectangle
+    return geometry.rotate_points(geometry.rectangle_corners(x1, y1, x2, y2),
+                                  ((x1 + x2) / 2., (y1 + y2) / 2.),
+                                  angle_radians)
+
+
+class Crop_rectangle_test(unittest.TestCase):
+
+    def setUp(self):
+        self.image = make_image()
+
+    def test_not_rotated(self):
+        crop, upperleft, lowerright = crop_rectangle(
+            self.image, [(100.5, 80.2), (400.1, 299.9)], 0, False)
+        # the box grows to whole pixels
+        self.assertEqual((upperleft, lowerright), ((100, 80), (401, 300)))
+        self.assertTrue(np.array_equal(crop, self.image[80:300, 100:401]))
+        self.assertTrue(crop.flags['C_CONTIGUOUS'])
+
+    def test_flip(self):
+        crop, upperleft, lowerright = crop_rectangle(
+            self.image, [(10, 20), (50, 60)], 0, True)
+        self.assertTrue(np.array_equal(
+            crop, cv2.flip(self.image, 1)[20:60, 10:50]))
+        self.assertTrue(crop.flags['C_CONTIGUOUS'])
+
+    def test_outside_of_the_image(self):
+        crop, upperleft, lowerright = crop_rectangle(
+            self.image, [(-20, -10), (700, 500)], 0, False)
+        self.assertEqual((upperleft, lowerright), ((0, 0), (641, 479)))
+        self.assertEqual(crop.shape, self.image.shape)
+
+    def test_rotated(self):
+        for degrees in [12.5, -33, 90]:
+            for flip in [False, True]:
+                angle = math.radians(-degrees)
+                corners = get_drawn_corners((100, 80, 400, 300), angle)
+                crop, upperleft, lowerright = crop_rectangle(
+                    self.image, corners, angle, flip)
+                # in the rotated image the rectangle is not turned
+                self.assertEqual((lowerright[0] - upperleft[0],
+                                  lowerright[1] - upperleft[1]), (300, 220))
+                expected = rotate.rotate_region(self.image, degrees,
+                                                upperleft, lowerright, flip)
+                self.assertTrue(np.array_equal(crop, expected), degrees)
+
+    def test_rotated_outside_of_the_image(self):
+        angle = math.radians(-20)
+        corners = get_drawn_corners((-300, -300, 1000, 900), angle)
+        crop, upperleft, lowerright = crop_rectangle(self.image, corners,
+                                                     angle, False)
+        height, width = rotate.get_rotated_size(self.image, 20)
+        self.assertEqual((upperleft, lowerright), ((0, 0), (width, height)))
+        self.assertEqual(crop.shape[0:2], (height, width))
+
+
+if __name__ == '__main__':
+    unittest.main()
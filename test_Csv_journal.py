@@ -0,0 +1,125 @@
+"""
+Checks writing csv rows with Csv_journal and repairing the file after a
+crash.
+
+    python -m unittest discover
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import Csv_journal
+from Csv_journal import Csv_journal as Journal, repair_csv
+
+HEADER = 'group_id,a,b\r\n'
+
+
+class Repair_csv_test(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.path, 'groups.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, content):
+        with open(self.csv_path, 'wb') as csv_file:
+            csv_file.write(content)
+
+    def read(self, path=None):
+        with open(path or self.csv_path, 'rb') as csv_file:
+            return csv_file.read()
+
+    def test_missing_and_empty_file(self):
+        self.assertFalse(repair_csv(self.csv_path))
+        self.assertFalse(os.path.exists(self.csv_path))
+        self.write('')
+        self.assertFalse(repair_csv(self.csv_path))
+        self.assertEqual(self.read(), '')
+
+    def test_complete_file(self):
+        content = HEADER + 'root/a,x,y\r\n'
+        self.write(content)
+        self.assertFalse(repair_csv(self.csv_path))
+        self.assertEqual(self.read(), content)
+
+    def test_complete_row_without_line_ending(self):
+        # the row is kept and gets its line ending
+        self.write(HEADER + 'root/a,x,y\r\nroot/b,z,w')
+        self.assertFalse(repair_csv(self.csv_path))
+        self.assertEqual(self.read(), HEADER + 'root/a,x,y\r\nroot/b,z,w\r\n')
+        self.write(HEADER + 'root/b,z,w\r')
+        self.assertFalse(repair_csv(self.csv_path))
+        self.assertEqual(self.read(), HEADER + 'root/b,z,w\r\n')
+        self.assertFalse(os.path.exists(self.csv_path + '.partial'))
+
+    def test_partial_row(self):
+        self.write(HEADER + 'root/a,x,y\r\nroot/b,z')
+        self.assertTrue(repair_csv(self.csv_path))
+        self.assertEqual(self.read(), HEADER + 'root/a,x,y\r\n')
+        # the removed row is kept aside
+        self.assertEqual(self.read(self.csv_path + '.partial'), 'root/b,z\n')
+
+    def test_partial_row_longer_than_a_block(self):
+        row = 'root/b,' + 'z' * 10000
+        self.write(HEADER + row)
+        self.assertTrue(repair_csv(self.csv_path))
+        self.assertEqual(self.read(), HEADER)
+        self.assertEqual(self.read(self.csv_path + '.partial'), row + '\n')
+
+    def test_partial_header(self):
+        self.write('group_id,a')
+        self.assertTrue(repair_csv(self.csv_path))
+        self.assertEqual(self.read(), '')
+
+    def test_optional_columns(self):
+        self.write(HEADER + 'root/b')
+        self.assertTrue(repair_csv(self.csv_path, 1))
+        self.write(HEADER + 'root/b,z')
+        self.assertFalse(repair_csv(self.csv_path, 1))
+        self.assertEqual(self.read(), HEADER + 'root/b,z\r\n')
+
+
+class Journal_test(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.path, 'groups.csv')
+        self.nr_fsyncs = 0
+        self.fsync = Csv_journal.os.fsync
+
+        def count_fsync(fileno):
+            self.nr_fsyncs += 1
+            self.fsync(fileno)
+        Csv_journal.os.fsync = count_fsync
+
+    def tearDown(self):
+        Csv_journal.os.fsync = self.fsync
+        shutil.rmtree(self.path)
+
+    def test_write_rows(self):
+        journal = Journal(self.csv_path, 3)
+        journal.write_row(['root/a', ['x'], 1])
+        # flushed before it is synced
+        with open(self.csv_path, 'rb') as csv_file:
+            self.assertEqual(csv_file.read(), "root/a,['x'],1\r\n")
+        journal.write_rows([['root/b', 'y', 2]] * 4)
+        self.assertEqual(self.nr_fsyncs, 1)
+        journal.close()
+        self.assertEqual(self.nr_fsyncs, 2)
+        journal.close()
+        self.assertEqual(self.nr_fsyncs, 2)
+        with open(self.csv_path, 'rb') as csv_file:
+            self.assertEqual(len(csv_file.readlines()), 5)
+
+    def test_sync_only_on_close(self):
+        journal = Journal(self.csv_path, 0)
+        journal.write_rows([['root/a', 'x']] * 50)
+        self.assertEqual(self.nr_fsyncs, 0)
+        journal.close()
+        self.assertEqual(self.nr_fsyncs, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+"""
+Checks resuming an Image_list after the last tagged group, in stream mode and
+with the whole list.
+
+    python -m unittest discover
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from Image_list import Image_list
+import Annotation_store as store
+
+# folder: nr of images. img_2 and img_2023 are named like repeats of img
+FOLDERS = {'img': 3, 'img_2': 1, 'img_2023': 2, 'other': 1,
+           'other/deeper': 4}
+
+
+def make_tree(path):
+    for folder, nr_images in FOLDERS.items():
+        folder_path = os.path.join(path, folder)
+        if not os.path.isdir(folder_path):
+            os.makedirs(folder_path)
+        for idx in range(nr_images):
+            open(os.path.join(folder_path, 'IMG_%d.jpg' % idx), 'w').close()
+
+
+class Setup_list_test(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        make_tree(self.path)
+        self.names = Image_list(self.path).get_group_list()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def assert_resumes_after(self, image_list, group_name):
+        """
+        the next group has to be the one after group_name in the full list
+        """
+        next_idx = self.names.index(group_name) + 1
+        self.assertEqual(image_list.get_log()[-1], group_name)
+        self.assertEqual(image_list.get_nr_groups_complete(), next_idx)
+        if next_idx < len(self.names):
+            self.assertEqual(image_list.get_group_list()[0],
+                             self.names[next_idx])
+        else:
+            self.assertTrue(image_list.no_groups_left())
+
+    def test_exact_name(self):
+        for stream in [False, True]:
+            for name in self.names:
+                image_list = Image_list(self.path, stream=stream, lookahead=2)
+                image_list.setup_list(name)
+                self.assert_resumes_after(image_list, name)
+
+    def test_repeated_group(self):
+        # root/other_2 repeats root/other, there is no such folder
+        for stream in [False, True]:
+            image_list = Image_list(self.path, stream=stream, lookahead=2)
+            image_list.setup_list('root/other_2')
+            self.assert_resumes_after(image_list, 'root/other')
+
+    def test_repeat_of_folder_named_like_a_repeat(self):
+        for stream in [False, True]:
+            image_list = Image_list(self.path, stream=stream, lookahead=2)
+            image_list.setup_list('root/img_2023_3')
+            self.assert_resumes_after(image_list, 'root/img_2023')
+
+    def test_unknown_group(self):
+        for stream in [False, True]:
+            image_list = Image_list(self.path, stream=stream, lookahead=2)
+            self.assertRaises(IndexError, image_list.setup_list,
+                              'root/missing')
+            # the list can still be used from the top
+            self.assertEqual(image_list.get_nr_groups_complete(), 0)
+            image_list.get_next_group()
+            self.assertEqual(image_list.get_current_group(), self.names[0])
+
+    def test_position(self):
+        position = self.names.index('root/img')
+        for stream in [False, True]:
+            # root/img_2 is both a folder and the name of a repeat of
+            # root/img, the position tells them apart
+            image_list = Image_list(self.path, stream=stream, lookahead=2)
+            image_list.setup_list('root/img_2', position)
+            self.assert_resumes_after(image_list, 'root/img')
+            image_list = Image_list(self.path, stream=stream, lookahead=2)
+            image_list.setup_list('root/img_2')
+            self.assert_resumes_after(image_list, 'root/img_2')
+
+    def test_changed_position(self):
+        # the folders changed after the position was stored, the name is
+        # used instead
+        position = self.names.index('root/other')
+        for stream in [False, True]:
+            image_list = Image_list(self.path, stream=stream, lookahead=2)
+            image_list.setup_list('root/img_2023', position)
+            self.assert_resumes_after(image_list, 'root/img_2023')
+            image_list = Image_list(self.path, stream=stream, lookahead=2)
+            image_list.setup_list('root/img_2023', len(self.names) + 5)
+            self.assert_resumes_after(image_list, 'root/img_2023')
+
+    def test_non_ascii_checkpoint(self):
+        # resuming from the checkpoint after a folder with a non-ascii name
+        folder = 'caf\xc3\xa9'
+        os.makedirs(os.path.join(self.path, folder))
+        open(os.path.join(self.path, folder, 'IMG_0.jpg'), 'w').close()
+        names = Image_list(self.path).get_group_list()
+        checkpoint_path = tempfile.mktemp()
+        try:
+            store.write_checkpoint(checkpoint_path, 'root/' + folder,
+                                   names.index('root/' + folder))
+            for stream in [False, True]:
+                last_group_name, position = store.read_checkpoint(
+                    checkpoint_path)
+                image_list = Image_list(self.path, stream=stream, lookahead=2)
+                image_list.setup_list(last_group_name, position)
+                self.assertEqual(image_list.get_log()[-1], 'root/' + folder)
+                image_list = Image_list(self.path, stream=stream, lookahead=2)
+                image_list.setup_list(last_group_name)
+                self.assertEqual(image_list.get_log()[-1], 'root/' + folder)
+        finally:
+            os.remove(checkpoint_path)
+
+    def test_constant_size(self):
+        names = Image_list(self.path, size_of_group=2).get_group_list()
+        image_list = Image_list(self.path, size_of_group=2, stream=True,
+                                lookahead=2)
+        image_list.setup_list('root/other/deeper#1_2')
+        self.assertEqual(image_list.get_log()[-1], 'root/other/deeper#1')
+        self.assertEqual(image_list.get_nr_groups_complete(),
+                         names.index('root/other/deeper#1') + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
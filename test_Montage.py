@@ -0,0 +1,87 @@
+"""
+Checks loading the tiles of a virtual montage in the background.
+
+    python -m unittest discover
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import cv2
+from Montage import Montage
+
+NR_IMAGES = 30
+
+
+def wait_for_tiles(montage, timeout=10):
+    """
+    collects the tiles until none are loading, returns their indices
+    """
+    collected = []
+    end = time.time() + timeout
+    while montage.is_loading() and time.time() < end:
+        collected.extend(montage.collect_tiles())
+        time.sleep(0.01)
+    collected.extend(montage.collect_tiles())
+    return collected
+
+
+class Virtual_montage_test(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filenames = []
+        for idx in range(NR_IMAGES):
+            filename = os.path.join(self.path, 'IMG_%d.jpg' % idx)
+            image = np.full((120, 160, 3), idx * 8, dtype=np.uint8)
+            cv2.imwrite(filename, image)
+            self.filenames.append(filename)
+        self.montage = Montage(self.filenames, (400, 200), (1, 2), False,
+                               nr_workers=3, min_tile_size=100)
+
+    def tearDown(self):
+        self.montage.close()
+        shutil.rmtree(self.path)
+
+    def test_request_tiles(self):
+        self.assertTrue(self.montage.is_virtual())
+        indices = self.montage.get_tiles_in_view(0, 250)
+        self.montage.request_tiles(indices)
+        self.assertEqual(sorted(wait_for_tiles(self.montage)), list(indices))
+        self.assertFalse(self.montage.is_loading())
+        # same tiles as loading them right away
+        loaded = Montage(self.filenames, (400, 200), (1, 2), False,
+                         min_tile_size=100)
+        loaded.load_tiles(indices)
+        for index in indices:
+            self.assertEqual(self.montage.get_tile(index).tobytes(),
+                             loaded.get_tile(index).tobytes())
+
+    def test_scrolled_away(self):
+        first = self.montage.get_tiles_in_view(0, 100)
+        last = self.montage.get_tiles_in_view(
+            self.montage.get_total_size()[1] - 100,
+            self.montage.get_total_size()[1])
+        self.montage.request_tiles(first)
+        self.montage.request_tiles(last)
+        collected = wait_for_tiles(self.montage)
+        # only the tiles still requested are kept
+        self.assertEqual(sorted(collected), list(last))
+        for index in first:
+            self.assertEqual(self.montage.get_tile(index), None)
+
+    def test_unreadable_image(self):
+        os.remove(self.filenames[0])
+        with open(self.filenames[0], 'w') as broken_file:
+            broken_file.write('not an image')
+        indices = self.montage.get_tiles_in_view(0, 100)
+        self.montage.request_tiles(indices)
+        collected = wait_for_tiles(self.montage)
+        self.assertFalse(self.montage.is_loading())
+        self.assertEqual(sorted(collected), list(indices)[1:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+Checks the columnar export of the annotations.
+
+    python -m unittest discover
+"""
+import os
+import math
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import Annotation_store as store
+from export import export_columns, load_columns
+from test_Annotation_store import (GROUP_QUESTIONS, IMAGE_QUESTIONS, GROUPS,
+                                   CROPS, write_annotations)
+
+
+def decode(columns, dictionaries, name):
+    """
+    returns the values of a dictionary encoded column, None if missing
+    """
+    return [None if code == -1 else dictionaries[name][code]
+            for code in columns[name]]
+
+
+class Export_columns_test(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.bundle_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        shutil.rmtree(self.bundle_path)
+
+    def export(self, backend):
+        annotations = store.make_store(backend, self.path, GROUP_QUESTIONS,
+                                       IMAGE_QUESTIONS)
+        write_annotations(annotations)
+        annotations.close()
+        annotations = store.make_store(backend, self.path, None, None,
+                                       read_only=True)
+        nr_rows = export_columns(annotations, self.bundle_path)
+        annotations.close()
+        self.assertEqual(nr_rows, len(CROPS))
+        return load_columns(self.bundle_path)
+
+    def check_columns(self, columns, dictionaries):
+        self.assertEqual(decode(columns, dictionaries, 'group_id'),
+                         [whole[0] for whole, answers, detail in CROPS])
+        self.assertEqual(list(columns['image_filename']),
+                         [whole[1] for whole, answers, detail in CROPS])
+        np.testing.assert_array_equal(
+            columns['rotation_degrees'],
+            np.array([float(whole[2]) for whole, answers, detail in CROPS],
+                     dtype=np.float32))
+        self.assertEqual(columns['upperleft_x'].dtype, np.int32)
+        self.assertEqual(
+            columns['lowerright_y'].tolist(),
+            [whole[6] for whole, answers, detail in CROPS])
+        self.assertEqual(columns['flip_state'].dtype, np.int8)
+        self.assertEqual(columns['has_detail'].tolist(),
+                         [detail is not None
+                          for whole, answers, detail in CROPS])
+        # missing detail crops
+        self.assertEqual(list(columns['logo_filename']),
+                         ['IMG_1_logo.jpg', '', 'IMG_3_logo.jpg'])
+        self.assertEqual(columns['upperleft_x_detail'].tolist(), [3, -1, 0])
+        self.assertTrue(math.isnan(columns['rotation_degrees_detail'][1]))
+        self.assertEqual(decode(columns, dictionaries, 'image_logo'),
+                         ['yes', 'no', 'yes'])
+        # joined on group_id, the repeat root/b#1_2 has its own answers
+        self.assertEqual(decode(columns, dictionaries, 'group_quality'),
+                         ['good', 'good', 'bad'])
+        self.assertEqual(decode(columns, dictionaries, 'group_comment'),
+                         ['', '', 'blurry'])
+
+    def test_csv(self):
+        self.check_columns(*self.export('csv'))
+
+    def test_sqlite(self):
+        self.check_columns(*self.export('sqlite'))
+
+    def test_memory_mapped(self):
+        columns, dictionaries = self.export('csv')
+        self.assertTrue(isinstance(columns['upperleft_x'], np.memmap))
+        columns, dictionaries = load_columns(self.bundle_path, mmap=False)
+        self.assertFalse(isinstance(columns['upperleft_x'], np.memmap))
+
+    def test_no_crops(self):
+        annotations = store.make_store('csv', self.path, GROUP_QUESTIONS,
+                                       IMAGE_QUESTIONS)
+        annotations.create()
+        annotations.close()
+        self.assertEqual(export_columns(annotations, self.bundle_path), 0)
+        columns, dictionaries = load_columns(self.bundle_path)
+        self.assertEqual(len(columns['image_filename']), 0)
+        self.assertEqual(len(columns['group_quality']), 0)
+
+    def test_clashing_names(self):
+        # (group questions, image questions)
+        for questions in [(['quality'], ['filename']),  # image_filename
+                          (['a b', 'a_b'], ['logo']),
+                          (['Quality', 'quality'], ['logo']),
+                          (['a.dictionary', 'a'], ['logo'])]:
+            annotations = store.make_store('csv', self.path, *questions)
+            annotations.create()
+            annotations.close()
+            self.assertRaises(ValueError, export_columns, annotations,
+                              self.bundle_path)
+            # refused before anything is written
+            self.assertEqual(os.listdir(self.bundle_path), [])
+        # the prefixes keep group and image tags apart
+        annotations = store.make_store('csv', self.path, ['a b'], ['a_b'])
+        annotations.create()
+        annotations.close()
+        export_columns(annotations, self.bundle_path)
+        columns, dictionaries = load_columns(self.bundle_path)
+        self.assertTrue('group_a b' in columns and 'image_a_b' in columns)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""
+Checks the geometry helpers against per-point math and OpenCV.
+
+    python -m unittest discover
+"""
+import math
+import unittest
+import numpy as np
+import cv2
+import geometry
+
+
+def rotate_point(point, center, angle_radians):
+    """
+    the per-point rotation that rotate_points replaces
+    """
+    x = point[0] - center[0]
+    y = point[1] - center[1]
+    _x = x * math.cos(angle_radians) + y * math.sin(angle_radians)
+    _y = -x * math.sin(angle_radians) + y * math.cos(angle_radians)
+    return (_x + center[0], _y + center[1])
+
+
+class Rotate_points_test(unittest.TestCase):
+
+    def test_single_point(self):
+        result = geometry.rotate_points((10, 5), (3, 4), 0.7)
+        self.assertEqual(result.shape, (2,))
+        np.testing.assert_allclose(result, rotate_point((10, 5), (3, 4), 0.7))
+
+    def test_quarter_turn(self):
+        # a positive angle turns clockwise on the screen (y points down)
+        result = geometry.rotate_points((1, 0), (0, 0), math.pi / 2)
+        np.testing.assert_allclose(result, (0, -1), atol=1e-12)
+
+    def test_list(self):
+        points = [(0, 0), (10, 0), (10, 20), (0, 20)]
+        result = geometry.rotate_points(points, (5, 10), -1.2)
+        self.assertEqual(result.shape, (4, 2))
+        for point, rotated in zip(points, result):
+            np.testing.assert_allclose(rotated,
+                                       rotate_point(point, (5, 10), -1.2))
+
+    def test_batch(self):
+        corners = geometry.rectangle_corners([0, 5, -3], [0, 2, 8],
+                                             [10, 7, 4], [20, 9, 11])
+        centers = [(5, 10), (0, 0), (1.5, -2)]
+        angles = [0.3, -2.1, 3.0]
+        result = geometry.rotate_points(corners, centers, angles)
+        self.assertEqual(result.shape, (3, 4, 2))
+        for rectangle, center, angle, rotated in zip(corners, centers, angles,
+                                                     result):
+            for point, rotated_point in zip(rectangle, rotated):
+                np.testing.assert_allclose(
+                    rotated_point, rotate_point(point, center, angle))
+
+    def test_zero_angle(self):
+        points = np.array([(1.5, 2), (3, -4)])
+        np.testing.assert_allclose(
+            geometry.rotate_points(points, (7, 7), 0), points)
+
+
+class Rectangle_test(unittest.TestCase):
+
+    def test_rectangle_corners(self):
+        np.testing.assert_array_equal(
+            geometry.rectangle_corners(1, 2, 3, 4),
+            [(1, 2), (3, 2), (3, 4), (1, 4)])
+        self.assertEqual(
+            geometry.rectangle_corners([1, 5], [2, 6], [3, 7], 4).shape,
+            (2, 4, 2))
+
+    def test_offset_points(self):
+        np.testing.assert_array_equal(
+            geometry.offset_points([(1, 2), (3, 4)], (1, 1)),
+            [(0, 1), (2, 3)])
+        np.testing.assert_array_equal(
+            geometry.offset_points([[(1, 2)], [(3, 4)]], [(1, 1), (2, 2)]),
+            [[(0, 1)], [(1, 2)]])
+
+    def test_bounding_corners(self):
+        upperleft, lowerright = geometry.bounding_corners(
+            [(3, 8), (-2, 5), (7, -1)])
+        np.testing.assert_array_equal(upperleft, (-2, -1))
+        np.testing.assert_array_equal(lowerright, (7, 8))
+
+    def test_bounding_corners_clamp(self):
+        # the box is left of and above the image, its lowerright corner
+        # stops at 0 like a slice of the image would
+        upperleft, lowerright = geometry.bounding_corners(
+            [(-9, -3), (-4, -7)])
+        np.testing.assert_array_equal(upperleft, (-9, -7))
+        np.testing.assert_array_equal(lowerright, (0, 0))
+        upperleft, lowerright = geometry.bounding_corners(
+            [(-9, 3), (-4, 7)])
+        np.testing.assert_array_equal(lowerright, (0, 7))
+
+    def test_bounding_corners_batch(self):
+        corners = geometry.rectangle_corners([0, -5], [0, -5], [2, -1],
+                                             [3, -2])
+        upperleft, lowerright = geometry.bounding_corners(corners)
+        np.testing.assert_array_equal(upperleft, [(0, 0), (-5, -5)])
+        np.testing.assert_array_equal(lowerright, [(2, 3), (0, 0)])
+
+
+class Round_half_away_test(unittest.TestCase):
+
+    def test_halves(self):
+        values = [-2.5, -1.5, -0.5, 0.5, 1.5, 2.5]
+        np.testing.assert_array_equal(geometry.round_half_away(values),
+                                      [-3, -2, -1, 1, 2, 3])
+        # same as Python 2's round
+        for value in values:
+            self.assertEqual(geometry.round_half_away(value), round(value))
+
+    def test_other_values(self):
+        np.testing.assert_array_equal(
+            geometry.round_half_away([-1.49, -0.2, 0, 0.2, 1.51, 7]),
+            [-1, 0, 0, 0, 2, 7])
+
+
+class Matrix_test(unittest.TestCase):
+
+    def test_rotation_matrix(self):
+        for center in [(0, 0), (320, 240), (17.5, -3.25)]:
+            for angle in [-143, -37.5, 0, 0.25, 12, 90, 180]:
+                for scale in [1.0, 0.5]:
+                    expected = cv2.getRotationMatrix2D(center, angle, scale)
+                    result = geometry.rotation_matrix(center, angle, scale)
+                    self.assertEqual(result.shape, (3, 3))
+                    np.testing.assert_allclose(result[0:2], expected,
+                                               atol=1e-9)
+                    np.testing.assert_array_equal(result[2], (0, 0, 1))
+
+    def test_translation_matrix(self):
+        np.testing.assert_array_equal(
+            geometry.transform_points(geometry.translation_matrix(3, -4),
+                                      (1, 1)),
+            (4, -3))
+
+    def test_flip_matrix(self):
+        image = np.arange(12, dtype=np.uint8).reshape(3, 4)
+        flipped = cv2.warpAffine(image, geometry.flip_matrix(4)[0:2], (4, 3),
+                                 flags=cv2.INTER_NEAREST)
+        np.testing.assert_array_equal(flipped, cv2.flip(image, 1))
+
+    def test_transform_points(self):
+        matrix = cv2.getRotationMatrix2D((10, 20), 30, 1.0)
+        points = np.array([(0, 0), (10, 20), (-3.5, 7)])
+        expected = cv2.transform(points[np.newaxis], matrix)[0]
+        # 2x3 and 3x3 matrices give the same result
+        np.testing.assert_allclose(geometry.transform_points(matrix, points),
+                                   expected)
+        np.testing.assert_allclose(
+            geometry.transform_points(np.vstack([matrix, (0, 0, 1)]), points),
+            expected)
+        # a single point and a batch of lists
+        np.testing.assert_allclose(
+            geometry.transform_points(matrix, points[2]), expected[2])
+        np.testing.assert_allclose(
+            geometry.transform_points(matrix, np.stack([points, points])),
+            np.stack([expected, expected]))
+
+    def test_composition(self):
+        # the matrices compose with dot like the transforms they stand for
+        matrix = geometry.translation_matrix(5, 6).dot(
+            geometry.rotation_matrix((1, 2), 40))
+        point = (3, 4)
+        expected = geometry.transform_points(
+            geometry.translation_matrix(5, 6),
+            geometry.transform_points(geometry.rotation_matrix((1, 2), 40),
+                                      point))
+        np.testing.assert_allclose(geometry.transform_points(matrix, point),
+                                   expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+"""
+Checks that rotate_image.rotate_region gives the same pixels as cropping the
+output of rotate_image.rotate_image.
+
+The two are not bit-identical: rotate_region shifts the translation of the
+affine matrix by the crop origin, and warpAffine quantizes the sample
+positions to 1/32 of a pixel, so some positions round the other way. On
+smooth (photo-like) content that changes a pixel by at most one level. Next
+to the black fill around the rotated image the Lanczos kernel reaches into
+the fill and a few pixels differ more, and on white noise the kernel
+amplifies the rounding. The tolerances below are set from these cases.
+Rotations by multiples of 90 degrees sample whole pixels and are exact.
+
+    python -m unittest discover
+"""
+import unittest
+import numpy as np
+import cv2
+import rotate_image as rotate
+
+ANGLES = [-37.5, -5, 0.25, 12, 143]
+# max difference (levels) on smooth content, away from the fill
+INTERIOR_TOLERANCE = 1
+# share of all pixels of the region that may differ by more than
+# INTERIOR_TOLERANCE + 1 on smooth content (the ones next to the fill)
+EDGE_SHARE = 0.001
+# on white noise: max and mean difference
+NOISE_TOLERANCE = 16
+NOISE_MEAN_TOLERANCE = 0.2
+# pixels this close to the fill count as edge pixels
+EDGE_DISTANCE = 4
+
+
+def make_smooth_image(random_state, width=640, height=480):
+    blobs = random_state.randint(0, 256, size=(6, 8, 3)).astype(np.uint8)
+    return cv2.resize(blobs, (width, height), interpolation=cv2.INTER_CUBIC)
+
+
+def make_noise_image(random_state, width=640, height=480):
+    return random_state.randint(0, 256,
+                                size=(height, width, 3)).astype(np.uint8)
+
+
+def get_region(image, angle):
+    """
+    returns (upperleft, lowerright) of a region inside the rotated image that
+    includes part of the fill around it
+    """
+    height, width = rotate.get_rotated_size(image, angle)
+    return (width // 4, height // 3), (width // 2 + 17, height - 9)
+
+
+def get_expected(image, angle, upperleft, lowerright, flip):
+    """
+    the crop as done before rotate_region: flip and rotate the whole image,
+    then slice
+    """
+    if flip:
+        image = cv2.flip(image, 1)
+    return rotate.rotate_image(image, angle, cv2.INTER_AREA)[
+        upperleft[1]:lowerright[1], upperleft[0]:lowerright[0]]
+
+
+def get_interior(image, angle, upperleft, lowerright):
+    """
+    returns a mask of the region pixels at least EDGE_DISTANCE pixels away
+    from the fill around the rotated image
+    """
+    inside = np.full(image.shape[0:2], 255, dtype=np.uint8)
+    inside = rotate.rotate_image(inside, angle, cv2.INTER_AREA) == 255
+    size = 2 * EDGE_DISTANCE + 1
+    inside = cv2.erode(inside.astype(np.uint8), np.ones((size, size),
+                                                        dtype=np.uint8))
+    return inside[upperleft[1]:lowerright[1],
+                  upperleft[0]:lowerright[0]].astype(bool)
+
+
+def get_difference(expected, result):
+    """
+    returns the max difference over the channels of every pixel
+    """
+    difference = np.abs(expected.astype(np.int16) - result.astype(np.int16))
+    if difference.ndim == 3:
+        difference = difference.max(axis=2)
+    return difference
+
+
+class Rotate_region_test(unittest.TestCase):
+
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+
+    def test_smooth_image(self):
+        image = make_smooth_image(self.random_state)
+        for angle in ANGLES:
+            for flip in [False, True]:
+                upperleft, lowerright = get_region(image, angle)
+                expected = get_expected(image, angle, upperleft, lowerright,
+                                        flip)
+                result = rotate.rotate_region(image, angle, upperleft,
+                                              lowerright, flip)
+                self.assertEqual(expected.shape, result.shape)
+                difference = get_difference(expected, result)
+                interior = get_interior(image, angle, upperleft, lowerright)
+                self.assertLessEqual(difference[interior].max(),
+                                     INTERIOR_TOLERANCE,
+                                     (angle, flip))
+                self.assertLessEqual(
+                    (difference > INTERIOR_TOLERANCE + 1).mean(), EDGE_SHARE,
+                    (angle, flip))
+
+    def test_noise_image(self):
+        image = make_noise_image(self.random_state)
+        for angle in ANGLES:
+            for flip in [False, True]:
+                upperleft, lowerright = get_region(image, angle)
+                expected = get_expected(image, angle, upperleft, lowerright,
+                                        flip)
+                result = rotate.rotate_region(image, angle, upperleft,
+                                              lowerright, flip)
+                self.assertEqual(expected.shape, result.shape)
+                difference = get_difference(expected, result)
+                self.assertLessEqual(difference.max(), NOISE_TOLERANCE,
+                                     (angle, flip))
+                self.assertLessEqual(difference.mean(), NOISE_MEAN_TOLERANCE,
+                                     (angle, flip))
+
+    def test_right_angles_are_exact(self):
+        image = make_noise_image(self.random_state, 321, 240)
+        for angle in [0, 90, 180, -90]:
+            for flip in [False, True]:
+                upperleft, lowerright = get_region(image, angle)
+                expected = get_expected(image, angle, upperleft, lowerright,
+                                        flip)
+                result = rotate.rotate_region(image, angle, upperleft,
+                                              lowerright, flip)
+                self.assertTrue(np.array_equal(expected, result),
+                                (angle, flip))
+
+    def test_grayscale_image(self):
+        image = make_smooth_image(self.random_state)[:, :, 0].copy()
+        upperleft, lowerright = get_region(image, 12)
+        expected = get_expected(image, 12, upperleft, lowerright, False)
+        result = rotate.rotate_region(image, 12, upperleft, lowerright)
+        self.assertEqual(expected.shape, result.shape)
+        interior = get_interior(image, 12, upperleft, lowerright)
+        self.assertLessEqual(
+            get_difference(expected, result)[interior].max(),
+            INTERIOR_TOLERANCE)
+
+    def test_empty_and_inverted_regions(self):
+        image = make_smooth_image(self.random_state)
+        for upperleft, lowerright in [((50, 60), (50, 90)),
+                                      ((50, 60), (80, 60)),
+                                      ((80, 60), (50, 90)),
+                                      ((50, 90), (80, 60)),
+                                      ((80, 90), (50, 60))]:
+            for flip in [False, True]:
+                expected = get_expected(image, 12, upperleft, lowerright, flip)
+                result = rotate.rotate_region(image, 12, upperleft,
+                                              lowerright, flip)
+                self.assertEqual(expected.shape, result.shape,
+                                 (upperleft, lowerright))
+                self.assertEqual(result.dtype, image.dtype)
+                self.assertEqual(result.size, 0)
+
+    def test_rotated_size(self):
+        image = make_smooth_image(self.random_state, 300, 200)
+        for angle in ANGLES:
+            self.assertEqual(
+                rotate.get_rotated_size(image, angle),
+                rotate.rotate_image(image, angle, cv2.INTER_AREA).shape[0:2])
+
+
+if __name__ == '__main__':
+    unittest.main()